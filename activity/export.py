@@ -0,0 +1,183 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Export of the notifications, for the audits of the provenance.
+
+The notifications of a range are read day by day, oldest first, with the
+queries of the history, and written as they're read so an export of any size
+only holds a few rows in memory. Each record carries the cursor of its
+position: an interrupted export is resumed by passing the cursor of the last
+complete record, the export then continues right after it.
+"""
+
+import csv
+from datetime import timedelta
+import io
+import json
+
+from django.conf import settings
+
+from activity.history import (
+    FIELDS,
+    iter_day,
+    make_cursor,
+    parse_cursor,
+)
+
+
+# Number of records written in a chunk of the export
+EXPORT_CHUNK_SIZE = getattr(settings, "EXPORT_CHUNK_SIZE", 100)
+
+FORMAT_CSV = "csv"
+FORMAT_NDJSON = "ndjson"
+EXPORT_FORMATS = [FORMAT_NDJSON, FORMAT_CSV]
+
+CONTENT_TYPES = {
+    FORMAT_CSV: "text/csv",
+    FORMAT_NDJSON: "application/x-ndjson",
+}
+
+EXPORT_FIELDS = FIELDS + ["cursor"]
+
+
+def _csv_line(values):
+    """Format a line of CSV"""
+    buf = io.StringIO()
+    csv.writer(buf).writerow(values)
+    return buf.getvalue()
+
+
+def _load_payload(payload):
+    """Payloads are stored as JSON, they're exported as objects"""
+    if isinstance(payload, str):
+        try:
+            return json.loads(payload)
+        except ValueError:
+            return payload
+    return payload
+
+
+def _ndjson_line(record):
+    """Format a line of NDJSON"""
+    record = dict(record, payload=_load_payload(record["payload"]))
+    return json.dumps(record, default=str) + "\n"
+
+
+def _record(day, notif):
+    """Describe an exported notification, with its cursor"""
+    record = dict(notif, when=str(notif["when"]))
+    record["cursor"] = make_cursor(day, notif["when"])
+    return record
+
+
+def export(filters, since, until, fmt=FORMAT_NDJSON, cursor=None):
+    """
+    Generate the export of the notifications of a range.
+
+    :param filters: The values of the columns the notifications need to
+      have (sender, object_type, operation_name) and the prefix of their
+      path (path)
+    :type filters: dict
+    :param since: The first day of the range
+    :type since: :class:`datetime.date`
+    :param until: The last day of the range
+    :type until: :class:`datetime.date`
+    :param fmt: The format of the export (ndjson, csv)
+    :type fmt: str
+    :param cursor: The cursor of the last record already exported, the
+      header of a CSV export isn't written again
+    :type cursor: str
+
+    :return: The text of the export, in chunks
+    :rtype: generator
+    """
+    if fmt == FORMAT_CSV:
+        if not cursor:
+            yield _csv_line(EXPORT_FIELDS)
+
+        def format_record(record):
+            # The payload is written as JSON, a record stays on one line
+            payload = json.dumps(_load_payload(record["payload"]), default=str)
+            record = dict(record, payload=payload)
+            return _csv_line([record[field] for field in EXPORT_FIELDS])
+    else:
+        format_record = _ndjson_line
+
+    chunk = []
+    for day, notif in iter_notifications(filters, since, until, cursor):
+        chunk.append(format_record(_record(day, notif)))
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def iter_notifications(filters, since, until, cursor=None):
+    """
+    Iterate on the notifications of a range, oldest first.
+
+    :param filters: The values of the columns the notifications need to
+      have (sender, object_type, operation_name) and the prefix of their
+      path (path)
+    :type filters: dict
+    :param since: The first day of the range
+    :type since: :class:`datetime.date`
+    :param until: The last day of the range
+    :type until: :class:`datetime.date`
+    :param cursor: The cursor of the last notification already read
+    :type cursor: str
+
+    :return: The notifications, as tuples (day, notification)
+    :rtype: generator
+    """
+    after = None
+    day = since
+    if cursor:
+        cursor_day, after = parse_cursor(cursor)
+        if cursor_day < since:
+            after = None
+        else:
+            day = cursor_day
+    prefix = filters.get("path")
+    while day <= until:
+        for notif in iter_day(day, filters, after=after, ascending=True):
+            if prefix and not (notif["object_key"] or "").startswith(prefix):
+                continue
+            yield (day, notif)
+        day += timedelta(days=1)
+        after = None
+
+
+def last_cursor(line, fmt=FORMAT_NDJSON):
+    """
+    Read the cursor of a record of an export.
+
+    :param line: The line of the record
+    :type line: str
+    :param fmt: The format of the export (ndjson, csv)
+    :type fmt: str
+
+    :return: The cursor, None if the line isn't a record
+    :rtype: str
+    """
+    try:
+        if fmt == FORMAT_CSV:
+            values = next(csv.reader([line]))
+            if values == EXPORT_FIELDS:
+                return None
+            return values[EXPORT_FIELDS.index("cursor")]
+        return json.loads(line)["cursor"]
+    except (IndexError, KeyError, StopIteration, TypeError, ValueError):
+        return None
@@ -0,0 +1,215 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Rendering of the notifications in the activity feed.
+
+The row template is compiled once. The objects and the senders of the
+notifications of a page are looked up once each, in parallel, to link the
+ones which still exist. Payloads are truncated, only a short payload is
+parsed and formatted for its row, a longer one is cut before it's formatted.
+The whole payload of a notification is fetched by the browser when it's
+expanded.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import pprint
+
+from django import template
+from django.conf import settings
+from django.urls import reverse
+
+from radon.model.collection import Collection
+from radon.model.group import Group
+from radon.model.notification import (
+    OBJ_COLLECTION,
+    OBJ_GROUP,
+    OBJ_RESOURCE,
+    OBJ_USER,
+)
+from radon.model.resource import Resource
+from radon.model.user import User
+
+
+# Number of characters of a payload displayed before it's expanded
+ACTIVITY_PAYLOAD_CHARS = getattr(settings, "ACTIVITY_PAYLOAD_CHARS", 500)
+# Number of threads which look up the objects of a page
+ACTIVITY_WORKERS = getattr(settings, "ACTIVITY_WORKERS", 8)
+# Payloads longer than this in JSON aren't formatted for the rows, they'd be
+# truncated anyway and only their beginning is displayed
+PAYLOAD_FORMAT_CHARS = 4 * ACTIVITY_PAYLOAD_CHARS
+
+ACTIVITY_TMPL = """
+<tr>
+  <td>{{ when }}</td>
+  <td>{{ action }}</td>
+  <td>{{ action_type }}</td>
+  <td>{% if object_url %}<a href="{{ object_url }}">{{ object_key }}</a>{% else %}{{ object_key }}{% endif %}</td>
+  <td>{% if user_url %}<a href="{{ user_url }}">{{ user }}</a>{% else %}{{ user }}{% endif %}</td>
+  <td>
+    <pre class="activity-payload">{{ msg }}</pre>
+    {% if payload_url %}<a href="#" class="activity-expand" data-url="{{ payload_url }}">Show all</a>{% endif %}
+  </td>
+</tr>"""
+
+# Functions which find an object from its key, by type
+FINDERS = {
+    OBJ_COLLECTION: Collection.find,
+    OBJ_GROUP: Group.find,
+    OBJ_RESOURCE: Resource.find,
+    OBJ_USER: User.find,
+}
+# Views of the objects, with the name of the parameter of the key
+OBJECT_VIEWS = {
+    OBJ_COLLECTION: ("archive:view", "path"),
+    OBJ_GROUP: ("groups:view", "name"),
+    OBJ_RESOURCE: ("archive:resource_view", "path"),
+    OBJ_USER: ("users:view", "login"),
+}
+
+_pool = ThreadPoolExecutor(max_workers=ACTIVITY_WORKERS,
+                           thread_name_prefix="radon-activity")
+_row_template = None
+
+
+def _exists(obj_type, obj_key):
+    """Check if an object still exists, called in the pool"""
+    try:
+        return FINDERS[obj_type](obj_key) is not None
+    except Exception:
+        return False
+
+
+def _object_url(obj_type, obj_key):
+    """URL of the page of an object"""
+    name, param = OBJECT_VIEWS[obj_type]
+    return reverse(name, kwargs={param: obj_key})
+
+
+def find_objects(notifications):
+    """
+    Find which objects and senders of some notifications still exist. Each
+    object is looked up once.
+
+    :param notifications: The notifications
+    :type notifications: list
+
+    :return: The set of the (object type, key) which exist
+    :rtype: set
+    """
+    keys = set()
+    for notif in notifications:
+        obj_type = notif.get("object_type", "")
+        if obj_type in FINDERS and notif.get("object_key"):
+            keys.add((obj_type, notif["object_key"]))
+        if notif.get("sender"):
+            keys.add((OBJ_USER, notif["sender"]))
+    keys = list(keys)
+    found = _pool.map(lambda key: _exists(*key), keys)
+    return set(key for key, exists in zip(keys, found) if exists)
+
+
+def format_payload(payload):
+    """
+    Format the payload of a notification for display.
+
+    :param payload: The payload, as a dictionary or as JSON
+    :type payload: dict or str
+
+    :return: The formatted payload
+    :rtype: str
+    """
+    if isinstance(payload, str):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            return payload
+    return pprint.pformat(payload)
+
+
+def preview_payload(payload):
+    """
+    Format the beginning of the payload of a notification for its row. Long
+    payloads are cut before they're parsed and formatted.
+
+    :param payload: The payload, as a dictionary or as JSON
+    :type payload: dict or str
+
+    :return: A tuple (the formatted payload, at most ACTIVITY_PAYLOAD_CHARS
+      characters, True if it has been truncated)
+    :rtype: tuple
+    """
+    text = payload
+    if not isinstance(text, str):
+        text = json.dumps(payload, default=str)
+    if len(text) > PAYLOAD_FORMAT_CHARS:
+        return (text[:ACTIVITY_PAYLOAD_CHARS] + "...", True)
+    msg = format_payload(text)
+    if len(msg) > ACTIVITY_PAYLOAD_CHARS:
+        return (msg[:ACTIVITY_PAYLOAD_CHARS] + "...", True)
+    return (msg, False)
+
+
+def get_row_template():
+    """
+    Get the template of the rows of the feed, compiled on the first call.
+
+    :return: The compiled template
+    :rtype: :class:`django.template.Template`
+    """
+    global _row_template
+    if _row_template is None:
+        _row_template = template.Template(ACTIVITY_TMPL)
+    return _row_template
+
+
+def render_rows(notifications):
+    """
+    Render the rows of the activity feed.
+
+    :param notifications: The notifications
+    :type notifications: list
+
+    :return: The HTML of the rows
+    :rtype: list
+    """
+    notifications = list(notifications)
+    existing = find_objects(notifications)
+    tmpl = get_row_template()
+    res = []
+    for notif in notifications:
+        obj_type = notif.get("object_type", "")
+        obj_key = notif.get("object_key", "")
+        sender = notif.get("sender", "")
+        msg, truncated = preview_payload(notif.get("payload", {}))
+        payload_url = None
+        if truncated:
+            if notif.get("when"):
+                payload_url = reverse("activity:payload", kwargs={
+                    "date": notif["date"], "when": str(notif["when"])})
+        ctx = template.Context({
+            "when": notif.get("date", ""),
+            "action": notif.get("operation_name", "undefined"),
+            "action_type": notif.get("operation_type", "undefined"),
+            "object_key": obj_key or "undefined",
+            "object_url": (_object_url(obj_type, obj_key)
+                           if (obj_type, obj_key) in existing else None),
+            "user": sender or "undefined",
+            "user_url": (_object_url(OBJ_USER, sender)
+                         if (OBJ_USER, sender) in existing else None),
+            "msg": msg,
+            "payload_url": payload_url,
+        })
+        res.append(tmpl.render(ctx))
+    return res
@@ -0,0 +1,57 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django import forms
+
+from radon.model.notification import (
+    OBJ_COLLECTION,
+    OBJ_GROUP,
+    OBJ_RESOURCE,
+    OBJ_USER,
+    OP_CREATE,
+    OP_DELETE,
+    OP_UPDATE,
+)
+
+
+class ActivityFilterForm(forms.Form):
+    """The filters of the activity history"""
+
+    sender = forms.CharField(label="User", max_length=100, required=False)
+    object_type = forms.ChoiceField(
+        label="Type", required=False,
+        choices=[("", "Any type")] + [
+            (obj_type, obj_type)
+            for obj_type in [OBJ_COLLECTION, OBJ_RESOURCE, OBJ_USER, OBJ_GROUP]
+        ],
+    )
+    operation_name = forms.ChoiceField(
+        label="Operation", required=False,
+        choices=[("", "Any operation")] + [
+            (op_name, op_name) for op_name in [OP_CREATE, OP_UPDATE, OP_DELETE]
+        ],
+    )
+    path = forms.CharField(label="Path prefix", max_length=1024, required=False)
+    since = forms.DateField(label="From", required=False,
+                            widget=forms.DateInput(attrs={"type": "date"}))
+    until = forms.DateField(label="To", required=False,
+                            widget=forms.DateInput(attrs={"type": "date"}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        since = cleaned_data.get("since")
+        until = cleaned_data.get("until")
+        if since and until and since > until:
+            raise forms.ValidationError("The start of the range is after its end")
+        return cleaned_data
@@ -0,0 +1,228 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Paginated and filtered history of the notifications.
+
+Notifications are stored in one partition per day, ordered by their time
+uuid. A page is read from the most recent day of the range backwards, in
+slices of ACTIVITY_FETCH_SIZE rows older than the last one read, and a page
+reads at most ACTIVITY_SCAN_DAYS days. The days indexed by
+:mod:`activity.index` are read from the index partition of the most
+selective filter, the other filters being checked on the notifications
+found. The days which aren't indexed yet, the current one at least, are
+scanned: the sender, the type of object and the operation are filtered by
+the database inside the partition, the path prefix on the rows returned.
+
+A cursor gives the day and the uuid of the last notification of a page, the
+next page starts right after it.
+"""
+
+from datetime import date, timedelta
+import uuid
+
+from django.conf import settings
+
+from radon.model.notification import Notification
+
+from activity.index import (
+    index_filter,
+    is_indexed,
+    iter_indexed,
+)
+
+
+# Number of notifications of a page
+ACTIVITY_PAGE_SIZE = getattr(settings, "ACTIVITY_PAGE_SIZE", 20)
+# Number of days searched when the range has no start
+ACTIVITY_HISTORY_DAYS = getattr(settings, "ACTIVITY_HISTORY_DAYS", 365)
+# Maximum number of days read for a page, a page which isn't full gets a
+# cursor to continue with the previous days
+ACTIVITY_SCAN_DAYS = getattr(settings, "ACTIVITY_SCAN_DAYS", 31)
+# Number of rows read by a query
+ACTIVITY_FETCH_SIZE = getattr(settings, "ACTIVITY_FETCH_SIZE", 200)
+
+# Format of the partition key of the notifications
+DATE_FORMAT = "%y%m%d"
+
+# Columns filtered by the database, inside a partition
+COLUMN_FILTERS = ["sender", "object_type", "operation_name"]
+
+FIELDS = [
+    "date", "when", "operation_type", "operation_name", "object_type",
+    "object_key", "sender", "payload",
+]
+
+
+def _as_dict(notif):
+    """Describe a stored notification as a dictionary"""
+    return {field: getattr(notif, field, None) for field in FIELDS}
+
+
+def _matches(notif, columns):
+    """Check the values of the columns of a notification read from the
+    index"""
+    return all(getattr(notif, column, None) == value
+               for column, value in columns.items())
+
+
+def default_range(since=None, until=None):
+    """
+    Complete a date range.
+
+    :param since: The first day of the range
+    :type since: :class:`datetime.date`
+    :param until: The last day of the range
+    :type until: :class:`datetime.date`
+
+    :return: A tuple (first day, last day)
+    :rtype: tuple
+    """
+    if until is None:
+        # The day of the partitions may be ahead of the local date
+        until = date.today() + timedelta(days=1)
+    if since is None:
+        since = until - timedelta(days=ACTIVITY_HISTORY_DAYS)
+    return (since, until)
+
+
+def get_page(filters, since, until, cursor=None, size=ACTIVITY_PAGE_SIZE):
+    """
+    Get a page of the history, most recent first.
+
+    :param filters: The values of the columns the notifications need to
+      have (sender, object_type, operation_name) and the prefix of their
+      path (path)
+    :type filters: dict
+    :param since: The first day of the range
+    :type since: :class:`datetime.date`
+    :param until: The last day of the range
+    :type until: :class:`datetime.date`
+    :param cursor: The cursor returned with the previous page
+    :type cursor: str
+    :param size: The number of notifications of the page
+    :type size: int
+
+    :return: A tuple (list of notifications, cursor of the next page or None
+      at the end of the range)
+    :rtype: tuple
+    """
+    if cursor:
+        day, before = parse_cursor(cursor)
+        day = min(day, until)
+    else:
+        day, before = until, None
+    prefix = filters.get("path")
+    res = []
+    scanned = 0
+    while day >= since:
+        if scanned == ACTIVITY_SCAN_DAYS:
+            return (res, make_cursor(day))
+        for notif in iter_day(day, filters, before):
+            if prefix and not (notif["object_key"] or "").startswith(prefix):
+                continue
+            res.append(notif)
+            if len(res) == size:
+                return (res, make_cursor(day, notif["when"]))
+        day -= timedelta(days=1)
+        before = None
+        scanned += 1
+    return (res, None)
+
+
+def iter_day(day, filters, before=None, after=None, ascending=False):
+    """
+    Iterate on the notifications of a day, most recent first unless
+    ascending is set. The path prefix is left to the caller.
+
+    :param day: The day
+    :type day: :class:`datetime.date`
+    :param filters: The values of the columns the notifications need to have
+    :type filters: dict
+    :param before: Only return the notifications older than this time uuid
+    :type before: :class:`uuid.UUID`
+    :param after: Only return the notifications more recent than this time
+      uuid
+    :type after: :class:`uuid.UUID`
+    :param ascending: Return the oldest notifications first
+    :type ascending: bool
+
+    :return: The notifications as dictionaries
+    :rtype: generator
+    """
+    columns = {
+        column: filters[column] for column in COLUMN_FILTERS
+        if filters.get(column)
+    }
+    partition = day.strftime(DATE_FORMAT)
+    index = index_filter(filters)
+    if index is not None and is_indexed(partition):
+        for notif in iter_indexed(partition, index[0], index[1],
+                                  ACTIVITY_FETCH_SIZE, before, after,
+                                  ascending):
+            if _matches(notif, columns):
+                yield _as_dict(notif)
+        return
+    while True:
+        query = Notification.objects.filter(date=partition)
+        if columns:
+            query = query.filter(**columns).allow_filtering()
+        if before is not None:
+            query = query.filter(when__lt=before)
+        if after is not None:
+            query = query.filter(when__gt=after)
+        order = "when" if ascending else "-when"
+        rows = list(query.order_by(order).limit(ACTIVITY_FETCH_SIZE))
+        for row in rows:
+            yield _as_dict(row)
+        if len(rows) < ACTIVITY_FETCH_SIZE:
+            return
+        if ascending:
+            after = rows[-1].when
+        else:
+            before = rows[-1].when
+
+
+def make_cursor(day, when=None):
+    """
+    Build the cursor of a position in the history.
+
+    :param day: The day of the position
+    :type day: :class:`datetime.date`
+    :param when: The time uuid of the last notification read, None to start
+      with the most recent notification of the day
+    :type when: :class:`uuid.UUID`
+
+    :return: The cursor
+    :rtype: str
+    """
+    if when is None:
+        return day.strftime(DATE_FORMAT)
+    return "{}_{}".format(day.strftime(DATE_FORMAT), when)
+
+
+def parse_cursor(cursor):
+    """
+    Decode a cursor built by :func:`make_cursor`.
+
+    :param cursor: The cursor
+    :type cursor: str
+
+    :return: A tuple (day, time uuid or None)
+    :rtype: tuple
+    """
+    day, _, when = cursor.partition("_")
+    if len(day) != 6 or not day.isdigit():
+        raise ValueError("Invalid cursor")
+    day = date(2000 + int(day[:2]), int(day[2:4]), int(day[4:]))
+    return (day, uuid.UUID(when) if when else None)
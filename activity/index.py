@@ -0,0 +1,217 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Index of the notifications maintained by the web tier.
+
+The notifications are stored in a partition per day and can only be found
+by sender, operation, type or path by reading the partitions. The index
+has a partition per day and per value of these fields (each collection
+above the object for the path), with the time uuids of the notifications,
+most recent first. A filtered page of an indexed day reads the partition
+of the most selective filter, then the notifications by primary key.
+
+Days are indexed by the index_notifications command, once they are over,
+and recorded in a second table. The days which aren't indexed (the current
+day at least) are read from their partition with the filters applied by the
+database.
+"""
+
+import logging
+import time
+
+from cassandra.cqlengine import columns
+from cassandra.cqlengine.models import Model
+
+from radon.model.notification import Notification
+
+
+# Indexed fields, the most selective first
+INDEXED_FIELDS = ["path", "sender", "operation_name", "object_type"]
+
+# Number of seconds the index isn't used after a failed query (when the
+# tables haven't been created yet)
+INDEX_RETRY_DELAY = 60
+
+logger = logging.getLogger("radon")
+
+# Days known to be indexed, as partition keys
+_indexed_days = set()
+# Time of the last failed query
+_failed = 0
+
+
+class NotificationIndex(Model):
+    """Time uuids of the notifications of a day which have a value for a
+    field"""
+
+    __table_name__ = "notification_index"
+
+    field = columns.Text(partition_key=True)
+    value = columns.Text(partition_key=True)
+    date = columns.Text(partition_key=True)
+    when = columns.TimeUUID(primary_key=True, clustering_order="DESC")
+
+
+class IndexedDay(Model):
+    """The days whose notifications have all been indexed"""
+
+    __table_name__ = "notification_indexed_day"
+
+    date = columns.Text(primary_key=True)
+
+
+def _path_keys(key):
+    """Index values of the path of an object: the collections above it, and
+    the object if it's a collection. The root isn't indexed, it doesn't
+    select anything."""
+    if not key or not key.startswith("/"):
+        return []
+    res = []
+    path = "/"
+    for name in key.split("/")[1:-1]:
+        path += name + "/"
+        res.append(path)
+    return res
+
+
+def index_filter(filters):
+    """
+    Choose the indexed field used to read a filtered day.
+
+    :param filters: The values of the columns the notifications need to
+      have (sender, object_type, operation_name) and the prefix of their
+      path (path)
+    :type filters: dict
+
+    :return: A tuple (field, value), None if no filter is indexed
+    :rtype: tuple
+    """
+    for field in INDEXED_FIELDS:
+        value = filters.get(field)
+        if not value:
+            continue
+        if field == "path":
+            # The collection which contains the prefix, the rest of the
+            # prefix is checked on the notifications
+            if not value.startswith("/"):
+                continue
+            value = value[:value.rfind("/") + 1]
+            if value == "/":
+                continue
+        return (field, value)
+    return None
+
+
+def index_notification(notif):
+    """
+    Add a notification to the index.
+
+    :param notif: The notification
+    :type notif: dict
+    """
+    values = [("path", path) for path in _path_keys(notif.get("object_key"))]
+    for field in INDEXED_FIELDS[1:]:
+        if notif.get(field):
+            values.append((field, notif[field]))
+    for field, value in values:
+        NotificationIndex.create(field=field, value=value,
+                                 date=notif["date"], when=notif["when"])
+
+
+def is_indexed(day):
+    """
+    Check if the notifications of a day have been indexed.
+
+    :param day: The partition key of the day
+    :type day: str
+
+    :return: True if the index can be used for the day
+    :rtype: bool
+    """
+    global _failed
+    if day in _indexed_days:
+        return True
+    if time.time() - _failed < INDEX_RETRY_DELAY:
+        return False
+    try:
+        found = IndexedDay.objects.filter(date=day).first() is not None
+    except Exception:
+        logger.warning("The index of the notifications can't be read, run "
+                       "the index_notifications command to create it")
+        _failed = time.time()
+        return False
+    if found:
+        _indexed_days.add(day)
+    return found
+
+
+def iter_indexed(day, field, value, fetch_size, before=None, after=None,
+                 ascending=False):
+    """
+    Iterate on the notifications of a day which have a value for an indexed
+    field, most recent first unless ascending is set.
+
+    :param day: The partition key of the day
+    :type day: str
+    :param field: The indexed field
+    :type field: str
+    :param value: The value of the field
+    :type value: str
+    :param fetch_size: The number of notifications read by a query
+    :type fetch_size: int
+    :param before: Only return the notifications older than this time uuid
+    :type before: :class:`uuid.UUID`
+    :param after: Only return the notifications more recent than this time
+      uuid
+    :type after: :class:`uuid.UUID`
+    :param ascending: Return the oldest notifications first
+    :type ascending: bool
+
+    :return: The stored notifications
+    :rtype: generator
+    """
+    while True:
+        query = NotificationIndex.objects.filter(field=field, value=value,
+                                                 date=day)
+        if before is not None:
+            query = query.filter(when__lt=before)
+        if after is not None:
+            query = query.filter(when__gt=after)
+        order = "when" if ascending else "-when"
+        whens = [row.when for row in query.order_by(order).limit(fetch_size)]
+        if whens:
+            found = {
+                notif.when: notif for notif in
+                Notification.objects.filter(date=day, when__in=whens)
+            }
+            for when in whens:
+                if when in found:
+                    yield found[when]
+        if len(whens) < fetch_size:
+            return
+        if ascending:
+            after = whens[-1]
+        else:
+            before = whens[-1]
+
+
+def mark_indexed(day):
+    """
+    Record that the notifications of a day have all been indexed.
+
+    :param day: The partition key of the day
+    :type day: str
+    """
+    IndexedDay.create(date=day)
+    _indexed_days.add(day)
@@ -0,0 +1,141 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import date
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from activity.export import (
+    EXPORT_FORMATS,
+    FORMAT_CSV,
+    FORMAT_NDJSON,
+    export,
+    last_cursor,
+)
+from activity.history import (
+    default_range,
+    parse_cursor,
+)
+
+
+# Size of the blocks read to find the last record of a file
+BLOCK_SIZE = 4096
+
+
+def _parse_date(value):
+    """Dates of the options are given as YYYY-MM-DD"""
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError("Invalid date: {}".format(value))
+
+
+def _resume_position(path, fmt):
+    """Find the cursor of the last complete record of an export. A record
+    which was only partly written is removed from the file"""
+    with open(path, "rb+") as fp:
+        end = fp.seek(0, os.SEEK_END)
+        tail = b""
+        pos = end
+        # Read backwards until the last complete line is found
+        while pos > 0 and tail.count(b"\n") < 2:
+            size = min(BLOCK_SIZE, pos)
+            pos -= size
+            fp.seek(pos)
+            tail = fp.read(size) + tail
+        if not tail.endswith(b"\n"):
+            # Partial record, cut after the last complete one
+            cut = tail.rfind(b"\n") + 1
+            fp.truncate(pos + cut)
+            tail = tail[:cut]
+        lines = tail.decode("utf-8").splitlines()
+    if not lines:
+        return None
+    return last_cursor(lines[-1], fmt)
+
+
+class Command(BaseCommand):
+    """Write the notifications of a range to a file or to the standard
+    output, oldest first"""
+
+    help = "Export the notifications as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=EXPORT_FORMATS,
+                            default=FORMAT_NDJSON,
+                            help="Format of the export")
+        parser.add_argument("--since", type=_parse_date,
+                            help="First day of the range (YYYY-MM-DD)")
+        parser.add_argument("--until", type=_parse_date,
+                            help="Last day of the range (YYYY-MM-DD)")
+        parser.add_argument("--path", default="",
+                            help="Prefix of the paths of the objects")
+        parser.add_argument("--sender", default="",
+                            help="User who sent the notifications")
+        parser.add_argument("--object-type", default="",
+                            help="Type of the objects")
+        parser.add_argument("--operation", default="",
+                            help="Name of the operations")
+        parser.add_argument("--cursor",
+                            help="Cursor of the last record already exported")
+        parser.add_argument("--output",
+                            help="File written, the standard output by default")
+        parser.add_argument("--resume", action="store_true",
+                            help="Continue the export of the output file "
+                                 "after its last record")
+
+    def handle(self, *args, **options):
+        fmt = options["format"]
+        since, until = default_range(options["since"], options["until"])
+        if since > until:
+            raise CommandError("The start of the range is after its end")
+        filters = {
+            "sender": options["sender"],
+            "object_type": options["object_type"],
+            "operation_name": options["operation"],
+            "path": options["path"],
+        }
+        cursor = options["cursor"]
+        output = options["output"]
+        mode = "w"
+        if options["resume"]:
+            if not output:
+                raise CommandError("--resume needs an --output file")
+            if os.path.exists(output):
+                cursor = _resume_position(output, fmt) or cursor
+                mode = "a"
+        if cursor:
+            try:
+                parse_cursor(cursor)
+            except ValueError:
+                raise CommandError("Invalid cursor: {}".format(cursor))
+        # A CSV file which is continued already has its header
+        skip_header = (fmt == FORMAT_CSV and not cursor and mode == "a" and
+                       os.path.getsize(output) > 0)
+
+        if output:
+            fp = open(output, mode, encoding="utf-8", newline="")
+        else:
+            fp = self.stdout
+        try:
+            chunks = export(filters, since, until, fmt, cursor)
+            if skip_header:
+                next(chunks, None)
+            for chunk in chunks:
+                fp.write(chunk)
+                fp.flush()
+        finally:
+            if output:
+                fp.close()
@@ -0,0 +1,78 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import date, timedelta
+
+from cassandra.cqlengine.management import sync_table
+from django.core.management.base import BaseCommand, CommandError
+
+from activity.history import (
+    ACTIVITY_HISTORY_DAYS,
+    DATE_FORMAT,
+    iter_day,
+)
+from activity.index import (
+    IndexedDay,
+    NotificationIndex,
+    index_notification,
+    is_indexed,
+    mark_indexed,
+)
+
+
+def _parse_date(value):
+    """Dates of the options are given as YYYY-MM-DD"""
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError("Invalid date: {}".format(value))
+
+
+class Command(BaseCommand):
+    """Index the notifications of the days which are over, the history uses
+    the index for these days. It's meant to be run every day."""
+
+    help = "Index the notifications by sender, path, operation and type"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", type=_parse_date,
+                            help="First day indexed (YYYY-MM-DD)")
+        parser.add_argument("--until", type=_parse_date,
+                            help="Last day indexed (YYYY-MM-DD), yesterday "
+                                 "by default")
+        parser.add_argument("--force", action="store_true",
+                            help="Index again the days already indexed")
+
+    def handle(self, *args, **options):
+        # A day which isn't over can't be marked as indexed
+        last = date.today() - timedelta(days=1)
+        until = min(options["until"] or last, last)
+        since = options["since"] or until - timedelta(days=ACTIVITY_HISTORY_DAYS)
+        if since > until:
+            raise CommandError("The start of the range is after its end")
+        sync_table(NotificationIndex)
+        sync_table(IndexedDay)
+
+        day = since
+        while day <= until:
+            partition = day.strftime(DATE_FORMAT)
+            if options["force"] or not is_indexed(partition):
+                count = 0
+                for notif in iter_day(day, {}, ascending=True):
+                    index_notification(notif)
+                    count += 1
+                mark_indexed(partition)
+                self.stdout.write("{}: {} notifications".format(
+                    day.isoformat(), count))
+            day += timedelta(days=1)
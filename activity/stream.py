@@ -0,0 +1,217 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Live stream of the activity, sent to the browsers as Server-Sent Events.
+
+The notifications received by the listener of the worker are queued and
+rendered once by a broadcaster thread, which hands the rows to the clients
+whose filters match. Each client has a bounded queue: a client which doesn't
+read fast enough loses its oldest rows, and is told how many it has lost,
+instead of slowing down the others.
+
+Each client holds a thread of the server for as long as it's connected, so
+the number of clients of a worker stays below the number of its threads, and
+a connection is closed after ACTIVITY_STREAM_MAX_AGE seconds: the browser
+connects again after the retry delay, possibly to a less busy worker.
+"""
+
+from datetime import datetime
+import json
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+from activity.feed import render_rows
+from activity.history import DATE_FORMAT
+from project import listener
+
+
+# Number of rows kept for a client which doesn't read them
+ACTIVITY_STREAM_QUEUE = getattr(settings, "ACTIVITY_STREAM_QUEUE", 100)
+# Number of seconds between two comments sent to keep a connection open
+ACTIVITY_STREAM_KEEPALIVE = getattr(settings, "ACTIVITY_STREAM_KEEPALIVE", 15)
+# Number of threads of a worker, as set in gunicorn.conf
+SERVER_THREADS = getattr(settings, "SERVER_THREADS",
+                         multiprocessing.cpu_count() * 2 + 1)
+# Number of threads of a worker which are never used by the stream
+ACTIVITY_STREAM_RESERVED_THREADS = getattr(
+    settings, "ACTIVITY_STREAM_RESERVED_THREADS", 4)
+# Maximum number of clients of a worker
+ACTIVITY_STREAM_MAX_CLIENTS = getattr(
+    settings, "ACTIVITY_STREAM_MAX_CLIENTS",
+    max(SERVER_THREADS - ACTIVITY_STREAM_RESERVED_THREADS, 1))
+# Number of seconds a connection is kept open before the client is asked to
+# connect again
+ACTIVITY_STREAM_MAX_AGE = getattr(settings, "ACTIVITY_STREAM_MAX_AGE", 300)
+
+# Number of notifications waiting to be rendered
+INCOMING_QUEUE = 1000
+# Milliseconds a browser waits before it connects again
+RETRY_DELAY = 5000
+
+logger = logging.getLogger("radon")
+
+_lock = threading.Lock()
+_clients = set()
+_incoming = queue.Queue(maxsize=INCOMING_QUEUE)
+_broadcaster = None
+
+
+class StreamClient():
+    """A browser connected to the stream, with its filters"""
+
+    def __init__(self, filters):
+        self.filters = filters
+        self.rows = queue.Queue(maxsize=ACTIVITY_STREAM_QUEUE)
+        self.dropped = 0
+
+    def matches(self, notif):
+        """
+        Check a notification against the filters of the client.
+
+        :param notif: The notification
+        :type notif: dict
+
+        :return: True if the client wants this notification
+        :rtype: bool
+        """
+        for field in ["sender", "object_type", "operation_name"]:
+            if self.filters.get(field) and notif.get(field) != self.filters[field]:
+                return False
+        prefix = self.filters.get("path")
+        return not prefix or (notif.get("object_key") or "").startswith(prefix)
+
+    def push(self, row):
+        """
+        Queue a row, dropping the oldest one if the queue is full.
+
+        :param row: The HTML of the row
+        :type row: str
+        """
+        while True:
+            try:
+                self.rows.put_nowait(row)
+                return
+            except queue.Full:
+                try:
+                    self.rows.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+def _broadcast():
+    """Render each notification once and hand it to the clients"""
+    while True:
+        notif = _incoming.get()
+        with _lock:
+            clients = [client for client in _clients if client.matches(notif)]
+        if not clients:
+            continue
+        try:
+            row = render_rows([notif])[0]
+        except Exception:
+            logger.exception("Unable to render a notification for the stream")
+            continue
+        for client in clients:
+            client.push(row)
+
+
+def _on_notification(notif):
+    """Queue a notification for the broadcaster, it's called from the thread
+    of the listener so it never blocks"""
+    if not _clients:
+        return
+    notif = dict(notif, date=datetime.now().strftime(DATE_FORMAT))
+    try:
+        _incoming.put_nowait(notif)
+    except queue.Full:
+        logger.warning("Activity stream overloaded, a notification is dropped")
+
+
+def events(client):
+    """
+    Generate the events sent to a client, until the connection is closed or
+    is older than ACTIVITY_STREAM_MAX_AGE seconds.
+
+    :param client: The client returned by :func:`subscribe`
+    :type client: :class:`StreamClient`
+
+    :return: The text of the events
+    :rtype: generator
+    """
+    deadline = time.monotonic() + ACTIVITY_STREAM_MAX_AGE
+    try:
+        yield "retry: {}\n\n".format(RETRY_DELAY)
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                # The browser connects again after the retry delay
+                return
+            try:
+                row = client.rows.get(
+                    timeout=min(ACTIVITY_STREAM_KEEPALIVE, left))
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if client.dropped:
+                dropped, client.dropped = client.dropped, 0
+                yield "event: gap\ndata: {}\n\n".format(dropped)
+            yield "event: activity\ndata: {}\n\n".format(json.dumps({"html": row}))
+    finally:
+        unsubscribe(client)
+
+
+def subscribe(filters):
+    """
+    Connect a client to the stream.
+
+    :param filters: The values of the fields the notifications need to have
+      (sender, object_type, operation_name) and the prefix of their path
+      (path)
+    :type filters: dict
+
+    :return: The client, None if the worker already has too many clients
+    :rtype: :class:`StreamClient`
+    """
+    global _broadcaster
+    client = StreamClient(filters)
+    with _lock:
+        if len(_clients) >= ACTIVITY_STREAM_MAX_CLIENTS:
+            return None
+        _clients.add(client)
+        if _broadcaster is None:
+            _broadcaster = threading.Thread(target=_broadcast,
+                                            name="radon-activity-stream",
+                                            daemon=True)
+            _broadcaster.start()
+    return client
+
+
+def unsubscribe(client):
+    """
+    Disconnect a client from the stream.
+
+    :param client: The client returned by :func:`subscribe`
+    :type client: :class:`StreamClient`
+    """
+    with _lock:
+        _clients.discard(client)
+
+
+listener.register(_on_notification)
@@ -16,11 +16,17 @@
 from django.urls import path
 
 from activity.views import (
+    export_notifications,
     home,
+    payload,
+    stream,
 )
 
 app_name = "activity"
 
 urlpatterns = [
     path("", home, name="home"),
+    path("export", export_notifications, name="export"),
+    path("payload/<str:date>/<str:when>", payload, name="payload"),
+    path("stream", stream, name="stream"),
 ]
@@ -12,172 +12,145 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import pprint
-from django import template
-from django.shortcuts import render
+import re
+import uuid
+
 from django.contrib.auth.decorators import login_required
-from radon.model.collection import Collection
-from radon.model.group import Group
+from django.core.exceptions import PermissionDenied
+from django.http import (
+    Http404,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import render
+
 from radon.model.notification import Notification
-from radon.model.resource import Resource
-from radon.model.user import User
-from radon.model.notification import (
-    OP_CREATE,
-    OP_DELETE,
-    OP_UPDATE,
-    OBJ_RESOURCE,
-    OBJ_COLLECTION,
-    OBJ_USER,
-    OBJ_GROUP,
+
+from activity.export import (
+    CONTENT_TYPES,
+    EXPORT_FORMATS,
+    FORMAT_NDJSON,
+    export,
+)
+from activity.feed import (
+    format_payload,
+    render_rows,
+)
+from activity.forms import ActivityFilterForm
+from activity.history import (
+    default_range,
+    get_page,
+    parse_cursor,
+)
+from activity.stream import (
+    events,
+    subscribe,
 )
 
-ACTIVITY_TMPL = """
-<tr>
-  <td>{when}</td>
-  <td>{action}</td>
-  <td>{action_type}</td>
-  <td>{object_key}</td>
-  <td>{user}</td>
-  <td><pre>{msg}</pre></td>
-</tr>"""
-
-
-def get_coll_obj_dict(obj_key):
-    """
-    Get a dictionary which describes a collection object. If not found returns
-    a minimal description.
-    
-    :param obj_key: The key of the object in Cassandra (path)
-    :type obj_key: str
-    
-    :return: A dictionary with collection fields
-    :rtype: dict
-    """
-    obj = Collection.find(obj_key)
-    if obj:
-        return obj.to_dict()
-    else:
-        return {"name": obj_key}
-
-
-def get_group_obj_dict(obj_key, op_name, payload):
-    """
-    Get a dictionary which describes a group object. If not found try to find the
-    name in the payload or return a minimal description.
-    
-    :param obj_key: The key of the object in Cassandra (name)
-    :type obj_key: str
-    
-    :return: A dictionary with group fields
-    :rtype: dict
-    """
-    obj = Group.find(obj_key)
-    if obj:
-        return obj.to_dict()
-    else:
-        # User has been deleted it can't be find by uuid
-        # look in payload of the message to get the name
-        name="ERROR"
-        try:
-            if op_name in [OP_CREATE, OP_DELETE]:
-                name = payload["obj"]["name"]
-            elif op_name in [OP_UPDATE]:
-                name = payload["pre"]["name"]
-        except KeyError:
-            pass
-        return {"name": name}
-
-
-def get_resc_obj_dict(obj_key):
-    """
-    Get a dictionary which describes a resource object. If not found returns
-    a minimal description.
-    
-    :param obj_key: The key of the object in Cassandra (path)
-    :type obj_key: str
-    
-    :return: A dictionary with resource fields
-    :rtype: dict
-    """
-    obj = Resource.find(obj_key)
-    if obj:
-        return obj.to_dict()
-    else:
-        return {"name": obj_key}
-
-
-def get_user_obj_dict(obj_key, op_name, payload):
-    """
-    Get a dictionary which describes a user object. If not found try to find the
-    name in the payload or return a minimal description.
-    
-    :param obj_key: The key of the object in Cassandra (login)
-    :type obj_key: str
-    
-    :return: A dictionary with user fields
-    :rtype: dict
-    """
-    obj = User.find(obj_key)
-    if obj:
-        return obj.to_dict()
-    else:
-        # User has been deleted it can't be find by uuid
-        # look in payload of the message to get the name
-        name="ERROR"
+
+DATE_RE = re.compile(r"^[0-9]{6}$")
+
+FILTER_FIELDS = ["sender", "object_type", "operation_name", "path"]
+
+
+@login_required
+def export_notifications(request):
+    """Export the notifications of a range as NDJSON or CSV, with the same
+    filters as the history. An interrupted export is resumed with the cursor
+    of the last record received"""
+    if not request.user.administrator:
+        raise PermissionDenied
+    fmt = request.GET.get("format", FORMAT_NDJSON)
+    if fmt not in EXPORT_FORMATS:
+        return HttpResponse("Invalid format", status=400)
+    form = ActivityFilterForm(request.GET)
+    if not form.is_valid():
+        return HttpResponse("Invalid filters", status=400)
+    cursor = request.GET.get("cursor") or None
+    if cursor:
         try:
-            if op_name in [OP_CREATE, OP_DELETE]:
-                name = payload["obj"]["login"]
-            elif op_name in [OP_UPDATE]:
-                name = payload["pre"]["login"]
-        except KeyError:
-            pass
-        return {"name": name}
+            parse_cursor(cursor)
+        except ValueError:
+            return HttpResponse("Invalid cursor", status=400)
+    filters = {field: form.cleaned_data[field] for field in FILTER_FIELDS}
+    since, until = default_range(form.cleaned_data["since"],
+                                 form.cleaned_data["until"])
+    resp = StreamingHttpResponse(export(filters, since, until, fmt, cursor),
+                                 content_type=CONTENT_TYPES[fmt])
+    filename = "notifications_{}_{}.{}".format(since.isoformat(),
+                                               until.isoformat(), fmt)
+    resp["Content-Disposition"] = 'attachment; filename="{}"'.format(filename)
+    resp["X-Accel-Buffering"] = "no"
+    return resp
 
 
 @login_required
 def home(request):
-    """Default view for Activities"""    
-    notifications = Notification.recent(20)
-    activities = []
-    for notif in notifications:
-        obj_key = notif.get("object_key", "")
-        obj_type = notif.get("object_type", "")
-        op_name = notif.get("operation_name", "")
-        payload = notif.get("payload", {})
-
-        if obj_type == OBJ_RESOURCE:
-            object_dict = get_resc_obj_dict(obj_key)
-        elif obj_type == OBJ_COLLECTION:
-            object_dict = get_coll_obj_dict(obj_key)
-        elif obj_type == OBJ_USER:
-            object_dict = get_user_obj_dict(obj_key, op_name, payload)
-        elif obj_type == OBJ_GROUP:
-            object_dict = get_group_obj_dict(obj_key, op_name, payload)
-
-        user_dict = {}
-        if notif["sender"]:
-            user = User.find(notif["sender"])
-            if user:
-                user_dict = user.to_dict()
-            else:
-                user_dict = { 'name': notif["sender"], 
-                              'email': notif["sender"]+ '@radon.org' }
-        
-        # Create the line 
-        tmpl_str = ACTIVITY_TMPL.format(
-            when=notif['date'],
-            action=notif.get("operation_name", "undefined"),
-            action_type=notif.get("operation_type", "undefined"),
-            object_key=notif.get("object_key", "undefined"),
-            user=notif.get("sender", "undefined"),
-            msg=pprint.pformat(payload))
-        
-        tmpl = template.Template(tmpl_str)
-        variables = {"user": user_dict, "when": notif["when"], "object": object_dict}
-        ctx = template.Context(variables)
-        activities.append({"html": tmpl.render(ctx)})
-
-    return render(request, "activity/index.html", {"activities": activities})
+    """Default view for Activities, a page of the history which can be
+    filtered"""
+    form = ActivityFilterForm(request.GET)
+    filters = {}
+    since = until = None
+    if form.is_valid():
+        filters = {field: form.cleaned_data[field] for field in FILTER_FIELDS}
+        since = form.cleaned_data["since"]
+        until = form.cleaned_data["until"]
+    # New notifications are streamed on the first page of an open range
+    live = until is None and not request.GET.get("cursor")
+    since, until = default_range(since, until)
+    cursor = request.GET.get("cursor")
+    try:
+        notifications, next_cursor = get_page(filters, since, until, cursor)
+    except ValueError:
+        # Invalid cursor, start again from the most recent notifications
+        cursor = None
+        notifications, next_cursor = get_page(filters, since, until)
+
+    params = request.GET.copy()
+    params.pop("cursor", None)
+    ctx = {
+        "activities": [{"html": html} for html in render_rows(notifications)],
+        "form": form,
+        "params": params.urlencode(),
+        "cursor": cursor,
+        "next_cursor": next_cursor,
+        "live": live,
+    }
+    return render(request, "activity/index.html", ctx)
+
 
+@login_required
+def payload(request, date, when):
+    """Return the whole payload of a notification, when a truncated payload
+    is expanded"""
+    try:
+        when = uuid.UUID(when)
+    except ValueError:
+        raise Http404
+    if not DATE_RE.match(date):
+        raise Http404
+    notif = Notification.objects.filter(date=date, when=when).first()
+    if not notif:
+        raise Http404
+    return JsonResponse({"payload": format_payload(notif.payload)})
 
 
+@login_required
+def stream(request):
+    """Send the new notifications as Server-Sent Events, with the same
+    filters as the history"""
+    form = ActivityFilterForm(request.GET)
+    filters = {}
+    if form.is_valid():
+        filters = {field: form.cleaned_data[field] for field in FILTER_FIELDS}
+    client = subscribe(filters)
+    if client is None:
+        resp = HttpResponse("Too many connections", status=503)
+        resp["Retry-After"] = "30"
+        return resp
+    resp = StreamingHttpResponse(events(client), content_type="text/event-stream")
+    resp["Cache-Control"] = "no-cache"
+    # Proxies mustn't buffer the events
+    resp["X-Accel-Buffering"] = "no"
+    return resp
@@ -0,0 +1,366 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Bulk updates of the objects of a selection or of a collection subtree.
+
+The objects are listed by walking the tree breadth first and processed in
+batches, by background jobs: the objects of a batch are read and their new
+state is computed by a pool of threads shared by all the jobs, then the
+update requests of the batch are all sent before their responses are
+awaited. Objects which wouldn't change aren't updated.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+from functools import partial
+import time
+
+from django.conf import settings
+
+from radon.model.collection import Collection
+from radon.model.notification import (
+    update_collection_request,
+    update_resource_request,
+    wait_response,
+)
+from radon.model.payload import (
+    PayloadUpdateCollectionRequest,
+    PayloadUpdateResourceRequest,
+)
+from radon.model.resource import Resource
+
+from project.acl import user_can
+
+
+# Number of threads which read the objects, shared by all the bulk jobs
+BULK_WORKERS = getattr(settings, "BULK_WORKERS", 8)
+# Number of update requests sent before their responses are awaited
+BULK_BATCH_SIZE = getattr(settings, "BULK_BATCH_SIZE", 100)
+# Number of seconds waited between two batches, to limit the load of a job
+BULK_BATCH_DELAY = getattr(settings, "BULK_BATCH_DELAY", 0)
+
+# Operations on the metadata
+OP_SET = "set"
+OP_ADD = "add"
+OP_REMOVE = "remove"
+METADATA_OPERATIONS = [OP_SET, OP_ADD, OP_REMOVE]
+
+# Types of objects a bulk operation applies to
+TARGET_ALL = "all"
+TARGET_COLLECTIONS = "collections"
+TARGET_RESOURCES = "resources"
+TARGETS = [TARGET_ALL, TARGET_COLLECTIONS, TARGET_RESOURCES]
+
+_pool = ThreadPoolExecutor(max_workers=BULK_WORKERS,
+                           thread_name_prefix="radon-bulk")
+
+
+class BulkError(Exception):
+    """An object which can't be updated"""
+
+
+def _acl_changes(read_access, write_access, obj):
+    """Compute the new ACL of an object, None if it already matches"""
+    current_read, current_write = obj.get_acl_list()
+    if (sorted(current_read) == sorted(read_access) and
+            sorted(current_write) == sorted(write_access)):
+        return None
+    return {
+        "metadata": obj.get_cdmi_user_meta() or {},
+        "read_access": read_access,
+        "write_access": write_access,
+    }
+
+
+def _as_list(value):
+    """Values of a metadata field can be a single value or a list"""
+    if isinstance(value, list):
+        return list(value)
+    return [value]
+
+
+def _from_list(values):
+    """Store a single value as it is"""
+    return values[0] if len(values) == 1 else values
+
+
+def _metadata_changes(operation, changes, conditions, obj):
+    """Compute the new metadata of an object"""
+    current = obj.get_cdmi_user_meta() or {}
+    if conditions and not match_metadata(current, conditions):
+        return None
+    metadata = edit_metadata(current, operation, changes)
+    if metadata == current:
+        return None
+    read_access, write_access = obj.get_acl_list()
+    return {
+        "metadata": metadata,
+        "read_access": read_access,
+        "write_access": write_access,
+    }
+
+
+def _prepare(path, is_collection, update, user):
+    """Read an object and compute its update, called in the pool"""
+    if is_collection:
+        obj = Collection.find(path)
+    else:
+        obj = Resource.find(path)
+    if not obj:
+        raise BulkError("The object doesn't exist anymore")
+    if not user_can(obj, user, "edit"):
+        raise BulkError("Permission denied")
+    return update(obj)
+
+
+def _update_batch(job, batch, update, user):
+    """Update a batch of objects"""
+    job.add_total(len(batch))
+    futures = [
+        _pool.submit(_prepare, path, is_collection, update, user)
+        for path, is_collection in batch
+    ]
+    requests = []
+    for (path, is_collection), future in zip(batch, futures):
+        try:
+            changes = future.result()
+        except Exception as exc:
+            job.error(path, str(exc))
+            continue
+        if changes is None:
+            job.advance(skipped=1)
+            continue
+        payload_json = {
+            "obj": dict(changes, path=path),
+            "meta": {"sender": user.login},
+        }
+        if is_collection:
+            notif = update_collection_request(
+                PayloadUpdateCollectionRequest(payload_json))
+        else:
+            notif = update_resource_request(
+                PayloadUpdateResourceRequest(payload_json))
+        requests.append((path, notif.req_id))
+    for path, req_id in requests:
+        resp = wait_response(req_id)
+        if resp == 0:
+            job.advance()
+        else:
+            job.error(path, "The update has failed" if resp == 1
+                      else "The update is still pending")
+
+
+def apply_updates(job, objects, update, user):
+    """
+    Update objects in batches.
+
+    :param job: The job which reports the progress
+    :type job: :class:`project.jobs.Job`
+    :param objects: The objects to update, as (path, is a collection)
+    :type objects: iterable
+    :param update: A function called with an object which returns the
+      fields of the update request (metadata, read_access, write_access),
+      or None if the object doesn't have to be updated
+    :type update: function
+    :param user: The user who updates the objects, an object they can't
+      edit isn't updated
+    :type user: :class:`radon.model.user.User`
+    """
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) == BULK_BATCH_SIZE:
+            _update_batch(job, batch, update, user)
+            batch = []
+            if BULK_BATCH_DELAY:
+                time.sleep(BULK_BATCH_DELAY)
+    if batch:
+        _update_batch(job, batch, update, user)
+
+
+def edit_metadata(current, operation, changes):
+    """
+    Apply an operation to a metadata dictionary.
+
+    :param current: The metadata of an object
+    :type current: dict
+    :param operation: "set" replaces the values of the fields, "add" adds
+      values to the fields, "remove" removes the given values from the fields
+      or the whole fields when the value is empty
+    :type operation: str
+    :param changes: The fields and values of the operation
+    :type changes: dict
+
+    :return: The new metadata
+    :rtype: dict
+    """
+    metadata = dict(current)
+    for key, value in changes.items():
+        if operation == OP_SET:
+            metadata[key] = value
+        elif operation == OP_ADD:
+            values = _as_list(metadata.get(key, []))
+            values += [val for val in _as_list(value) if val not in values]
+            metadata[key] = _from_list(values)
+        elif operation == OP_REMOVE and key in metadata:
+            if value in ["", None, []]:
+                del metadata[key]
+                continue
+            removed = _as_list(value)
+            values = [val for val in _as_list(metadata[key])
+                      if val not in removed]
+            if values:
+                metadata[key] = _from_list(values)
+            else:
+                del metadata[key]
+    return metadata
+
+
+def match_metadata(metadata, conditions):
+    """
+    Check the metadata of an object against some conditions.
+
+    :param metadata: The metadata of an object
+    :type metadata: dict
+    :param conditions: The fields the object needs to have, with the value
+      they need to contain ("" or "*" for any value)
+    :type conditions: dict
+
+    :return: True if all the conditions are met
+    :rtype: bool
+    """
+    for key, value in conditions.items():
+        if key not in metadata:
+            return False
+        if value not in ["", "*"] and value not in _as_list(metadata[key]):
+            return False
+    return True
+
+
+def propagate_acl(job, path, read_access, write_access, user):
+    """
+    Apply an ACL to the content of a collection, run by a background job.
+    The collection itself isn't updated.
+
+    :param job: The job which reports the progress
+    :type job: :class:`project.jobs.Job`
+    :param path: The path of the collection
+    :type path: str
+    :param read_access: The groups which can read the objects
+    :type read_access: list
+    :param write_access: The groups which can write the objects
+    :type write_access: list
+    :param user: The user who changes the ACL
+    :type user: :class:`radon.model.user.User`
+    """
+    root = path.rstrip("/") + "/"
+    apply_updates(
+        job,
+        (obj for obj in walk([root]) if obj[0] != root),
+        partial(_acl_changes, read_access, write_access),
+        user,
+    )
+
+
+def select(objects, targets=TARGET_ALL, pattern=None):
+    """
+    Filter objects on their type and their path.
+
+    :param objects: The objects, as (path, is a collection)
+    :type objects: iterable
+    :param targets: The type of the objects kept (all, collections or
+      resources)
+    :type targets: str
+    :param pattern: A shell-style pattern the paths have to match
+    :type pattern: str
+
+    :return: The objects kept
+    :rtype: generator
+    """
+    for path, is_collection in objects:
+        if targets == TARGET_COLLECTIONS and not is_collection:
+            continue
+        if targets == TARGET_RESOURCES and is_collection:
+            continue
+        if pattern and not fnmatchcase(path, pattern):
+            continue
+        yield (path, is_collection)
+
+
+def update_metadata(job, paths, recursive, operation, changes, user,
+                    targets=TARGET_ALL, pattern=None, conditions=None):
+    """
+    Edit the metadata of some objects, run by a background job.
+
+    :param job: The job which reports the progress
+    :type job: :class:`project.jobs.Job`
+    :param paths: The paths of the selected collections and resources
+    :type paths: list
+    :param recursive: Include the descendants of the selected collections
+    :type recursive: bool
+    :param operation: The operation (set, add, remove)
+    :type operation: str
+    :param changes: The fields and values of the operation
+    :type changes: dict
+    :param user: The user who edits the metadata
+    :type user: :class:`radon.model.user.User`
+    :param targets: The type of the objects edited (all, collections or
+      resources)
+    :type targets: str
+    :param pattern: A shell-style pattern the paths have to match
+    :type pattern: str
+    :param conditions: The metadata the objects need to have
+    :type conditions: dict
+    """
+    apply_updates(
+        job,
+        select(walk(paths, recursive), targets, pattern),
+        partial(_metadata_changes, operation, changes, conditions),
+        user,
+    )
+
+
+def walk(paths, recursive=True):
+    """
+    List the objects of a selection.
+
+    :param paths: The paths of the selected collections and resources
+    :type paths: list
+    :param recursive: Include the descendants of the selected collections
+    :type recursive: bool
+
+    :return: The objects, as (path, is a collection), collections being
+      listed before their children
+    :rtype: generator
+    """
+    for path in paths:
+        if not path.endswith("/") and Resource.find(path):
+            yield (path, False)
+            continue
+        root = path.rstrip("/") + "/"
+        queue = deque([root])
+        while queue:
+            coll_path = queue.popleft()
+            coll = Collection.find(coll_path)
+            if not coll:
+                continue
+            yield (coll_path, True)
+            if not recursive:
+                break
+            children_c, children_r = coll.get_child(False)
+            for name in children_r:
+                yield (coll_path + name, False)
+            for name in children_c:
+                queue.append(coll_path + name.rstrip("/") + "/")
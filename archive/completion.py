@@ -0,0 +1,256 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Prefix completion of the search box.
+
+Collection paths are kept in a sorted list in memory, so completing a prefix
+is a binary search. The list is built once per worker in a background thread,
+then kept up to date with the notifications of created and deleted
+collections. The digest of the ACL of each collection is kept with its path,
+so the permissions of a user are checked with the memoised evaluations of
+:mod:`project.acl` instead of reading the candidates. A walk which fails is
+started again by a later completion. The names of the indexed metadata
+fields are read from the configuration and refreshed periodically.
+"""
+
+from bisect import bisect_left, insort
+from collections import deque
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from radon.model.collection import Collection
+from radon.model.config import Config
+from radon.model.notification import (
+    OBJ_COLLECTION,
+    OP_CREATE,
+    OP_DELETE,
+    OP_UPDATE,
+)
+
+from project import listener
+from project.acl import (
+    acl_digest,
+    cached_user_can,
+    user_can,
+)
+
+
+# Maximum number of collection paths kept in memory
+COMPLETION_MAX_PATHS = getattr(settings, "COMPLETION_MAX_PATHS", 100000)
+# Number of seconds the names of the indexed fields are kept
+COMPLETION_FIELDS_TIMEOUT = getattr(settings, "COMPLETION_FIELDS_TIMEOUT", 60)
+
+# Number of seconds before a walk which has failed is started again
+LOADER_RETRY_DELAY = 30
+
+logger = logging.getLogger("radon")
+
+_lock = threading.Lock()
+_paths = []
+# path -> digest of the ACL, missing until the collection has been read
+_digests = {}
+_loader = None
+# Time the last walk has failed
+_loader_failed = 0
+# (time of the last refresh, sorted field names)
+_fields = (0, [])
+
+
+def _digest_of(path):
+    """Digest of the ACL of a collection of the index, None if it hasn't
+    been read yet"""
+    with _lock:
+        return _digests.get(path)
+
+
+def _load_paths():
+    """Build the index, a walk which fails can be started again"""
+    global _loader, _loader_failed
+    try:
+        _walk()
+    except Exception:
+        logger.exception("Unable to build the index of the collection paths")
+        with _lock:
+            _loader = None
+            _loader_failed = time.time()
+
+
+def _walk():
+    """Walk the collection tree breadth first to build the index"""
+    found = []
+    digests = {}
+    queue = deque(["/"])
+    while queue and len(found) < COMPLETION_MAX_PATHS:
+        path = queue.popleft()
+        coll = Collection.find(path)
+        if not coll:
+            continue
+        if path != "/":
+            digests[path] = acl_digest(coll)
+        children_c, _ = coll.get_child(False)
+        for name in children_c:
+            child = path + name.rstrip("/") + "/"
+            found.append(child)
+            queue.append(child)
+    found.sort()
+    with _lock:
+        # Notifications received during the walk are kept
+        _paths[:] = sorted(set(found) | set(_paths))
+        for path, digest in digests.items():
+            _digests.setdefault(path, digest)
+
+
+def _on_notification(notif):
+    """Add or remove the collections which are created or deleted"""
+    if notif["object_type"] != OBJ_COLLECTION or notif["object_key"] == "/":
+        return
+    if notif["operation_name"] == OP_CREATE:
+        add_path(notif["object_key"])
+    elif notif["operation_name"] == OP_DELETE:
+        remove_path(notif["object_key"])
+    elif notif["operation_name"] == OP_UPDATE:
+        # The ACL may have changed, for the descendants too
+        forget_digests(notif["object_key"])
+
+
+def add_path(path):
+    """
+    Add a collection to the index.
+
+    :param path: The path of the collection
+    :type path: str
+    """
+    with _lock:
+        idx = bisect_left(_paths, path)
+        if idx == len(_paths) or _paths[idx] != path:
+            insort(_paths, path)
+
+
+def complete(prefix, user, limit=10):
+    """
+    Get the completions of the beginning of a query. A prefix which starts
+    with a slash is completed with the paths of the collections the user can
+    read, anything else with the names of the indexed fields.
+
+    :param prefix: The beginning of the query
+    :type prefix: str
+    :param user: The user who types the query
+    :type user: :class:`radon.model.user.User`
+    :param limit: The maximum number of completions
+    :type limit: int
+
+    :return: The list of completions
+    :rtype: list
+    """
+    if not prefix:
+        return []
+    if not prefix.startswith("/"):
+        return [
+            "{}:".format(name) for name in get_field_names()
+            if name.startswith(prefix)
+        ][:limit]
+    start_loader()
+    with _lock:
+        idx = bisect_left(_paths, prefix)
+        # Some candidates may not be readable by the user
+        candidates = []
+        while (idx < len(_paths) and len(candidates) < 2 * limit and
+               _paths[idx].startswith(prefix)):
+            candidates.append(_paths[idx])
+            idx += 1
+    res = []
+    for path in candidates:
+        digest = _digest_of(path)
+        allowed = None
+        if digest is not None:
+            allowed = cached_user_can(digest, user, "read")
+        if allowed is None:
+            # First evaluation of this ACL for the groups of the user
+            coll = Collection.find(path)
+            if not coll:
+                continue
+            digest = acl_digest(coll)
+            with _lock:
+                _digests[path] = digest
+            allowed = user_can(coll, user, "read", digest)
+        if allowed:
+            res.append(path)
+            if len(res) == limit:
+                break
+    return res
+
+
+def forget_digests(path):
+    """
+    Drop the digests of the ACLs of a collection and its descendants, they're
+    computed again when they're needed.
+
+    :param path: The path of the collection
+    :type path: str
+    """
+    with _lock:
+        start = bisect_left(_paths, path)
+        stop = start
+        while stop < len(_paths) and _paths[stop].startswith(path):
+            _digests.pop(_paths[stop], None)
+            stop += 1
+
+
+def get_field_names():
+    """
+    Get the names of the indexed metadata fields.
+
+    :return: The sorted names of the fields
+    :rtype: list
+    """
+    global _fields
+    refreshed, names = _fields
+    if time.time() - refreshed > COMPLETION_FIELDS_TIMEOUT:
+        names = sorted(name for name, _ in Config.get_search_indexes())
+        _fields = (time.time(), names)
+    return names
+
+
+def remove_path(path):
+    """
+    Remove a collection and its descendants from the index.
+
+    :param path: The path of the collection
+    :type path: str
+    """
+    with _lock:
+        start = bisect_left(_paths, path)
+        stop = start
+        while stop < len(_paths) and _paths[stop].startswith(path):
+            _digests.pop(_paths[stop], None)
+            stop += 1
+        del _paths[start:stop]
+
+
+def start_loader():
+    """Start building the index of the paths if it isn't done yet"""
+    global _loader
+    with _lock:
+        if (_loader is not None or
+                time.time() - _loader_failed < LOADER_RETRY_DELAY):
+            return
+        _loader = threading.Thread(target=_load_paths, name="radon-completion",
+                                   daemon=True)
+        _loader.start()
+
+
+listener.register(_on_notification)
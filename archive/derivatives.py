@@ -0,0 +1,219 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Generation of derivatives (thumbnails) of image resources.
+
+The content is read by a background thread, then the image is decoded and
+resized in a pool of processes, so the conversion holds neither a request
+thread nor the GIL. Derivatives are stored in the "derivatives" cache with a
+key built from the version of the content: a new version of a resource gets
+new derivatives and the old ones expire.
+
+Pillow is installed with the requirements, without it no thumbnail is
+generated.
+"""
+
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from concurrent.futures.process import BrokenProcessPool
+import io
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from archive.storage import (
+    get_version,
+    read_head,
+)
+
+
+# Number of processes which convert images
+DERIVATIVE_WORKERS = getattr(settings, "DERIVATIVE_WORKERS", 2)
+# Images bigger than this (in bytes) don't get a thumbnail
+DERIVATIVE_MAX_BYTES = getattr(settings, "DERIVATIVE_MAX_BYTES", 20971520)
+# Number of seconds a derivative is kept, versions change with the content
+DERIVATIVE_TIMEOUT = getattr(settings, "DERIVATIVE_TIMEOUT", 30 * 24 * 3600)
+# Number of seconds before a generation which failed for a transient reason
+# (storage error, crashed process) is tried again
+DERIVATIVE_RETRY_TIMEOUT = getattr(settings, "DERIVATIVE_RETRY_TIMEOUT", 300)
+# Maximum width and height of a thumbnail (in pixels)
+THUMBNAIL_SIZE = getattr(settings, "THUMBNAIL_SIZE", 256)
+
+THUMBNAIL_MIMETYPE = "image/jpeg"
+# Image formats Pillow can't decode
+UNSUPPORTED_MIMETYPES = ["image/svg+xml"]
+
+logger = logging.getLogger("radon")
+
+_lock = threading.Lock()
+# Cache key -> future of the derivatives being generated
+_pending = {}
+_processes = None
+# Threads which read the content and wait for the conversion
+_readers = ThreadPoolExecutor(max_workers=DERIVATIVE_WORKERS,
+                              thread_name_prefix="radon-derivatives")
+
+
+class InvalidImage(Exception):
+    """Content which can't be decoded as an image, it won't get better by
+    trying again"""
+
+
+def _convert(data):
+    """Convert the content in a process of the pool, the pool is created
+    again if a process died (e.g. on a decompression bomb)"""
+    global _processes
+    with _lock:
+        if _processes is None:
+            _processes = ProcessPoolExecutor(max_workers=DERIVATIVE_WORKERS)
+        processes = _processes
+    try:
+        return processes.submit(make_thumbnail, data, THUMBNAIL_SIZE).result()
+    except BrokenProcessPool:
+        with _lock:
+            if _processes is processes:
+                _processes = None
+        raise
+
+
+def _generate(resource, key):
+    """Read the content of a resource and store its thumbnail in the cache.
+    An empty value is stored when the image is too big or can't be decoded
+    so it isn't tried again for the same version, other failures are only
+    remembered for DERIVATIVE_RETRY_TIMEOUT."""
+    thumbnail = b""
+    timeout = DERIVATIVE_TIMEOUT
+    try:
+        data, truncated = read_head(resource, DERIVATIVE_MAX_BYTES)
+        if not truncated:
+            thumbnail = _convert(data)
+    except InvalidImage as exc:
+        logger.warning("No thumbnail for {}: {}".format(resource.path, exc))
+    except Exception:
+        logger.exception("Unable to generate the thumbnail of {}".format(
+            resource.path))
+        timeout = DERIVATIVE_RETRY_TIMEOUT
+    caches["derivatives"].set(key, thumbnail, timeout)
+    return thumbnail
+
+
+def _pop(key):
+    """Forget a derivative when its generation is done"""
+    with _lock:
+        _pending.pop(key, None)
+
+
+def has_thumbnail(mimetype):
+    """
+    Check if a thumbnail can be generated for a type of content.
+
+    :param mimetype: The mimetype of a resource
+    :type mimetype: str
+
+    :return: True if thumbnails are supported for this mimetype
+    :rtype: bool
+    """
+    return (Image is not None and bool(mimetype) and
+            mimetype.startswith("image/") and
+            mimetype not in UNSUPPORTED_MIMETYPES)
+
+
+def make_thumbnail(data, size):
+    """
+    Build a JPEG thumbnail of an image. It runs in a process of the pool so
+    it has to stay a module-level function.
+
+    :param data: The content of the image
+    :type data: bytes
+    :param size: The maximum width and height of the thumbnail
+    :type size: int
+
+    :return: The content of the thumbnail
+    :rtype: bytes
+
+    :raises InvalidImage: If the content isn't an image Pillow can decode
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        # JPEG images can be decoded directly at a reduced scale
+        image.draft("RGB", (size, size))
+        image.thumbnail((size, size))
+        if image.mode in ["RGBA", "LA", "P"]:
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+    except (Image.DecompressionBombError, OSError, SyntaxError,
+            ValueError) as exc:
+        # Unsupported, corrupt or truncated images, and decompression bombs
+        raise InvalidImage(str(exc))
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+def request_thumbnail(resource):
+    """
+    Get the thumbnail of a resource, starting its generation if it isn't in
+    the cache. Concurrent requests for the same version share the same
+    generation.
+
+    :param resource: An image resource
+    :type resource: :class:`radon.model.resource.Resource`
+
+    :return: A future of the content of the thumbnail, empty if there's no
+      thumbnail for this resource
+    :rtype: :class:`concurrent.futures.Future`
+    """
+    key = thumbnail_key(resource)
+    thumbnail = caches["derivatives"].get(key)
+    if thumbnail is not None:
+        future = Future()
+        future.set_result(thumbnail)
+        return future
+    with _lock:
+        future = _pending.get(key)
+        created = future is None
+        if created:
+            future = _readers.submit(_generate, resource, key)
+            _pending[key] = future
+    if created:
+        # The callback may run straight away, outside of the lock
+        future.add_done_callback(lambda f: _pop(key))
+    return future
+
+
+def thumbnail_key(resource):
+    """
+    Build the cache key of the thumbnail of a resource.
+
+    :param resource: An image resource
+    :type resource: :class:`radon.model.resource.Resource`
+
+    :return: The cache key, it changes with the version of the content
+    :rtype: str
+    """
+    return "thumbnail_{}_{}".format(get_version(resource), THUMBNAIL_SIZE)
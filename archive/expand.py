@@ -0,0 +1,512 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Expansion of uploaded ZIP or TAR archives into collections and resources.
+
+The uploaded archive is staged on disk and expanded by a background job. The
+collections are created level by level, then the resources in batches: the
+creation requests of a batch are all sent before their responses are
+awaited, and the contents of a batch are written by a pool of threads while
+the next batch is created. Every object gets the ACL of the collection the
+archive is expanded in.
+
+Members are read at their own offset so they can be written in parallel,
+compressed TAR archives are decompressed once in the staging directory. The
+decompressed archive and the sizes of the members count against the same
+budget, EXPAND_MAX_BYTES, so a small archive can't fill the staging directory
+or the storage.
+"""
+
+import bz2
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import reduce
+import gzip
+import io
+import lzma
+import mimetypes
+import os
+import shutil
+import stat
+import tarfile
+import uuid
+import zipfile
+
+from django.conf import settings
+from django.core.files import File
+
+from radon.model.collection import Collection
+from radon.model.notification import (
+    create_collection_request,
+    create_resource_request,
+    wait_response,
+)
+from radon.model.payload import PayloadCreateCollectionRequest
+from radon.model.resource import Resource
+from radon.util import merge
+
+from archive.listing import invalidate_child_index
+from archive.uploads import (
+    DEFAULT_MIMETYPE,
+    UPLOAD_STAGING_DIR,
+    UploadError,
+    clean_staging,
+    resource_payload,
+)
+
+
+# Number of threads which write the contents of an archive
+EXPAND_WORKERS = getattr(settings, "EXPAND_WORKERS", 8)
+# Number of creation requests sent before their responses are awaited
+EXPAND_BATCH_SIZE = getattr(settings, "EXPAND_BATCH_SIZE", 100)
+# Maximum number of members of an archive
+EXPAND_MAX_ENTRIES = getattr(settings, "EXPAND_MAX_ENTRIES", 100000)
+# Maximum size of the expanded content of an archive (in bytes)
+EXPAND_MAX_BYTES = getattr(settings, "EXPAND_MAX_BYTES", 10737418240)
+# Size of the blocks written when a TAR archive is decompressed
+DECOMPRESS_BLOCK_SIZE = 1048576
+
+# Members added by some archivers which aren't part of the content
+IGNORED_NAMES = ["__MACOSX", ".DS_Store"]
+
+# Signatures of the compressed TAR archives
+COMPRESSIONS = [
+    (b"\x1f\x8b", gzip.open),
+    (b"BZh", bz2.open),
+    (b"\xfd7zXZ\x00", lzma.open),
+]
+
+MSG_CONFLICT = "The name is already in use"
+MSG_PARENT_FAILED = "The parent collection hasn't been created"
+MSG_UNSUPPORTED = "Only directories and regular files are supported"
+MSG_TOO_LARGE = "The expanded archive is larger than {} bytes"
+
+
+class _Slice(io.RawIOBase):
+    """A member of an uncompressed TAR archive, read from its offset with
+    its own file handle"""
+
+    def __init__(self, path, offset, size):
+        super().__init__()
+        self.fh = open(path, "rb")
+        self.fh.seek(offset)
+        self.size = size
+        self.left = size
+
+    def close(self):
+        self.fh.close()
+        super().close()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        length = min(len(buf), self.left)
+        if not length:
+            return 0
+        data = self.fh.read(length)
+        buf[:len(data)] = data
+        self.left -= len(data)
+        return len(data)
+
+
+class _TarArchive():
+    """An uncompressed TAR archive"""
+
+    def __init__(self, path):
+        self.path = path
+        self.tar = tarfile.open(path, "r:")
+
+    def close(self):
+        self.tar.close()
+
+    def members(self):
+        """Iterate on the members (name, is a directory, locator, size), the
+        locator is None for the members which can't be expanded"""
+        for member in self.tar:
+            if member.isdir():
+                yield (member.name, True, None, 0)
+            elif member.isreg() and not member.issparse():
+                yield (member.name, False, (member.offset_data, member.size),
+                       member.size)
+            else:
+                yield (member.name, False, None, 0)
+
+    def open(self, locator):
+        """Open a member, it can be called from several threads"""
+        return _Slice(self.path, *locator)
+
+
+class _ZipArchive():
+    """A ZIP archive"""
+
+    def __init__(self, path):
+        self.zip = zipfile.ZipFile(path)
+
+    def close(self):
+        self.zip.close()
+
+    def members(self):
+        """Iterate on the members (name, is a directory, locator, size), the
+        locator is None for the members which can't be expanded"""
+        for info in self.zip.infolist():
+            if info.is_dir():
+                yield (info.filename, True, None, 0)
+            elif stat.S_ISLNK(info.external_attr >> 16):
+                yield (info.filename, False, None, 0)
+            else:
+                # zipfile doesn't read more than the declared size
+                yield (info.filename, False, info, info.file_size)
+
+    def open(self, locator):
+        """Open a member, the members of a ZIP file can be read
+        concurrently"""
+        return self.zip.open(locator)
+
+
+def _decompress(path):
+    """Decompress a compressed TAR archive in place, it stops as soon as the
+    decompressed archive is larger than EXPAND_MAX_BYTES"""
+    with open(path, "rb") as fh:
+        head = fh.read(8)
+    for magic, opener in COMPRESSIONS:
+        if head.startswith(magic):
+            tmp = path + ".tar"
+            try:
+                with opener(path, "rb") as src, open(tmp, "wb") as dst:
+                    written = 0
+                    while True:
+                        block = src.read(DECOMPRESS_BLOCK_SIZE)
+                        if not block:
+                            break
+                        written += len(block)
+                        if written > EXPAND_MAX_BYTES:
+                            raise UploadError(MSG_TOO_LARGE.format(
+                                EXPAND_MAX_BYTES))
+                        dst.write(block)
+                os.replace(tmp, path)
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+            return
+
+
+def _join(container, parts):
+    """Path of a member in the collection the archive is expanded in"""
+    return reduce(merge, parts, container)
+
+
+def _plan(archive):
+    """Split the members of an archive in collections and resources. Paths
+    are tuples of names relative to the collection the archive is expanded
+    in. The sizes of the members count against EXPAND_MAX_BYTES."""
+    collections = set()
+    resources = {}
+    rejected = []
+    total_size = 0
+    for num, (name, is_dir, locator, size) in enumerate(archive.members()):
+        if num == EXPAND_MAX_ENTRIES:
+            raise UploadError("The archive has more than {} members".format(
+                EXPAND_MAX_ENTRIES))
+        total_size += size
+        if total_size > EXPAND_MAX_BYTES:
+            raise UploadError(MSG_TOO_LARGE.format(EXPAND_MAX_BYTES))
+        parts = member_path(name)
+        if parts is None:
+            rejected.append((name, "Invalid path"))
+            continue
+        if not parts:
+            continue
+        names = parts if is_dir else parts[:-1]
+        for idx in range(1, len(names) + 1):
+            collections.add(tuple(names[:idx]))
+        if is_dir:
+            continue
+        if locator is None:
+            rejected.append((name, MSG_UNSUPPORTED))
+        else:
+            resources[tuple(parts)] = (locator, size)
+    for parts in list(resources):
+        if parts in collections:
+            del resources[parts]
+            rejected.append(("/".join(parts), MSG_CONFLICT))
+    return (sorted(collections, key=lambda parts: (len(parts), parts)),
+            resources, rejected)
+
+
+def _write(job, archive, path, locator, name):
+    """Write the content of a resource, called in the pool of writers"""
+    try:
+        resource = Resource.find(path)
+        with archive.open(locator) as fh:
+            resource.put(File(fh, name))
+        job.advance()
+    except Exception as exc:
+        job.error(path, "Unable to write the content: {}".format(exc))
+
+
+def archive_format(path):
+    """
+    Check the format of an archive.
+
+    :param path: The path of the archive on disk
+    :type path: str
+
+    :return: "zip" or "tar"
+    :rtype: str
+    """
+    if zipfile.is_zipfile(path):
+        return "zip"
+    if tarfile.is_tarfile(path):
+        return "tar"
+    raise UploadError("The file isn't a ZIP or TAR archive")
+
+
+def create_collections(job, container, collections, read_access,
+                       write_access, sender):
+    """
+    Create the collections of an archive, parents first. The creation
+    requests of a batch are sent before their responses are awaited.
+
+    :param job: The job which reports the progress
+    :type job: :class:`project.jobs.Job`
+    :param container: The path of the collection the archive is expanded in
+    :type container: str
+    :param collections: The relative paths (tuples of names) of the
+      collections, sorted by depth
+    :type collections: list
+    :param read_access: The groups which can read the collections
+    :type read_access: list
+    :param write_access: The groups which can write the collections
+    :type write_access: list
+    :param sender: The login of the user who expands the archive
+    :type sender: str
+
+    :return: A tuple (the set of the collections which already existed, the
+      set of the collections which couldn't be created), with the container
+      as an empty tuple
+    :rtype: tuple
+    """
+    existed = {()}
+    failed = set()
+    for start in range(0, len(collections), EXPAND_BATCH_SIZE):
+        batch = collections[start:start + EXPAND_BATCH_SIZE]
+        # A batch may contain several levels, a parent has to be created
+        # before its children
+        levels = {}
+        for parts in batch:
+            levels.setdefault(len(parts), []).append(parts)
+        for level in sorted(levels):
+            requests = []
+            for parts in levels[level]:
+                parent = parts[:-1]
+                path = _join(container, parts)
+                if parent in failed:
+                    failed.add(parts)
+                    job.error(path, MSG_PARENT_FAILED)
+                    continue
+                if parent in existed:
+                    # Only existing collections can have children
+                    if Collection.find(path + "/"):
+                        existed.add(parts)
+                        job.advance(skipped=1)
+                        continue
+                    if Resource.find(path):
+                        failed.add(parts)
+                        job.error(path, MSG_CONFLICT)
+                        continue
+                payload_json = {
+                    "obj": {
+                        "name" : parts[-1],
+                        "container": _join(container, parent),
+                        "path": path,
+                        "metadata": {},
+                        "read_access": read_access,
+                        "write_access": write_access,
+                    },
+                    "meta": {"sender": sender}
+                }
+                notif = create_collection_request(
+                    PayloadCreateCollectionRequest(payload_json))
+                requests.append((parts, path, notif.req_id))
+            for parts, path, req_id in requests:
+                resp = wait_response(req_id)
+                if resp == 0:
+                    job.advance()
+                else:
+                    failed.add(parts)
+                    job.error(path, "The creation has failed" if resp == 1
+                              else "The creation is still pending")
+    return (existed, failed)
+
+
+def create_resources(job, archive, container, resources, existed, failed,
+                     read_access, write_access, sender):
+    """
+    Create the resources of an archive and write their contents. The
+    contents of a batch are written in parallel while the next batch is
+    created.
+
+    :param job: The job which reports the progress
+    :type job: :class:`project.jobs.Job`
+    :param archive: The opened archive
+    :type archive: :class:`_ZipArchive` or :class:`_TarArchive`
+    :param container: The path of the collection the archive is expanded in
+    :type container: str
+    :param resources: The locator and size of the members, by relative path
+    :type resources: dict
+    :param existed: The collections which already existed
+    :type existed: set
+    :param failed: The collections which couldn't be created
+    :type failed: set
+    :param read_access: The groups which can read the resources
+    :type read_access: list
+    :param write_access: The groups which can write the resources
+    :type write_access: list
+    :param sender: The login of the user who expands the archive
+    :type sender: str
+    """
+    writing = []
+    with ThreadPoolExecutor(max_workers=EXPAND_WORKERS,
+                            thread_name_prefix="radon-expand") as writers:
+        paths = sorted(resources)
+        for start in range(0, len(paths), EXPAND_BATCH_SIZE):
+            batch = paths[start:start + EXPAND_BATCH_SIZE]
+            requests = []
+            for parts in batch:
+                parent = parts[:-1]
+                path = _join(container, parts)
+                if parent in failed:
+                    job.error(path, MSG_PARENT_FAILED)
+                    continue
+                if parent in existed and (Resource.find(path) or
+                                          Collection.find(path + "/")):
+                    job.error(path, MSG_CONFLICT)
+                    continue
+                locator, size = resources[parts]
+                mimetype = mimetypes.guess_type(parts[-1])[0] or DEFAULT_MIMETYPE
+                notif = create_resource_request(resource_payload(
+                    _join(container, parent), parts[-1], mimetype, size,
+                    read_access, write_access, sender))
+                requests.append((parts, path, locator, notif.req_id))
+            # The contents of the previous batch are written meanwhile
+            wait(writing)
+            writing = []
+            for parts, path, locator, req_id in requests:
+                resp = wait_response(req_id)
+                if resp != 0:
+                    job.error(path, "The creation has failed" if resp == 1
+                              else "The creation is still pending")
+                    continue
+                writing.append(writers.submit(_write, job, archive, path,
+                                              locator, parts[-1]))
+        wait(writing)
+
+
+def expand_archive(job, archive_path, container, read_access, write_access,
+                   sender):
+    """
+    Expand a staged archive in a collection, run by a background job. The
+    staged archive is removed at the end.
+
+    :param job: The job which reports the progress
+    :type job: :class:`project.jobs.Job`
+    :param archive_path: The path of the staged archive
+    :type archive_path: str
+    :param container: The path of the collection the archive is expanded in
+    :type container: str
+    :param read_access: The groups which can read the new objects
+    :type read_access: list
+    :param write_access: The groups which can write the new objects
+    :type write_access: list
+    :param sender: The login of the user who expands the archive
+    :type sender: str
+    """
+    try:
+        if archive_format(archive_path) == "zip":
+            archive = _ZipArchive(archive_path)
+        else:
+            job.message = "Decompressing the archive"
+            job.save(True)
+            _decompress(archive_path)
+            archive = _TarArchive(archive_path)
+            job.message = ""
+        try:
+            collections, resources, rejected = _plan(archive)
+            job.add_total(len(collections) + len(resources) + len(rejected))
+            for name, msg in rejected:
+                job.error(name, msg)
+            existed, failed = create_collections(
+                job, container, collections, read_access, write_access, sender)
+            create_resources(job, archive, container, resources, existed,
+                             failed, read_access, write_access, sender)
+        finally:
+            archive.close()
+    finally:
+        try:
+            os.remove(archive_path)
+        except OSError:
+            pass
+        invalidate_child_index(container)
+
+
+def member_path(name):
+    """
+    Get the relative path of a member of an archive.
+
+    :param name: The name of the member in the archive
+    :type name: str
+
+    :return: The list of the names of the path, empty if the member is
+      ignored, None if the path is invalid (absolute or going up)
+    :rtype: list
+    """
+    parts = [part for part in name.replace("\\", "/").split("/")
+             if part and part != "."]
+    if name.startswith("/") or ".." in parts:
+        return None
+    if any(part in IGNORED_NAMES for part in parts):
+        return []
+    return parts
+
+
+def stage_archive(uploaded):
+    """
+    Move an uploaded archive to the staging directory, it's expanded after
+    the end of the request.
+
+    :param uploaded: The uploaded archive
+    :type uploaded: :class:`django.core.files.uploadedfile.UploadedFile`
+
+    :return: The path of the staged archive
+    :rtype: str
+    """
+    os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+    clean_staging()
+    path = os.path.join(UPLOAD_STAGING_DIR, uuid.uuid4().hex + ".archive")
+    if hasattr(uploaded, "temporary_file_path"):
+        # Large uploads are already on disk
+        shutil.move(uploaded.temporary_file_path(), path)
+    else:
+        with open(path, "wb") as fh:
+            for chunk in uploaded.chunks():
+                fh.write(chunk)
+    try:
+        archive_format(path)
+    except UploadError:
+        os.remove(path)
+        raise
+    return path
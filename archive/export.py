@@ -0,0 +1,289 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Streaming export of a collection subtree as a ZIP or a TAR archive.
+
+The archive is generated while it's sent, nothing is staged on disk. The
+content of the next members is read by a pool of threads while the current
+one is written, each member buffering a bounded number of chunks, so the
+memory used doesn't depend on the size of the subtree.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from radon.model.collection import Collection
+from radon.model.resource import Resource
+from radon.util import merge
+
+from archive.storage import get_mtime
+from project.acl import user_can
+
+
+FORMAT_TAR = "tar"
+FORMAT_ZIP = "zip"
+FORMATS = {
+    FORMAT_TAR: "application/x-tar",
+    FORMAT_ZIP: "application/zip",
+}
+
+# Number of members read in advance while the current one is written
+EXPORT_READ_AHEAD = getattr(settings, "EXPORT_READ_AHEAD", 4)
+# Number of chunks buffered for each member read in advance
+EXPORT_MEMBER_BUFFER = getattr(settings, "EXPORT_MEMBER_BUFFER", 4)
+
+# Seconds a reader waits for room in its buffer before checking if the export
+# has been cancelled
+QUEUE_TIMEOUT = 1
+
+_END = object()
+
+
+class _StreamBuffer():
+    """Unseekable file object which keeps what's written until it's drained,
+    zipfile writes data descriptors when it can't seek"""
+
+    def __init__(self):
+        self.data = []
+
+    def drain(self):
+        """Return what has been written since the last call"""
+        res = b"".join(self.data)
+        self.data = []
+        return res
+
+    def flush(self):
+        """Nothing to flush, the content is kept until it's drained"""
+
+    def write(self, data):
+        """Keep the bytes written"""
+        self.data.append(bytes(data))
+        return len(data)
+
+
+class _Member():
+    """A resource of the archive with the chunks which have been read"""
+
+    def __init__(self, name, resource, cancelled):
+        self.name = name
+        self.resource = resource
+        self.size = resource.get_size() or 0
+        self.mtime = _timestamp(get_mtime(resource))
+        self.chunks = queue.Queue(maxsize=EXPORT_MEMBER_BUFFER)
+        self.cancelled = cancelled
+
+    def _put(self, item):
+        """Add an item in the buffer, waiting for some room"""
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=QUEUE_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def iter_chunks(self):
+        """Iterate on the chunks of the content, as they are read"""
+        while True:
+            item = self.chunks.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def read(self):
+        """Read the content of the resource in the buffer, called from a
+        thread of the pool"""
+        try:
+            for chk in self.resource.chunk_content():
+                if not self._put(chk):
+                    return
+            self._put(_END)
+        except Exception as exc:
+            self._put(exc)
+
+
+def _timestamp(date_str):
+    """Convert an ISO date to a timestamp, now if it's unknown"""
+    try:
+        date = parse_datetime(date_str) if date_str else None
+    except ValueError:
+        date = None
+    if not date:
+        return time.time()
+    return date.timestamp()
+
+
+def _tar_directory(name, mtime):
+    """Header of a directory in a TAR archive"""
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.DIRTYPE
+    info.mode = 0o755
+    info.mtime = mtime
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def _tar_member(member):
+    """Generate a file of a TAR archive, the content is padded or truncated to
+    the size given in the header if the resource changed in the meantime"""
+    info = tarfile.TarInfo(member.name)
+    info.size = member.size
+    info.mode = 0o644
+    info.mtime = member.mtime
+    yield info.tobuf(format=tarfile.PAX_FORMAT)
+    written = 0
+    for chk in member.iter_chunks():
+        chk = chk[:member.size - written]
+        written += len(chk)
+        if chk:
+            yield chk
+    if written < member.size:
+        yield bytes(member.size - written)
+    remainder = member.size % tarfile.BLOCKSIZE
+    if remainder:
+        yield bytes(tarfile.BLOCKSIZE - remainder)
+
+
+def _zip_directory(archive, buf, name, mtime):
+    """Add a directory in a ZIP archive"""
+    info = zipfile.ZipInfo(name, time.localtime(mtime)[:6])
+    info.external_attr = 0o40755 << 16
+    archive.writestr(info, b"")
+    return buf.drain()
+
+
+def _zip_member(archive, buf, member):
+    """Generate a file of a ZIP archive"""
+    info = zipfile.ZipInfo(member.name, time.localtime(member.mtime)[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    with archive.open(info, mode="w", force_zip64=True) as dest:
+        for chk in member.iter_chunks():
+            dest.write(chk)
+            yield buf.drain()
+    yield buf.drain()
+
+
+def walk(collection, user, prefix=""):
+    """
+    Walk a collection subtree and yield the objects the user can read.
+    Subcollections which can't be read are skipped with their content.
+
+    :param collection: The root of the subtree
+    :type collection: :class:`radon.model.collection.Collection`
+    :param user: The user who requests the export
+    :type user: :class:`radon.model.user.User`
+    :param prefix: The name of the root in the archive
+    :type prefix: str
+
+    :return: An iterator of (name in the archive, object, is_collection)
+    :rtype: iterator
+    """
+    children_c, children_r = collection.get_child(False)
+    for name in sorted(children_r, key=lambda x: x.lower()):
+        resource = Resource.find(merge(collection.path, name))
+        if (resource and not resource.is_reference() and
+                user_can(resource, user, "read")):
+            yield (prefix + name, resource, False)
+    for name in sorted(children_c, key=lambda x: x.lower()):
+        child = Collection.find(merge(collection.path, name))
+        if child and user_can(child, user, "read"):
+            child_prefix = prefix + name.rstrip("/") + "/"
+            yield (child_prefix, child, True)
+            for entry in walk(child, user, child_prefix):
+                yield entry
+
+
+def stream_archive(collection, user, fmt=FORMAT_ZIP):
+    """
+    Generate an archive of a collection subtree.
+
+    :param collection: The root of the subtree
+    :type collection: :class:`radon.model.collection.Collection`
+    :param user: The user who requests the export, only the objects the user
+      can read are added
+    :type user: :class:`radon.model.user.User`
+    :param fmt: The format of the archive (zip or tar)
+    :type fmt: str
+
+    :return: An iterator on the bytes of the archive
+    :rtype: iterator
+    """
+    root = (collection.name.rstrip("/") or "radon") + "/"
+    # Each member read in advance has its own thread: a reader blocked on a
+    # full buffer can't prevent the member being written from being read
+    pool = ThreadPoolExecutor(max_workers=EXPORT_READ_AHEAD,
+                              thread_name_prefix="radon-export")
+    cancelled = threading.Event()
+    pending = deque()
+    entries = walk(collection, user, root)
+    buf = _StreamBuffer()
+    archive = None
+    if fmt == FORMAT_ZIP:
+        archive = zipfile.ZipFile(buf, mode="w", allowZip64=True)
+
+    def fill():
+        """Start reading the next members, up to the read-ahead limit"""
+        while len(pending) < EXPORT_READ_AHEAD:
+            entry = next(entries, None)
+            if entry is None:
+                return
+            name, obj, is_collection = entry
+            if is_collection:
+                pending.append((name, obj, None))
+            else:
+                member = _Member(name, obj, cancelled)
+                pool.submit(member.read)
+                pending.append((name, obj, member))
+
+    try:
+        if fmt == FORMAT_ZIP:
+            yield _zip_directory(archive, buf, root, time.time())
+        else:
+            yield _tar_directory(root, time.time())
+        fill()
+        while pending:
+            name, obj, member = pending.popleft()
+            if member is None:
+                mtime = _timestamp(get_mtime(obj))
+                if fmt == FORMAT_ZIP:
+                    yield _zip_directory(archive, buf, name, mtime)
+                else:
+                    yield _tar_directory(name, mtime)
+            elif fmt == FORMAT_ZIP:
+                for data in _zip_member(archive, buf, member):
+                    if data:
+                        yield data
+            else:
+                for data in _tar_member(member):
+                    yield data
+            fill()
+        if fmt == FORMAT_ZIP:
+            archive.close()
+            yield buf.drain()
+        else:
+            yield bytes(2 * tarfile.BLOCKSIZE)
+    finally:
+        # The client may have disconnected, stop the readers
+        cancelled.set()
+        pool.shutdown(wait=False)
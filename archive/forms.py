@@ -14,20 +14,73 @@
 
 
 from django import forms
-from radon.model.group import Group
 
+from archive.bulk import (
+    METADATA_OPERATIONS,
+    TARGET_ALL,
+    TARGETS,
+)
 from archive.widgets import JsonPairInputs
+from project.acl import get_group_names
 
 
 def get_groups():
     """Get all the groups defined in the system, adding special groups
-    authenticated and anonymous"""
+    authenticated and anonymous. The names are cached so the four ACL fields
+    of a form share them."""
  
     return [(u"AUTHENTICATED@", "authenticated@"), (u"ANONYMOUS@", "anonymous@")] + [
-        (g.name, g.name,) for g in Group.objects.all()
+        (name, name,) for name in get_group_names()
     ]
  
 
+class BulkMetadataForm(forms.Form):
+    """A form to edit the metadata of several objects of a collection"""
+
+    operation = forms.ChoiceField(
+        choices=[(op, op.capitalize()) for op in METADATA_OPERATIONS],
+        initial=METADATA_OPERATIONS[0], widget=forms.RadioSelect(),
+    )
+    metadata = forms.CharField(
+        label="Metadata", required=False, widget=JsonPairInputs()
+    )
+    paths = forms.CharField(
+        label="Selection", required=False, widget=forms.Textarea(attrs={"rows": 4}),
+        help_text="One name or path per line, relative to the collection. "
+                  "Leave empty to select the whole collection.",
+    )
+    recursive = forms.BooleanField(
+        label="Include the content of the selected collections",
+        required=False, initial=True,
+    )
+    targets = forms.ChoiceField(
+        choices=[(target, target.capitalize()) for target in TARGETS],
+        initial=TARGET_ALL,
+    )
+    pattern = forms.CharField(
+        label="Path pattern", required=False, max_length=1024,
+        help_text="Only the paths which match a pattern such as *.csv",
+    )
+    conditions = forms.CharField(
+        label="Metadata filter", required=False,
+        widget=forms.Textarea(attrs={"rows": 2}),
+        help_text="One key=value per line, the objects need to have these "
+                  "values (* for any value)",
+    )
+
+    def clean_conditions(self):
+        """Parse the metadata filter as a dictionary"""
+        conditions = {}
+        for line in self.cleaned_data["conditions"].splitlines():
+            if not line.strip():
+                continue
+            key, _, value = line.partition("=")
+            if not key.strip():
+                raise forms.ValidationError("Invalid condition '{}'".format(line))
+            conditions[key.strip()] = value.strip()
+        return conditions
+
+
 class CollectionForm(forms.Form):
     """A form to edit a collection"""
  
@@ -48,6 +101,8 @@ class CollectionForm(forms.Form):
     delete_access = forms.MultipleChoiceField(
         required=False, widget=forms.CheckboxSelectMultiple(), choices=groups,
     )
+    # Apply the ACL to the content of the collection
+    recursive = forms.BooleanField(required=False)
  
  
 class CollectionNewForm(CollectionForm):
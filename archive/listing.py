@@ -0,0 +1,319 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from radon.model.collection import Collection
+from radon.model.notification import (
+    OBJ_COLLECTION,
+    OBJ_RESOURCE,
+    OP_CREATE,
+    OP_DELETE,
+)
+from radon.model.resource import Resource
+from radon.util import merge
+
+from archive.storage import get_mtime
+from project import listener
+from project.acl import (
+    ACTIONS,
+    permissions,
+)
+
+
+# Number of children materialised by a single task of the pool
+LISTING_BATCH_SIZE = getattr(settings, "ARCHIVE_LISTING_BATCH_SIZE", 50)
+# Maximum number of concurrent requests to Cassandra for a listing
+LISTING_WORKERS = getattr(settings, "ARCHIVE_LISTING_WORKERS", 8)
+# Number of seconds a sorted index of the children of a collection is kept
+INDEX_TIMEOUT = getattr(settings, "ARCHIVE_INDEX_TIMEOUT", 60)
+
+SORT_NAME = "name"
+SORT_SIZE = "size"
+SORT_DATE = "date"
+SORT_KEYS = [SORT_NAME, SORT_SIZE, SORT_DATE]
+
+# The pool is shared by all the requests served by the worker so the number of
+# concurrent queries stays bounded whatever the number of users
+_pool = ThreadPoolExecutor(max_workers=LISTING_WORKERS,
+                           thread_name_prefix="radon-listing")
+
+
+def _batches(names, size):
+    """Split a list of names in batches of a given size"""
+    for idx in range(0, len(names), size):
+        yield names[idx:idx + size]
+
+
+def _entry(obj, obj_dict, user):
+    """Complete the dictionary of a child with the permissions of the user and
+    the fields used as a key to cache the rendered row"""
+    perms = permissions(obj, user)
+    obj_dict.update(perms)
+    obj_dict["uuid"] = obj.uuid
+    obj_dict["version"] = hashlib.md5(
+        "{}|{}".format(get_mtime(obj), obj_dict).encode("utf-8")).hexdigest()
+    # Rows only depend on the rights of the user, not on the user itself
+    obj_dict["perms"] = "".join(
+        action[0] if perms["can_{}".format(action)] else "-" for action in ACTIONS
+    )
+    return obj_dict
+
+
+def _collection_batch(path, names, user):
+    """Materialise a batch of child collections"""
+    res = []
+    for name in names:
+        child = Collection.find(merge(path, name))
+        # With pending requests it may be possible that some objects are
+        # currently being deleted
+        if child:
+            res.append(_entry(child, child.to_dict(), user))
+    return res
+
+
+def _resource_batch(path, names, user):
+    """Materialise a batch of child resources"""
+    res = []
+    for name in names:
+        child = Resource.find(merge(path, name))
+        if child:
+            res.append(_entry(child, child.simple_dict(), user))
+    return res
+
+
+def _materialise(fetch_batch, path, names, user):
+    """Run the fetch function on batches of names in parallel and return the
+    concatenated results, in the same order as the names"""
+    if len(names) <= LISTING_BATCH_SIZE:
+        return fetch_batch(path, names, user)
+    futures = [
+        _pool.submit(fetch_batch, path, batch, user)
+        for batch in _batches(names, LISTING_BATCH_SIZE)
+    ]
+    res = []
+    for future in futures:
+        res.extend(future.result())
+    return res
+
+
+def get_child_collections(path, names, user):
+    """
+    Get the dictionaries which describe the child collections of a collection.
+
+    :param path: The path of the parent collection
+    :type path: str
+    :param names: The names of the children to materialise
+    :type names: list
+    :param user: The user who requests the listing, used for permissions
+    :type user: :class:`radon.model.user.User`
+
+    :return: A list of collection dictionaries, in the order of the names
+    :rtype: list
+    """
+    return _materialise(_collection_batch, path, names, user)
+
+
+def get_child_resources(path, names, user):
+    """
+    Get the dictionaries which describe the child resources of a collection.
+
+    :param path: The path of the parent collection
+    :type path: str
+    :param names: The names of the children to materialise
+    :type names: list
+    :param user: The user who requests the listing, used for permissions
+    :type user: :class:`radon.model.user.User`
+
+    :return: A list of resource dictionaries, in the order of the names
+    :rtype: list
+    """
+    return _materialise(_resource_batch, path, names, user)
+
+
+def _cache_key(prefix, path):
+    """Build a cache key for a collection path, paths may contain characters
+    which aren't valid in a cache key"""
+    return "{}_{}".format(prefix, hashlib.md5(path.encode("utf-8")).hexdigest())
+
+
+def _on_notification(notif):
+    """The index of a collection changes when a child is created or deleted,
+    possibly by another worker or through another interface"""
+    if (notif["object_type"] in [OBJ_COLLECTION, OBJ_RESOURCE] and
+            notif["operation_name"] in [OP_CREATE, OP_DELETE]):
+        invalidate_child_index(get_parent_path(notif["object_key"]))
+
+
+def _stat_batch(path, names):
+    """Get the size and modification date of a batch of child resources"""
+    res = []
+    for name in names:
+        child = Resource.find(merge(path, name))
+        if child:
+            res.append((name, child.get_size() or 0, get_mtime(child)))
+    return res
+
+
+def find_name(entries, prefix, by_name=True):
+    """
+    Find the position of the first entry whose name starts with a prefix in a
+    list of (name, is_collection) tuples. If no name matches and the entries
+    are sorted by name in ascending order, the position of the first name
+    which follows the prefix in a case-insensitive order is returned.
+
+    :param entries: The ordered entries of a collection
+    :type entries: list
+    :param prefix: The beginning of the name to find
+    :type prefix: str
+    :param by_name: The entries are sorted by name in ascending order
+    :type by_name: bool
+
+    :return: The position of the entry in the list, None if no name matches
+      in a listing which isn't sorted by name
+    :rtype: int
+    """
+    prefix = prefix.lower()
+    keys = [name.lower() for name, _ in entries]
+    for idx, key in enumerate(keys):
+        if key.startswith(prefix):
+            return idx
+    if not by_name:
+        return None
+    for idx, key in enumerate(keys):
+        if key > prefix:
+            return idx
+    return max(len(entries) - 1, 0)
+
+
+def get_child_index(collection):
+    """
+    Get the sorted names of the children of a collection. The index is kept in
+    the cache so a page of a large collection can be displayed without listing
+    the whole collection again.
+
+    :param collection: The collection to index
+    :type collection: :class:`radon.model.collection.Collection`
+
+    :return: A dictionary with the sorted names of the child collections and
+      the child resources
+    :rtype: dict
+    """
+    key = _cache_key("archive_index", collection.path)
+    index = cache.get(key)
+    if index is None:
+        children_c, children_r = collection.get_child(False)
+        children_c.sort(key=lambda x: x.lower())
+        children_r.sort(key=lambda x: x.lower())
+        index = {"collections": children_c, "resources": children_r}
+        cache.set(key, index, INDEX_TIMEOUT)
+    return index
+
+
+def get_parent_path(path):
+    """
+    Get the path of the collection which contains an object.
+
+    :param path: The path of a collection or a resource
+    :type path: str
+
+    :return: The path of the parent collection
+    :rtype: str
+    """
+    return path.rstrip("/").rsplit("/", 1)[0] + "/"
+
+
+def get_child_stats(path, names):
+    """
+    Get the size and the modification date of the child resources of a
+    collection, used to sort a listing. Sorting by size or date needs every
+    child resource to be read, not only the ones of the visible page, so the
+    stats are cached with the index.
+
+    :param path: The path of the parent collection
+    :type path: str
+    :param names: The names of the child resources
+    :type names: list
+
+    :return: A dictionary name -> (size, modification date)
+    :rtype: dict
+    """
+    key = _cache_key("archive_stats", path)
+    stats = cache.get(key)
+    if stats is None:
+        futures = [
+            _pool.submit(_stat_batch, path, batch)
+            for batch in _batches(names, LISTING_BATCH_SIZE)
+        ]
+        stats = {}
+        for future in futures:
+            for name, size, mtime in future.result():
+                stats[name] = (size, mtime)
+        cache.set(key, stats, INDEX_TIMEOUT)
+    return stats
+
+
+def invalidate_child_index(path):
+    """
+    Remove the cached index of a collection. It has to be called when a child
+    is added or removed.
+
+    :param path: The path of the collection
+    :type path: str
+    """
+    cache.delete_many([
+        _cache_key("archive_index", path),
+        _cache_key("archive_stats", path),
+    ])
+
+
+def sort_child_index(path, index, sort=SORT_NAME, reverse=False):
+    """
+    Order the children of a collection. Collections are always listed first,
+    sorted by name, then resources sorted with the requested key.
+
+    :param path: The path of the collection
+    :type path: str
+    :param index: The index returned by :meth:`get_child_index`
+    :type index: dict
+    :param sort: The sort key (name, size or date)
+    :type sort: str
+    :param reverse: Reverse the order
+    :type reverse: bool
+
+    :return: A list of (name, is_collection) tuples
+    :rtype: list
+    """
+    children_c = index["collections"]
+    children_r = index["resources"]
+    if sort in [SORT_SIZE, SORT_DATE]:
+        stats = get_child_stats(path, children_r)
+        pos = 0 if sort == SORT_SIZE else 1
+        # Resources which disappeared since the index was built are removed
+        children_r = sorted(
+            [name for name in children_r if name in stats],
+            key=lambda x: (stats[x][pos], x.lower()),
+        )
+    if reverse:
+        children_c = list(reversed(children_c))
+        children_r = list(reversed(children_r))
+    return ([(name, True) for name in children_c] +
+            [(name, False) for name in children_r])
+
+
+listener.register(_on_notification)
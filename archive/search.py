@@ -0,0 +1,374 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Search in the archive, delegated to the Solr index of DSE Search.
+
+The query, the collection filter and the pagination are sent in a single JSON
+``solr_query`` so the search backend only returns the hits of the page which
+is displayed, and the total number of hits is counted by the index.
+Permissions are then checked on the hits of the page only.
+
+Pages and counts are cached, for users with the same rights. The keys contain
+a generation number of the collection the search is restricted to, it's
+incremented for every ancestor of an object which is created, updated or
+deleted so the cached searches which could include it are dropped.
+"""
+
+import hashlib
+import json
+import time
+
+from cassandra.cqlengine import connection
+from django.conf import settings
+from django.core.cache import cache
+
+from radon.model.config import cfg
+from radon.model.notification import (
+    OBJ_COLLECTION,
+    OBJ_RESOURCE,
+    OP_CREATE,
+    OP_DELETE,
+    OP_UPDATE,
+)
+from radon.model.search import Search
+
+from archive.listing import get_parent_path
+from project import listener
+from project.acl import user_signature
+
+
+# Table indexed by DSE Search
+SEARCH_TABLE = "tree_node"
+
+# Characters with a meaning in the Solr query syntax
+SOLR_SPECIAL_CHARS = '+-&|!(){}[]^"~*?:\\/ '
+
+# Number of seconds a page of results or a count is kept
+SEARCH_CACHE_TIMEOUT = getattr(settings, "SEARCH_CACHE_TIMEOUT", 300)
+# Maximum number of values returned for a facet
+SEARCH_FACET_LIMIT = getattr(settings, "SEARCH_FACET_LIMIT", 10)
+
+
+def _cache_key(prefix, *parts):
+    """Build a cache key from the parameters of a search, queries may contain
+    characters which aren't valid in a cache key"""
+    return "{}_{}".format(prefix, hashlib.md5(
+        json.dumps(parts).encode("utf-8")).hexdigest())
+
+
+def _generation_key(path):
+    """Cache key of the generation number of a collection"""
+    return "search_gen_{}".format(hashlib.md5(path.encode("utf-8")).hexdigest())
+
+
+def _on_notification(notif):
+    """A change on an object can modify the results of the searches restricted
+    to any of its ancestors"""
+    if (notif["object_type"] in [OBJ_COLLECTION, OBJ_RESOURCE] and
+            notif["operation_name"] in [OP_CREATE, OP_DELETE, OP_UPDATE]):
+        invalidate_path(notif["object_key"])
+
+
+def _scope(collection):
+    """The collection whose generation covers a collection filter. The filter
+    is a path prefix, it can stop in the middle of a name."""
+    if not collection or collection == "/":
+        return "/"
+    if collection.endswith("/"):
+        return collection
+    return get_parent_path(collection)
+
+
+def get_generation(path):
+    """
+    Get the generation number of a collection for the search cache. A new
+    number is based on the time so the keys of a number which was evicted
+    aren't used again.
+
+    :param path: The path of the collection
+    :type path: str
+
+    :return: The generation number
+    :rtype: int
+    """
+    key = _generation_key(path)
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, time.time_ns(), None)
+        value = cache.get(key, 0)
+    return value
+
+
+def invalidate_path(path):
+    """
+    Drop the cached searches which may contain an object, by incrementing the
+    generation number of all its ancestors.
+
+    :param path: The path of a collection or a resource
+    :type path: str
+    """
+    ancestors = ["/"]
+    names = [name for name in path.split("/") if name]
+    if not path.endswith("/"):
+        # A resource isn't the scope of a search
+        names = names[:-1]
+    for name in names:
+        ancestors.append(ancestors[-1] + name + "/")
+    for ancestor in ancestors:
+        key = _generation_key(ancestor)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def normalise_query(query):
+    """
+    Normalise a query so equivalent queries share the same cache entries.
+
+    :param query: The query typed by the user
+    :type query: str
+
+    :return: The query without superfluous spaces
+    :rtype: str
+    """
+    return " ".join(query.split())
+
+
+class SearchResults():
+    """Lazy sequence of the hits of a query, usable with a Django Paginator.
+    Only the slices which are requested are fetched from the search
+    backend."""
+
+    def __init__(self, query, collection, user, filters=None):
+        self.query = query
+        self.collection = collection
+        self.user = user
+        self.filters = filters or []
+        self._count = None
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("Search results can only be sliced")
+        start = key.start or 0
+        if key.stop is None:
+            rows = max(self.count() - start, 0)
+        else:
+            rows = max(key.stop - start, 0)
+        if not rows:
+            return []
+        return search_page(self.query, self.collection, self.user, start, rows,
+                           self.filters)
+
+    def __len__(self):
+        return self.count()
+
+    def count(self):
+        """Total number of hits, counted by the index"""
+        if self._count is None:
+            self._count = count_hits(self.query, self.collection, self.filters)
+        return self._count
+
+
+def build_solr_query(query, collection=None, start=None, filters=None):
+    """
+    Build the JSON query sent to DSE Search.
+
+    :param query: The query typed by the user, a simple text is searched in
+      the paths, a query with a field (field:value) is sent as it is
+    :type query: str
+    :param collection: The path of a collection the hits have to be in
+    :type collection: str
+    :param start: The position of the first hit returned
+    :type start: int
+    :param filters: A list of (field, value) the hits have to match
+    :type filters: list
+
+    :return: The JSON query
+    :rtype: str
+    """
+    if ":" not in query:
+        solr = {"q": 'path:"{}"'.format(query.replace('"', '\\"'))}
+    else:
+        solr = {"q": query}
+    fq = []
+    if collection and collection != "/":
+        fq.append(path_filter(collection))
+    for field, value in filters or []:
+        fq.append("{}:{}".format(field, escape_term(value)))
+    if fq:
+        solr["fq"] = fq[0] if len(fq) == 1 else fq
+    if start is not None:
+        # Driver paging has to be disabled to use an offset
+        solr["start"] = start
+        solr["paging"] = "off"
+    return json.dumps(solr)
+
+
+def count_hits(query, collection=None, filters=None):
+    """
+    Count the hits of a query with the index.
+
+    :param query: The query typed by the user
+    :type query: str
+    :param collection: The path of a collection the hits have to be in
+    :type collection: str
+    :param filters: A list of (field, value) the hits have to match
+    :type filters: list
+
+    :return: The number of hits
+    :rtype: int
+    """
+    query = normalise_query(query)
+    # Counts don't depend on the user
+    key = _cache_key("search_count", query, collection, filters,
+                     get_generation(_scope(collection)))
+    res = cache.get(key)
+    if res is None:
+        stmt = "SELECT count(*) FROM {}.{} WHERE solr_query=%s".format(
+            cfg.dse_keyspace, SEARCH_TABLE)
+        solr = build_solr_query(query, collection, filters=filters)
+        row = connection.execute(stmt, [solr]).one()
+        if not row:
+            res = 0
+        else:
+            res = row["count"] if isinstance(row, dict) else row[0]
+        cache.set(key, res, SEARCH_CACHE_TIMEOUT)
+    return res
+
+
+def escape_term(value):
+    """
+    Escape the characters of a term which have a meaning in the Solr syntax.
+
+    :param value: The term
+    :type value: str
+
+    :return: The escaped term
+    :rtype: str
+    """
+    return "".join(
+        "\\" + char if char in SOLR_SPECIAL_CHARS else char for char in value
+    )
+
+
+def get_facets(query, collection, filters, fields, collections):
+    """
+    Count the hits of a query for the values of some fields and for some
+    collections. All the facets are computed by the index in a single
+    request.
+
+    :param query: The query typed by the user
+    :type query: str
+    :param collection: The path of a collection the hits have to be in
+    :type collection: str
+    :param filters: A list of (field, value) the hits have to match
+    :type filters: list
+    :param fields: The names of the fields to count the values of
+    :type fields: list
+    :param collections: The paths of the collections to count the hits in
+    :type collections: list
+
+    :return: A dictionary with the counts of the values of each field (a list
+      of (value, count) by field name) and the counts of the collections (a
+      list of (path, count))
+    :rtype: dict
+    """
+    query = normalise_query(query)
+    key = _cache_key("search_facets", query, collection, filters, fields,
+                     collections, get_generation(_scope(collection)))
+    res = cache.get(key)
+    if res is not None:
+        return res
+    solr = json.loads(build_solr_query(query, collection, filters=filters))
+    queries = {path_filter(path): path for path in collections}
+    solr["facet"] = {
+        "field": fields,
+        "query": list(queries),
+        "mincount": 1,
+        "limit": SEARCH_FACET_LIMIT,
+    }
+    stmt = "SELECT * FROM {}.{} WHERE solr_query=%s".format(
+        cfg.dse_keyspace, SEARCH_TABLE)
+    # A facet request returns a single row with the counts as JSON
+    row = connection.execute(stmt, [json.dumps(solr)]).one() or {}
+    facet_fields = json.loads(row.get("facet_fields") or "{}")
+    facet_queries = json.loads(row.get("facet_queries") or "{}")
+    res = {
+        "fields": {
+            field: sorted(facet_fields.get(field, {}).items(),
+                          key=lambda x: (-x[1], x[0]))
+            for field in fields
+        },
+        "collections": [
+            (queries[fq], count) for fq, count in facet_queries.items()
+            if fq in queries and count
+        ],
+    }
+    cache.set(key, res, SEARCH_CACHE_TIMEOUT)
+    return res
+
+
+def path_filter(collection):
+    """
+    Build the Solr filter on the objects of a collection.
+
+    :param collection: The path of the collection, or any path prefix
+    :type collection: str
+
+    :return: The filter
+    :rtype: str
+    """
+    return "path:{}*".format(escape_term(collection))
+
+
+def search_page(query, collection, user, start, rows, filters=None):
+    """
+    Get a page of the hits of a query. The hits the user can't read are
+    removed by :meth:`radon.model.search.Search.search`.
+
+    :param query: The query typed by the user
+    :type query: str
+    :param collection: The path of a collection the hits have to be in
+    :type collection: str
+    :param user: The user who searches
+    :type user: :class:`radon.model.user.User`
+    :param start: The position of the first hit
+    :type start: int
+    :param rows: The number of hits of the page
+    :type rows: int
+    :param filters: A list of (field, value) the hits have to match
+    :type filters: list
+
+    :return: A list of dictionaries which describe the hits
+    :rtype: list
+    """
+    query = normalise_query(query)
+    # Users with the same signature see the same hits
+    key = _cache_key("search_page", query, collection, filters,
+                     user_signature(user), start, rows,
+                     get_generation(_scope(collection)))
+    res = cache.get(key)
+    if res is None:
+        solr = build_solr_query(query, collection, start, filters)
+        # The condition is used in the WHERE clause of the query of Search,
+        # single quotes are escaped for CQL
+        solr_query = "solr_query='{}' LIMIT {}".format(solr.replace("'", "''"),
+                                                       int(rows))
+        res = list(Search.search(solr_query, user))
+        cache.set(key, res, SEARCH_CACHE_TIMEOUT)
+    return res
+
+
+listener.register(_on_notification)
@@ -0,0 +1,190 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import deque
+import calendar
+import hashlib
+
+import requests
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from project.ranges import iter_range
+
+
+# CDMI system metadata which store the dates of an object
+CDMI_MTIME = "cdmi_mtime"
+CDMI_CTIME = "cdmi_ctime"
+
+# Size of the chunks read from the server of a reference
+REFERENCE_CHUNK_SIZE = 65536
+# Number of seconds waited for the server of a reference to connect or to
+# send data
+REFERENCE_TIMEOUT = getattr(settings, "REFERENCE_TIMEOUT", 10)
+# Maximum size of a content whose end is read when it can't be requested on
+# its own (stored contents are only read from the start)
+PREVIEW_FOOTER_MAX_SIZE = getattr(settings, "PREVIEW_FOOTER_MAX_SIZE",
+                                  64 * 1048576)
+
+
+def _keep_tail(chunks, max_bytes, max_size):
+    """Keep the last bytes of an iterator of chunks, a ValueError is raised
+    if it has more than max_size bytes"""
+    kept = deque()
+    len_kept = 0
+    len_read = 0
+    for chk in chunks:
+        len_read += len(chk)
+        if len_read > max_size:
+            raise ValueError(_too_large(max_size))
+        kept.append(chk)
+        len_kept += len(chk)
+        # Drop the oldest chunks which aren't needed for the last bytes
+        while kept and len_kept - len(kept[0]) >= max_bytes:
+            len_kept -= len(kept.popleft())
+    return b"".join(kept)[-max_bytes:]
+
+
+def _too_large(max_size):
+    """Message of the error raised when the end of a content can't be read"""
+    return "The file is too large to read its footer (more than {} bytes)".format(
+        max_size)
+
+
+def get_etag(resource):
+    """
+    Get the entity tag of the content of a resource, to be used in the ETag
+    header.
+
+    :param resource: The resource
+    :type resource: :class:`radon.model.resource.Resource`
+
+    :return: The quoted entity tag
+    :rtype: str
+    """
+    return '"{}"'.format(get_version(resource))
+
+
+def get_last_modified(resource):
+    """
+    Get the modification date of a resource as a timestamp, to be used in the
+    Last-Modified header.
+
+    :param resource: The resource
+    :type resource: :class:`radon.model.resource.Resource`
+
+    :return: The number of seconds since the epoch, None if unknown
+    :rtype: int
+    """
+    mtime = get_mtime(resource)
+    if not mtime:
+        return None
+    try:
+        date = parse_datetime(mtime)
+    except ValueError:
+        return None
+    if not date:
+        return None
+    return calendar.timegm(date.utctimetuple())
+
+
+def get_mtime(obj):
+    """
+    Get the modification date of a collection or a resource from its CDMI
+    system metadata, the creation date is used if it has never been modified.
+
+    :param obj: A collection or a resource
+    :type obj: :class:`radon.model.collection.Collection` or
+      :class:`radon.model.resource.Resource`
+
+    :return: The modification date in ISO format, or an empty string
+    :rtype: str
+    """
+    sys_meta = obj.get_cdmi_sys_meta()
+    return sys_meta.get(CDMI_MTIME, sys_meta.get(CDMI_CTIME, ""))
+
+
+def get_version(resource):
+    """
+    Get a digest which changes each time the content of a resource changes. It
+    is computed from the uuid, the size and the system metadata of the
+    resource.
+
+    :param resource: The resource
+    :type resource: :class:`radon.model.resource.Resource`
+
+    :return: The version of the resource
+    :rtype: str
+    """
+    sys_meta = sorted(resource.get_cdmi_sys_meta().items())
+    data = "{}|{}|{}".format(resource.uuid, resource.get_size(), sys_meta)
+    return hashlib.md5(data.encode("utf-8")).hexdigest()
+
+
+def read_head(resource, max_bytes):
+    """
+    Read the beginning of the content of a resource. Only the chunks needed
+    are read.
+
+    :param resource: The resource
+    :type resource: :class:`radon.model.resource.Resource`
+    :param max_bytes: The maximum number of bytes to read
+    :type max_bytes: int
+
+    :return: A tuple (bytes read, True if the content is longer)
+    :rtype: tuple
+    """
+    # One more byte to know if the content has been truncated
+    if resource.is_reference():
+        with requests.get(resource.url, stream=True,
+                          timeout=REFERENCE_TIMEOUT) as resp:
+            chunks = resp.iter_content(REFERENCE_CHUNK_SIZE)
+            data = b"".join(iter_range(chunks, 0, max_bytes + 1))
+    else:
+        data = b"".join(iter_range(resource.chunk_content(), 0,
+                                   max_bytes + 1))
+    return data[:max_bytes], len(data) > max_bytes
+
+
+def read_tail(resource, max_bytes):
+    """
+    Read the end of the content of a resource. References are read with a
+    suffix range request. Stored contents can only be read from the start,
+    they are refused above PREVIEW_FOOTER_MAX_SIZE bytes and only the last
+    chunks are kept in memory.
+
+    :param resource: The resource
+    :type resource: :class:`radon.model.resource.Resource`
+    :param max_bytes: The maximum number of bytes to read
+    :type max_bytes: int
+
+    :return: The last bytes of the content
+    :rtype: bytes
+    :raise ValueError: If the whole content would have to be read and it's
+      larger than PREVIEW_FOOTER_MAX_SIZE
+    """
+    if resource.is_reference():
+        with requests.get(resource.url, stream=True, timeout=REFERENCE_TIMEOUT,
+                          headers={"Range": "bytes=-{}".format(max_bytes)}) as resp:
+            # A server which ignores the range sends the whole content
+            size = resp.headers.get("Content-Length", "")
+            if (resp.status_code != 206 and size.isdigit()
+                    and int(size) > PREVIEW_FOOTER_MAX_SIZE):
+                raise ValueError(_too_large(PREVIEW_FOOTER_MAX_SIZE))
+            return _keep_tail(resp.iter_content(REFERENCE_CHUNK_SIZE),
+                              max_bytes, PREVIEW_FOOTER_MAX_SIZE)
+    if (resource.get_size() or 0) > PREVIEW_FOOTER_MAX_SIZE:
+        raise ValueError(_too_large(PREVIEW_FOOTER_MAX_SIZE))
+    return _keep_tail(resource.chunk_content(), max_bytes,
+                      PREVIEW_FOOTER_MAX_SIZE)
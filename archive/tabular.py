@@ -0,0 +1,411 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Parsing of tabular contents for the previews.
+
+Delimited text (CSV, TSV) is parsed from the beginning of the content only.
+Parquet and Arrow files describe their schema in a footer at the end of the
+file, it's decoded with minimal readers of the Thrift compact protocol and of
+flatbuffers so the data pages are never parsed and no dependency is needed.
+Footers come from uploaded files: the nesting and the number of columns are
+bounded and any malformed footer is reported as a ValueError.
+"""
+
+import csv
+import io
+import struct
+
+
+PARQUET_MAGIC = b"PAR1"
+ARROW_MAGIC = b"ARROW1"
+
+# Maximum nesting of the structures of a footer
+MAX_DEPTH = 64
+# Maximum number of columns of a schema
+MAX_COLUMNS = 10000
+
+PARQUET_TYPES = [
+    "BOOLEAN", "INT32", "INT64", "INT96", "FLOAT", "DOUBLE", "BYTE_ARRAY",
+    "FIXED_LEN_BYTE_ARRAY",
+]
+PARQUET_CONVERTED_TYPES = [
+    "UTF8", "MAP", "MAP_KEY_VALUE", "LIST", "ENUM", "DECIMAL", "DATE",
+    "TIME_MILLIS", "TIME_MICROS", "TIMESTAMP_MILLIS", "TIMESTAMP_MICROS",
+    "UINT_8", "UINT_16", "UINT_32", "UINT_64", "INT_8", "INT_16", "INT_32",
+    "INT_64", "JSON", "BSON", "INTERVAL",
+]
+PARQUET_REPETITIONS = ["required", "optional", "repeated"]
+
+ARROW_TYPES = [
+    "None", "Null", "Int", "FloatingPoint", "Binary", "Utf8", "Bool",
+    "Decimal", "Date", "Time", "Timestamp", "Interval", "List", "Struct",
+    "Union", "FixedSizeBinary", "FixedSizeList", "Map", "Duration",
+    "LargeBinary", "LargeUtf8", "LargeList", "RunEndEncoded", "BinaryView",
+    "Utf8View", "ListView", "LargeListView",
+]
+
+# Thrift compact protocol types
+CT_STOP = 0
+CT_TRUE = 1
+CT_FALSE = 2
+CT_BYTE = 3
+CT_I16 = 4
+CT_I32 = 5
+CT_I64 = 6
+CT_DOUBLE = 7
+CT_BINARY = 8
+CT_LIST = 9
+CT_SET = 10
+CT_MAP = 11
+CT_STRUCT = 12
+
+
+class _CompactReader():
+    """Reader of the Thrift compact protocol. Structures are decoded as
+    dictionaries field id -> value, without any knowledge of the IDL."""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.depth = 0
+
+    def _byte(self):
+        if self.pos >= len(self.data):
+            raise ValueError("Unexpected end of the Thrift data")
+        res = self.data[self.pos]
+        self.pos += 1
+        return res
+
+    def _varint(self):
+        res = 0
+        shift = 0
+        while True:
+            byte = self._byte()
+            res |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                return res
+            shift += 7
+
+    def _zigzag(self):
+        num = self._varint()
+        return (num >> 1) ^ -(num & 1)
+
+    def _value(self, ctype):
+        if ctype in [CT_TRUE, CT_FALSE]:
+            # Booleans in containers are stored as a byte
+            return self._byte() == CT_TRUE
+        if ctype == CT_BYTE:
+            return self._byte()
+        if ctype in [CT_I16, CT_I32, CT_I64]:
+            return self._zigzag()
+        if ctype == CT_DOUBLE:
+            if self.pos + 8 > len(self.data):
+                raise ValueError("Unexpected end of the Thrift data")
+            res = struct.unpack_from("<d", self.data, self.pos)[0]
+            self.pos += 8
+            return res
+        if ctype == CT_BINARY:
+            length = self._varint()
+            res = self.data[self.pos:self.pos + length]
+            if len(res) != length:
+                raise ValueError("Unexpected end of the Thrift data")
+            self.pos += length
+            return res
+        if ctype in [CT_LIST, CT_SET]:
+            header = self._byte()
+            size = header >> 4
+            if size == 15:
+                size = self._varint()
+            self._enter()
+            res = [self._value(header & 0x0f) for _ in range(size)]
+            self.depth -= 1
+            return res
+        if ctype == CT_MAP:
+            size = self._varint()
+            if not size:
+                return {}
+            types = self._byte()
+            self._enter()
+            res = {}
+            for _ in range(size):
+                key = self._value(types >> 4)
+                if isinstance(key, (dict, list)):
+                    raise ValueError("Unsupported Thrift map key")
+                res[key] = self._value(types & 0x0f)
+            self.depth -= 1
+            return res
+        if ctype == CT_STRUCT:
+            return self.read_struct()
+        raise ValueError("Unknown Thrift type {}".format(ctype))
+
+    def _enter(self):
+        """Go down a level of nesting"""
+        self.depth += 1
+        if self.depth > MAX_DEPTH:
+            raise ValueError("The Thrift structures are nested too deeply")
+
+    def read_struct(self):
+        """Read a structure as a dictionary field id -> value"""
+        self._enter()
+        res = {}
+        field_id = 0
+        while True:
+            header = self._byte()
+            ctype = header & 0x0f
+            if ctype == CT_STOP:
+                self.depth -= 1
+                return res
+            delta = header >> 4
+            field_id = field_id + delta if delta else self._zigzag()
+            if ctype in [CT_TRUE, CT_FALSE]:
+                # Booleans of a structure are stored in the field header
+                res[field_id] = ctype == CT_TRUE
+            else:
+                res[field_id] = self._value(ctype)
+
+
+class _FlatBuffer():
+    """Accessor on the tables of a flatbuffer"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def _unpack(self, fmt, pos):
+        if pos < 0 or pos + struct.calcsize(fmt) > len(self.data):
+            raise ValueError("Offset out of the flatbuffer")
+        return struct.unpack_from(fmt, self.data, pos)[0]
+
+    def root(self):
+        """Position of the root table"""
+        return self._unpack("<I", 0)
+
+    def _field(self, table, idx):
+        """Position of a field of a table, None if it's absent"""
+        vtable = table - self._unpack("<i", table)
+        vt_size = self._unpack("<H", vtable)
+        entry = 4 + 2 * idx
+        if entry >= vt_size:
+            return None
+        offset = self._unpack("<H", vtable + entry)
+        return table + offset if offset else None
+
+    def scalar(self, table, idx, fmt, default=0):
+        """Value of a scalar field"""
+        pos = self._field(table, idx)
+        return default if pos is None else self._unpack(fmt, pos)
+
+    def table(self, table, idx):
+        """Position of a sub-table, None if it's absent"""
+        pos = self._field(table, idx)
+        return None if pos is None else pos + self._unpack("<I", pos)
+
+    def string(self, table, idx):
+        """Value of a string field"""
+        pos = self.table(table, idx)
+        if pos is None:
+            return ""
+        length = self._unpack("<I", pos)
+        return self.data[pos + 4:pos + 4 + length].decode("utf-8", "replace")
+
+    def vector(self, table, idx):
+        """Position of the elements and length of a vector field"""
+        pos = self.table(table, idx)
+        if pos is None:
+            return (0, 0)
+        return (pos + 4, self._unpack("<I", pos))
+
+    def tables(self, table, idx):
+        """Positions of the tables of a vector field"""
+        start, length = self.vector(table, idx)
+        return [
+            start + 4 * i + self._unpack("<I", start + 4 * i)
+            for i in range(length)
+        ]
+
+
+def _arrow_fields(buf, fields, depth, res):
+    """Flatten the fields of an Arrow schema, depth first"""
+    if depth >= MAX_DEPTH:
+        raise ValueError("The Arrow schema is nested too deeply")
+    for field in fields:
+        if len(res) >= MAX_COLUMNS:
+            raise ValueError("The Arrow schema has too many columns")
+        type_id = buf.scalar(field, 2, "<B")
+        res.append({
+            "depth": depth,
+            "name": buf.string(field, 0),
+            "type": (ARROW_TYPES[type_id] if type_id < len(ARROW_TYPES)
+                     else str(type_id)),
+            "repetition": "optional" if buf.scalar(field, 1, "<?") else "required",
+        })
+        _arrow_fields(buf, buf.tables(field, 5), depth + 1, res)
+    return res
+
+
+def _footer(tail, magic, length_fmt):
+    """Extract the footer of a file from its last bytes"""
+    size = struct.calcsize(length_fmt)
+    if not tail.endswith(magic) or len(tail) < len(magic) + size:
+        raise ValueError("Not a valid file, the magic number is missing")
+    end = len(tail) - len(magic) - size
+    length = struct.unpack_from(length_fmt, tail, end)[0]
+    if length > end:
+        raise ValueError("The footer is larger than the bytes read")
+    return tail[end - length:end]
+
+
+def _parse_arrow(tail):
+    """Decode the footer of an Arrow IPC file"""
+    buf = _FlatBuffer(_footer(tail, ARROW_MAGIC, "<i"))
+    footer = buf.root()
+    schema = buf.table(footer, 1)
+    columns = []
+    if schema is not None:
+        _arrow_fields(buf, buf.tables(schema, 1), 0, columns)
+    return {
+        "columns": columns,
+        "record_batches": buf.vector(footer, 3)[1],
+    }
+
+
+def _parse_parquet(tail):
+    """Decode the footer of a Parquet file"""
+    meta = _CompactReader(_footer(tail, PARQUET_MAGIC, "<I")).read_struct()
+    columns = []
+    # The schema is flattened depth first, the first element is the root and
+    # each group gives its number of children. The stack keeps the number of
+    # children left in the open groups.
+    schema = _typed(meta.get(2, []), list)
+    if not all(isinstance(element, dict) for element in schema):
+        raise ValueError("Invalid Parquet schema")
+    stack = [_typed(schema[0].get(5, 0), int)] if schema else []
+    for element in schema[1:]:
+        if not stack:
+            break
+        if len(columns) >= MAX_COLUMNS:
+            raise ValueError("The Parquet schema has too many columns")
+        if len(stack) > MAX_DEPTH:
+            raise ValueError("The Parquet schema is nested too deeply")
+        depth = len(stack) - 1
+        stack[-1] -= 1
+        ptype = _typed(element.get(1), int)
+        ctype = _typed(element.get(6), int)
+        if ctype is not None and 0 <= ctype < len(PARQUET_CONVERTED_TYPES):
+            type_name = PARQUET_CONVERTED_TYPES[ctype]
+        elif ptype is not None and 0 <= ptype < len(PARQUET_TYPES):
+            type_name = PARQUET_TYPES[ptype]
+        else:
+            type_name = "group"
+        repetition = _typed(element.get(3, 0), int)
+        name = _typed(element.get(4, b""), bytes)
+        columns.append({
+            "depth": depth,
+            "name": name.decode("utf-8", "replace"),
+            "type": type_name,
+            "repetition": (PARQUET_REPETITIONS[repetition]
+                           if 0 <= repetition < len(PARQUET_REPETITIONS)
+                           else ""),
+        })
+        if _typed(element.get(5), int):
+            stack.append(element[5])
+        while stack and stack[-1] <= 0:
+            stack.pop()
+    created_by = _typed(meta.get(6, b""), bytes)
+    return {
+        "columns": columns,
+        "num_rows": _typed(meta.get(3, 0), int),
+        "row_groups": len(_typed(meta.get(4, []), list)),
+        "created_by": created_by.decode("utf-8", "replace"),
+    }
+
+
+def _typed(value, expected):
+    """Check the type of a decoded value, None is accepted for absent
+    fields"""
+    if value is not None and (not isinstance(value, expected) or
+                              isinstance(value, bool) != (expected is bool)):
+        raise ValueError("Unexpected value in the footer")
+    return value
+
+
+def parse_arrow_footer(tail):
+    """
+    Decode the schema of an Arrow IPC file from its footer.
+
+    :param tail: The last bytes of the file, including the whole footer
+    :type tail: bytes
+
+    :return: A dictionary with the columns (depth, name, type, repetition) and
+      the number of record batches
+    :rtype: dict
+
+    :raises ValueError: If the footer is missing or malformed
+    """
+    try:
+        return _parse_arrow(tail)
+    except ValueError:
+        raise
+    except Exception as exc:
+        raise ValueError("Invalid Arrow footer ({})".format(exc))
+
+
+def parse_delimited(data, truncated, delimiter=",", max_rows=1000):
+    """
+    Parse the beginning of a delimited text.
+
+    :param data: The first bytes of the content
+    :type data: bytes
+    :param truncated: True if the content continues after these bytes, the
+      last line is then incomplete and dropped
+    :type truncated: bool
+    :param delimiter: The field delimiter
+    :type delimiter: str
+    :param max_rows: The maximum number of rows returned, header excluded
+    :type max_rows: int
+
+    :return: A tuple (header, rows, True if some rows have been left out)
+    :rtype: tuple
+    """
+    text = data.decode("utf-8-sig", errors="replace")
+    if truncated:
+        text = text[:text.rfind("\n") + 1]
+    reader = csv.reader(io.StringIO(text, newline=""), delimiter=delimiter)
+    header = next(reader, [])
+    rows = []
+    for row in reader:
+        if len(rows) == max_rows:
+            return (header, rows, True)
+        rows.append(row)
+    return (header, rows, truncated)
+
+
+def parse_parquet_footer(tail):
+    """
+    Decode the metadata of a Parquet file from its footer.
+
+    :param tail: The last bytes of the file, including the whole footer
+    :type tail: bytes
+
+    :return: A dictionary with the columns (depth, name, type, repetition),
+      the number of rows, the number of row groups and the writer
+    :rtype: dict
+
+    :raises ValueError: If the footer is missing or malformed
+    """
+    try:
+        return _parse_parquet(tail)
+    except ValueError:
+        raise
+    except Exception as exc:
+        raise ValueError("Invalid Parquet footer ({})".format(exc))
@@ -0,0 +1,157 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from archive.storage import (
+    PREVIEW_FOOTER_MAX_SIZE,
+    read_tail,
+)
+from archive.tabular import (
+    ARROW_MAGIC,
+    PARQUET_MAGIC,
+    parse_arrow_footer,
+    parse_parquet_footer,
+)
+
+
+def arrow_file(depth, width=1):
+    """Build the end of an Arrow file whose schema is a chain of nested
+    fields, each level having `width` children which are the same table"""
+    buf = bytearray(struct.pack("<I", 0))
+
+    def patch(pos, target):
+        struct.pack_into("<I", buf, pos, target - pos)
+
+    # Footer and schema: field 1 only. Fields: field 5 (children) only
+    vt_table = len(buf)
+    buf += struct.pack("<4H", 8, 8, 0, 4)
+    vt_field = len(buf)
+    buf += struct.pack("<8H", 16, 8, 0, 0, 0, 0, 0, 4)
+    footer = len(buf)
+    struct.pack_into("<I", buf, 0, footer)
+    buf += struct.pack("<i", footer - vt_table)
+    slot = len(buf)
+    buf += struct.pack("<I", 0)
+    schema = len(buf)
+    patch(slot, schema)
+    buf += struct.pack("<i", schema - vt_table)
+    slot = len(buf)
+    buf += struct.pack("<I", 0)
+    for _ in range(depth):
+        vector = len(buf)
+        patch(slot, vector)
+        buf += struct.pack("<I", width)
+        elements = [len(buf) + 4 * idx for idx in range(width)]
+        buf += bytes(4 * width)
+        table = len(buf)
+        for element in elements:
+            patch(element, table)
+        buf += struct.pack("<i", table - vt_field)
+        # The children of the last field are an empty vector at the slot
+        slot = len(buf)
+        buf += struct.pack("<I", 0)
+    return bytes(buf) + struct.pack("<i", len(buf)) + ARROW_MAGIC
+
+
+def parquet_file(meta):
+    """Build the end of a Parquet file from an encoded footer"""
+    return meta + struct.pack("<I", len(meta)) + PARQUET_MAGIC
+
+
+class ArrowFooterTest(SimpleTestCase):
+
+    def test_nested_fields(self):
+        info = parse_arrow_footer(arrow_file(3))
+        self.assertEqual([col["depth"] for col in info["columns"]], [0, 1, 2])
+
+    def test_deep_nesting(self):
+        with self.assertRaises(ValueError):
+            parse_arrow_footer(arrow_file(5000))
+
+    def test_shared_children(self):
+        # Each level points twice to the same table, 2 ** 30 columns
+        with self.assertRaises(ValueError):
+            parse_arrow_footer(arrow_file(30, width=2))
+
+    def test_truncated(self):
+        with self.assertRaises(ValueError):
+            parse_arrow_footer(arrow_file(3)[-20:])
+
+
+class ParquetFooterTest(SimpleTestCase):
+
+    def test_schema(self):
+        # Root with 1 child, then a required INT32 column "a"
+        meta = (b"\x29\x2c"
+                b"\x55\x02\x00"
+                b"\x15\x02\x25\x00\x18\x01a\x00"
+                b"\x16\x14\x00")
+        info = parse_parquet_footer(parquet_file(meta))
+        self.assertEqual(info["columns"], [
+            {"depth": 0, "name": "a", "type": "INT32", "repetition": "required"},
+        ])
+        self.assertEqual(info["num_rows"], 10)
+
+    def test_truncated_double(self):
+        with self.assertRaises(ValueError):
+            parse_parquet_footer(parquet_file(b"\x17\x00\x00\x00"))
+
+    def test_deep_nesting(self):
+        with self.assertRaises(ValueError):
+            parse_parquet_footer(parquet_file(b"\x1c" * 5000))
+
+    def test_deep_lists(self):
+        with self.assertRaises(ValueError):
+            parse_parquet_footer(parquet_file(b"\x19" + b"\x19" * 5000))
+
+    def test_schema_not_structures(self):
+        # The schema is a list of integers
+        with self.assertRaises(ValueError):
+            parse_parquet_footer(parquet_file(b"\x29\x15\x02\x00"))
+
+    def test_name_not_binary(self):
+        # The name of a column is an integer
+        meta = b"\x29\x2c\x55\x02\x00\x45\x0e\x00\x00"
+        with self.assertRaises(ValueError):
+            parse_parquet_footer(parquet_file(meta))
+
+    def test_missing_magic(self):
+        with self.assertRaises(ValueError):
+            parse_parquet_footer(b"not a parquet file")
+
+
+class ReadTailTest(SimpleTestCase):
+
+    def stored(self, chunks):
+        resource = mock.Mock()
+        resource.is_reference.return_value = False
+        resource.get_size.return_value = sum(len(chk) for chk in chunks)
+        resource.chunk_content.return_value = iter(chunks)
+        return resource
+
+    def test_tail(self):
+        resource = self.stored([b"abc", b"defg", b"hi", b"j"])
+        self.assertEqual(read_tail(resource, 4), b"ghij")
+        self.assertEqual(read_tail(self.stored([b"ab"]), 4), b"ab")
+
+    def test_too_large(self):
+        resource = self.stored([])
+        resource.get_size.return_value = PREVIEW_FOOTER_MAX_SIZE + 1
+        with self.assertRaises(ValueError):
+            read_tail(resource, 4)
+        resource.chunk_content.assert_not_called()
@@ -0,0 +1,651 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Creation of resources from uploaded contents.
+
+Chunked uploads are staged on disk: the client starts an upload, sends its
+chunks in any order (possibly in parallel) and commits it. Each chunk is
+written at its own offset in the staged file and its index is logged, the
+commit checks that all the chunks have been received before the resource is
+created and the staged file streamed to the store.
+
+Form uploads are streamed to the store by :class:`ResourceUploadHandler`
+while the request is parsed, without being buffered in memory or in a
+temporary file. Their CSRF token is sent in a header or in the URL, so it's
+checked before the body is read.
+"""
+
+import copy
+import hashlib
+import json
+import mimetypes
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import (
+    FileUploadHandler,
+    StopFutureHandlers,
+)
+from django.http import QueryDict
+from django.middleware.csrf import CsrfViewMiddleware
+
+from radon.model.collection import Collection
+from radon.model.notification import (
+    create_resource_request,
+    delete_resource_request,
+    update_resource_request,
+    wait_response,
+)
+from radon.model.payload import (
+    PayloadCreateResourceRequest,
+    PayloadDeleteResourceRequest,
+    PayloadUpdateResourceRequest,
+)
+from radon.model.resource import Resource
+from radon.util import merge
+
+
+# Directory where the chunks of the uploads are staged
+UPLOAD_STAGING_DIR = getattr(
+    settings, "UPLOAD_STAGING_DIR",
+    os.path.join(tempfile.gettempdir(), "radon-uploads"))
+# Size of the chunks sent by the clients (in bytes)
+UPLOAD_CHUNK_SIZE = getattr(settings, "UPLOAD_CHUNK_SIZE", 8388608)
+# Number of seconds after which an upload which isn't committed is removed
+UPLOAD_STAGING_TIMEOUT = getattr(settings, "UPLOAD_STAGING_TIMEOUT", 86400)
+# Number of blocks of a form upload buffered while they are written
+UPLOAD_PIPE_BUFFER = getattr(settings, "UPLOAD_PIPE_BUFFER", 16)
+
+# Size of the blocks copied from a request to the store or the staged file
+COPY_BLOCK_SIZE = 65536
+# Seconds the parser waits for room in the pipe before checking if the
+# writer has failed
+PIPE_TIMEOUT = 1
+# Parameter of the URL which carries the CSRF token of a form upload
+CSRF_PARAM = "csrfmiddlewaretoken"
+
+DEFAULT_MIMETYPE = "application/octet-stream"
+# Signatures of the beginning of some contents
+MAGIC_NUMBERS = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"%PDF-", "application/pdf"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"\x1f\x8b", "application/gzip"),
+    (b"PAR1", "application/vnd.apache.parquet"),
+    (b"ARROW1", "application/vnd.apache.arrow.file"),
+    (b"\x89HDF\r\n\x1a\n", "application/x-hdf5"),
+]
+
+# Formats used as containers by other formats, the name is more specific
+CONTAINER_MIMETYPES = ["application/zip"]
+
+UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(Exception):
+    """An upload which can't be staged or committed"""
+
+
+class _Pipe():
+    """File-like object read by :meth:`Resource.put` in a thread while the
+    upload handler writes the blocks it receives. The buffer is bounded so
+    the memory used doesn't depend on the size of the upload."""
+
+    def __init__(self):
+        self.blocks = queue.Queue(maxsize=UPLOAD_PIPE_BUFFER)
+        self.pending = b""
+        self.error = None
+        # Set when the reader stops, whether it has read everything or not
+        self.done = False
+        self.eof = False
+        self.aborted = False
+
+    def __iter__(self):
+        return self.chunks()
+
+    def _get(self):
+        """Next block written, None at the end"""
+        if self.eof:
+            return None
+        block = self.blocks.get()
+        if self.aborted:
+            raise UploadError("The upload has been interrupted")
+        if block is None:
+            self.eof = True
+        return block
+
+    def abort(self):
+        """Stop the reader, the content is incomplete"""
+        self.aborted = True
+        self.write(None)
+
+    def chunks(self, chunk_size=None):
+        """Iterate on the blocks as they are written"""
+        if self.pending:
+            block, self.pending = self.pending, b""
+            yield block
+        while True:
+            block = self._get()
+            if block is None:
+                return
+            yield block
+
+    def close(self):
+        """Mark the end of the content"""
+        self.write(None)
+
+    def read(self, size=-1):
+        """Read the content, blocking until enough has been written"""
+        data = [self.pending]
+        length = len(self.pending)
+        while size < 0 or length < size:
+            block = self._get()
+            if block is None:
+                break
+            data.append(block)
+            length += len(block)
+        data = b"".join(data)
+        if size < 0:
+            self.pending = b""
+            return data
+        self.pending = data[size:]
+        return data[:size]
+
+    def write(self, block):
+        """Add a block, waiting for some room. Nothing is written once the
+        reader has stopped."""
+        while self.error is None and not self.done:
+            try:
+                self.blocks.put(block, timeout=PIPE_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+class ResourceUploadHandler(FileUploadHandler):
+    """
+    Upload handler which creates a resource as soon as the content of a file
+    starts to be received, then streams the content to the store while
+    computing its size and checksum. It's only installed once the CSRF token
+    of the request has been checked by :func:`check_csrf_token`, before the
+    body is read. The name of the resource is given by the "name" parameter
+    of the URL, as the fields of the form may follow the file in the
+    request. Without this parameter, or if the name is already used, the
+    next handlers process the file. The "md5" parameter of the URL, if it's
+    given, is the checksum the content must have.
+    """
+
+    chunk_size = COPY_BLOCK_SIZE
+
+    def __init__(self, request, container, read_access, write_access):
+        super().__init__(request)
+        self.container = container
+        self.read_access = read_access
+        self.write_access = write_access
+        self.name = request.GET.get("name", "").strip()
+        self.expected_md5 = request.GET.get("md5", "").strip().lower()
+        self.path = None
+        self.used = False
+        self.activated = False
+
+    def _create(self, head):
+        """Create the resource, the mimetype is sniffed from the first
+        block"""
+        self.mimetype = sniff_mimetype(head, self.name, self.content_type)
+        notif = create_resource_request(resource_payload(
+            self.container, self.name, self.mimetype, 0, self.read_access,
+            self.write_access, self.request.user.login))
+        self.status = wait_response(notif.req_id)
+        if self.status == 0:
+            self.pipe = _Pipe()
+            self.writer = threading.Thread(
+                target=self._write, args=(Resource.find(self.path),),
+                name="radon-upload", daemon=True)
+            self.writer.start()
+
+    def _delete(self):
+        """Delete the resource, its content is incomplete or corrupted"""
+        notif = delete_resource_request(PayloadDeleteResourceRequest.default(
+            self.path, self.request.user.login))
+        wait_response(notif.req_id)
+
+    def _write(self, resource):
+        """Store the content, called in the writer thread"""
+        try:
+            resource.put(self.pipe)
+        except Exception as exc:
+            self.pipe.error = exc
+        finally:
+            self.pipe.done = True
+
+    def new_file(self, field_name, file_name, content_type, content_length,
+                 charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length,
+                         charset, content_type_extra)
+        if self.used or not self.name or "/" in self.name:
+            return
+        path = merge(self.container, self.name)
+        if Collection.find(path + "/") or Resource.find(path):
+            # The conflict is reported by the view
+            return
+        self.used = True
+        self.activated = True
+        self.path = path
+        self.size = 0
+        self.checksum = hashlib.md5()
+        self.status = None
+        self.pipe = None
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.activated:
+            return raw_data
+        if self.status is None:
+            self._create(raw_data)
+        self.size += len(raw_data)
+        self.checksum.update(raw_data)
+        if self.pipe is not None and not self.pipe.write(raw_data):
+            self.status = 1
+        return None
+
+    def file_complete(self, file_size):
+        if not self.activated:
+            return None
+        self.activated = False
+        if self.status is None:
+            # Empty file
+            self._create(b"")
+        checksum = self.checksum.hexdigest()
+        if self.pipe is not None:
+            self.pipe.close()
+            self.writer.join()
+            if self.pipe.error is not None or not self.pipe.eof:
+                self.status = 1
+            elif self.expected_md5 and self.expected_md5 != checksum:
+                self.status = 1
+                self._delete()
+        return StoredFile(self.name, self.mimetype, self.size, checksum,
+                          self.path, self.status)
+
+    def upload_interrupted(self):
+        if not self.activated:
+            return
+        self.activated = False
+        if self.pipe is not None:
+            self.pipe.abort()
+            self.writer.join()
+            self._delete()
+
+
+class StoredFile(UploadedFile):
+    """A file of a form which has already been stored in a resource"""
+
+    def __init__(self, name, content_type, size, checksum, path, status):
+        super().__init__(None, name, content_type, size)
+        self.checksum = checksum
+        self.path = path
+        # Status of the creation (0 created, 1 failed, 2 pending)
+        self.status = status
+
+    def discard(self, sender):
+        """
+        Delete the resource, when the form isn't valid.
+
+        :param sender: The login of the user who uploaded the file
+        :type sender: str
+        """
+        if self.status == 0:
+            notif = delete_resource_request(
+                PayloadDeleteResourceRequest.default(self.path, sender))
+            wait_response(notif.req_id)
+
+
+class StagedUpload():
+    """An upload whose chunks are staged on disk"""
+
+    def __init__(self, upload_id):
+        if not UPLOAD_ID_RE.match(upload_id or ""):
+            raise UploadError("Invalid upload id")
+        self.upload_id = upload_id
+        base = os.path.join(UPLOAD_STAGING_DIR, upload_id)
+        self.data_path = base + ".data"
+        self.chunks_path = base + ".chunks"
+        self.meta_path = base + ".json"
+        try:
+            with open(self.meta_path) as fh:
+                self.meta = json.load(fh)
+        except (OSError, ValueError):
+            raise UploadError("Unknown upload")
+
+    @classmethod
+    def create(cls, meta):
+        """
+        Start a new upload.
+
+        :param meta: The description of the resource to create (name,
+          container, size, mimetype, sender, ...)
+        :type meta: dict
+
+        :return: The staged upload
+        :rtype: :class:`StagedUpload`
+        """
+        os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+        clean_staging()
+        upload_id = uuid.uuid4().hex
+        base = os.path.join(UPLOAD_STAGING_DIR, upload_id)
+        meta = dict(meta, chunk_size=UPLOAD_CHUNK_SIZE)
+        with open(base + ".data", "wb") as fh:
+            fh.truncate(meta["size"])
+        open(base + ".chunks", "w").close()
+        with open(base + ".json", "w") as fh:
+            json.dump(meta, fh)
+        return cls(upload_id)
+
+    @property
+    def num_chunks(self):
+        """Number of chunks expected for the upload"""
+        return max(-(-self.meta["size"] // self.meta["chunk_size"]), 1)
+
+    def abort(self):
+        """Remove the staged files"""
+        for path in [self.data_path, self.chunks_path, self.meta_path]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def missing_chunks(self):
+        """
+        Get the chunks which haven't been received yet.
+
+        :return: The sorted list of the indexes of the missing chunks
+        :rtype: list
+        """
+        with open(self.chunks_path) as fh:
+            received = set(int(line) for line in fh if line.strip())
+        return [idx for idx in range(self.num_chunks) if idx not in received]
+
+    def write_chunk(self, index, stream, length):
+        """
+        Write a chunk at its offset in the staged file. Chunks can be written
+        concurrently, and a chunk which is sent again overwrites itself.
+
+        :param index: The index of the chunk
+        :type index: int
+        :param stream: The content of the chunk
+        :type stream: file-like object
+        :param length: The length of the chunk
+        :type length: int
+        """
+        if index < 0 or index >= self.num_chunks:
+            raise UploadError("Invalid chunk index")
+        offset = index * self.meta["chunk_size"]
+        expected = min(self.meta["chunk_size"], self.meta["size"] - offset)
+        if length != expected:
+            raise UploadError("Invalid chunk length")
+        written = 0
+        with open(self.data_path, "r+b") as fh:
+            fh.seek(offset)
+            while written < length:
+                block = stream.read(min(COPY_BLOCK_SIZE, length - written))
+                if not block:
+                    raise UploadError("Incomplete chunk")
+                fh.write(block)
+                written += len(block)
+        # Small appends are atomic, the log can be shared by parallel chunks
+        with open(self.chunks_path, "a") as fh:
+            fh.write("{}\n".format(index))
+
+    def commit(self, metadata=None):
+        """
+        Create the resource with the staged content.
+
+        :param metadata: The user metadata of the resource
+        :type metadata: dict
+
+        :return: The status of the creation (0 created, 1 failed, 2 pending)
+        :rtype: int
+        """
+        if self.missing_chunks():
+            raise UploadError("Some chunks are missing")
+        meta = self.meta
+        try:
+            with open(self.data_path, "rb") as fh:
+                resp = create_resource(
+                    meta["container"], meta["name"], File(fh, meta["name"]),
+                    meta["mimetype"], meta["size"], meta["read_access"],
+                    meta["write_access"], meta["sender"], metadata,
+                )
+        finally:
+            self.abort()
+        return resp
+
+
+def _csrf_token(request):
+    """CSRF token sent before the body of a request"""
+    return (request.META.get(settings.CSRF_HEADER_NAME) or
+            request.GET.get(CSRF_PARAM, ""))
+
+
+def check_csrf_token(request):
+    """
+    Check the CSRF token of a form upload before its body is read. The token
+    is given by the X-CSRFToken header or by the "csrfmiddlewaretoken"
+    parameter of the URL, and checked by the CSRF middleware as it would
+    check the field of the form.
+
+    :param request: The request of the upload
+    :type request: :class:`django.http.HttpRequest`
+
+    :return: None if the token is valid, the response which rejects the
+      request otherwise
+    :rtype: :class:`django.http.HttpResponse`
+    """
+    # The middleware reads the field of the form in the body first, it
+    # checks a copy of the request whose form is known to be empty
+    probe = copy.copy(request)
+    probe._post = QueryDict()
+    probe.META = dict(request.META)
+    probe.META[settings.CSRF_HEADER_NAME] = _csrf_token(request)
+    rejected = CsrfViewMiddleware(lambda req: None).process_view(
+        probe, None, (), {})
+    if rejected is None:
+        request.csrf_processing_done = True
+    return rejected
+
+
+def clean_staging():
+    """Remove the uploads which have been started a long time ago and never
+    committed"""
+    limit = time.time() - UPLOAD_STAGING_TIMEOUT
+    try:
+        names = os.listdir(UPLOAD_STAGING_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(UPLOAD_STAGING_DIR, name)
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def create_resource(container, name, content, mimetype, size, read_access,
+                    write_access, sender, metadata=None):
+    """
+    Create a resource through the notification workflow, then store its
+    content.
+
+    :param container: The path of the parent collection
+    :type container: str
+    :param name: The name of the resource
+    :type name: str
+    :param content: The content of the resource
+    :type content: :class:`django.core.files.File`
+    :param mimetype: The mimetype of the content
+    :type mimetype: str
+    :param size: The size of the content
+    :type size: int
+    :param read_access: The groups which can read the resource
+    :type read_access: list
+    :param write_access: The groups which can write the resource
+    :type write_access: list
+    :param sender: The login of the user who creates the resource
+    :type sender: str
+    :param metadata: The user metadata of the resource
+    :type metadata: dict
+
+    :return: The status of the creation (0 created, 1 failed, 2 pending)
+    :rtype: int
+    """
+    notif = create_resource_request(resource_payload(
+        container, name, mimetype, size, read_access, write_access, sender,
+        metadata))
+    resp = wait_response(notif.req_id)
+    if resp == 0:
+        resource = Resource.find(merge(container, name))
+        resource.put(content)
+    return resp
+
+
+def has_csrf_token(request):
+    """
+    Check if a CSRF token is sent before the body of a request, see
+    :func:`check_csrf_token`.
+
+    :param request: The request of the upload
+    :type request: :class:`django.http.HttpRequest`
+
+    :return: True if the token is in a header or in the URL
+    :rtype: bool
+    """
+    return bool(_csrf_token(request))
+
+
+def resource_payload(container, name, mimetype, size, read_access,
+                     write_access, sender, metadata=None):
+    """
+    Build the payload of the creation of a resource.
+
+    :param container: The path of the parent collection
+    :type container: str
+    :param name: The name of the resource
+    :type name: str
+    :param mimetype: The mimetype of the content
+    :type mimetype: str
+    :param size: The size of the content
+    :type size: int
+    :param read_access: The groups which can read the resource
+    :type read_access: list
+    :param write_access: The groups which can write the resource
+    :type write_access: list
+    :param sender: The login of the user who creates the resource
+    :type sender: str
+    :param metadata: The user metadata of the resource
+    :type metadata: dict
+
+    :return: The payload of the request
+    :rtype: :class:`radon.model.payload.PayloadCreateResourceRequest`
+    """
+    payload_json = {
+        "obj": {
+            "name" : name,
+            "container": container,
+            "path": merge(container, name),
+            "metadata": metadata or {},
+            "mimetype": mimetype,
+            "size": size,
+            "read_access": read_access,
+            "write_access": write_access,
+        },
+        "meta": {
+            "sender": sender,
+        }
+    }
+    return PayloadCreateResourceRequest(payload_json)
+
+
+def sniff_mimetype(head, name, content_type=None):
+    """
+    Get the mimetype of a content. The type given by the client is kept,
+    unless it's missing or generic: the type is then guessed from the first
+    bytes of the content and from the name.
+
+    :param head: The first bytes of the content
+    :type head: bytes
+    :param name: The name of the resource
+    :type name: str
+    :param content_type: The type given by the client
+    :type content_type: str
+
+    :return: The mimetype
+    :rtype: str
+    """
+    if content_type and content_type != DEFAULT_MIMETYPE:
+        return content_type
+    guessed = mimetypes.guess_type(name)[0]
+    for magic, mimetype in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            if mimetype in CONTAINER_MIMETYPES and guessed:
+                # Office documents, jars, ... are ZIP files too
+                return guessed
+            return mimetype
+    return guessed or DEFAULT_MIMETYPE
+
+
+def update_resource(path, metadata, read_access, write_access, sender):
+    """
+    Update the metadata and the ACL of a resource through the notification
+    workflow.
+
+    :param path: The path of the resource
+    :type path: str
+    :param metadata: The user metadata of the resource
+    :type metadata: dict
+    :param read_access: The groups which can read the resource
+    :type read_access: list
+    :param write_access: The groups which can write the resource
+    :type write_access: list
+    :param sender: The login of the user who updates the resource
+    :type sender: str
+
+    :return: The status of the update (0 updated, 1 failed, 2 pending)
+    :rtype: int
+    """
+    payload_json = {
+        "obj": {
+            "path": path,
+            "metadata": metadata,
+            "read_access": read_access,
+            "write_access": write_access,
+        },
+        "meta": {"sender": sender}
+    }
+    notif = update_resource_request(PayloadUpdateResourceRequest(payload_json))
+    return wait_response(notif.req_id)
@@ -15,16 +15,26 @@
 from django.urls import path
 # 
 from archive.views import (
+    autocomplete,
+    bulk_metadata,
     delete_collection,
     delete_resource,
     download,
     edit_collection,
     edit_resource,
+    expand,
+    export_collection,
     home,
     new_collection,
     new_resource,
     preview,
     search,
+    thumbnail,
+    tree,
+    upload,
+    upload_chunk,
+    upload_commit,
+    upload_start,
     view_collection,
     view_resource,
 )
@@ -35,16 +45,29 @@ app_name = "archive"
 urlpatterns = [
     path("", home, name="home"),
     path("search", search, name="search"),
+    path("complete", autocomplete, name="complete"),
     path("resource<path:path>", view_resource, name="resource_view"),
     path("resource", view_resource, name="resource_view"),
     path("new/collection<path:parent>", new_collection, name="new_collection"),
     path("edit/collection<path:path>", edit_collection, name="edit_collection"),
+    path("bulk/metadata<path:path>", bulk_metadata, name="bulk_metadata"),
     path("delete/collection<path:path>", delete_collection, name="delete_collection"),
     path("new/resource<path:parent>", new_resource, name="new_resource"),
     path("edit/resource<path:path>", edit_resource, name="edit_resource"),
+    # The prefixes of the uploader can't be mistaken for a collection path,
+    # which always starts with a "/"
+    path("upload-start<path:parent>", upload_start, name="upload_start"),
+    path("upload-chunk/<str:upload_id>", upload_chunk, name="upload_chunk"),
+    path("upload-commit/<str:upload_id>", upload_commit, name="upload_commit"),
+    path("expand<path:parent>", expand, name="expand"),
+    path("upload<path:parent>", upload, name="upload"),
     path("delete/resource<path:path>", delete_resource, name="delete_resource"),
     path("view<path:path>", view_collection, name="view"),
     path("view", view_collection, name="view"),
+    path("tree<path:path>", tree, name="tree"),
+    path("tree", tree, name="tree"),
     path("download<path:path>", download, name="download"),
+    path("export<path:path>", export_collection, name="export"),
     path("preview<path:path>", preview, name="preview"),
+    path("thumbnail<path:path>", thumbnail, name="thumbnail"),
 ]
@@ -13,21 +13,78 @@
 # limitations under the License.
 
 
+from bisect import bisect_right
+from concurrent.futures import TimeoutError
 import json
+import mimetypes
 import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.utils.cache import get_conditional_response
+from django.utils.html import escape
+from django.utils.http import http_date, parse_http_date_safe, urlencode
 from django.http import (
     StreamingHttpResponse,
     Http404,
     HttpResponse,
+    JsonResponse,
 )
 from django.core.exceptions import PermissionDenied
 from django.shortcuts import render
+from django.template.loader import render_to_string
 from django.shortcuts import redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
 from django.contrib import messages
 
+from archive.bulk import (
+    propagate_acl,
+    update_metadata,
+)
+from archive.completion import (
+    complete,
+    get_field_names,
+)
+from archive.derivatives import (
+    THUMBNAIL_MIMETYPE,
+    has_thumbnail,
+    request_thumbnail,
+    thumbnail_key,
+)
+from archive.expand import (
+    expand_archive,
+    stage_archive,
+)
+from archive.export import (
+    FORMAT_ZIP,
+    FORMATS,
+    stream_archive,
+)
+from archive.storage import (
+    get_etag,
+    get_last_modified,
+    get_version,
+    read_head,
+    read_tail,
+)
+from project.jobs import submit
+from project.acl import (
+    get_group_names,
+    permissions,
+    user_can,
+)
+from project.ranges import (
+    RangeNotSatisfiable,
+    iter_range,
+    multipart_byteranges,
+    parse_range_header,
+)
 from project.config import (
     ARCHIVE_VIEW,
+    URL_BULK_METADATA,
     URL_DELETE_COLLECTION,
     URL_DELETE_RESOURCE,
     URL_EDIT_COLLECTION,
@@ -36,19 +93,50 @@ from project.config import (
     URL_NEW_REFERENCE,
     URL_NEW_RESOURCE,
     URL_PREVIEW_RESOURCE,
+    URL_PREVIEW_SCHEMA,
+    URL_PREVIEW_TABLE,
+    URL_UPLOAD_RESOURCES,
     URL_VIEW_RESOURCE
 ) 
 from archive.forms import (
+    BulkMetadataForm,
     CollectionForm,
     CollectionNewForm,
     ResourceForm,
     ResourceNewForm,
 )
+from archive.uploads import (
+    ResourceUploadHandler,
+    StagedUpload,
+    StoredFile,
+    UploadError,
+    check_csrf_token,
+    create_resource,
+    has_csrf_token,
+    update_resource,
+)
+from archive.search import (
+    SearchResults,
+    get_facets,
+)
+from archive.tabular import (
+    parse_arrow_footer,
+    parse_delimited,
+    parse_parquet_footer,
+)
+from archive.listing import (
+    SORT_KEYS,
+    SORT_NAME,
+    find_name,
+    get_child_collections,
+    get_child_index,
+    get_child_resources,
+    invalidate_child_index,
+    sort_child_index,
+)
 from radon.model.collection import Collection
-from radon.model.group import Group
 from radon.model.notification import (
     create_collection_request,
-    create_resource_request,
     delete_collection_request,
     delete_resource_request,
     update_collection_request,
@@ -57,7 +145,6 @@ from radon.model.notification import (
 )
 from radon.model.payload import (
     PayloadCreateCollectionRequest,
-    PayloadCreateResourceRequest,
     PayloadDeleteCollectionRequest,
     PayloadDeleteResourceRequest,
     PayloadUpdateCollectionRequest,
@@ -65,7 +152,6 @@ from radon.model.payload import (
 )
 
 from radon.model.resource import Resource
-from radon.model.search import Search
 from radon.model.errors import (
     ResourceConflictError
 )
@@ -77,6 +163,64 @@ from radon.util import (
 
 MSG_NAME_CONFLICT = "That name is in use in the current collection"
 
+DOWNLOAD_CHUNK_SIZE = 1048576
+
+# Display modes of a collection
+VIEW_LIST = "list"
+VIEW_THUMBNAILS = "thumbnails"
+VIEW_MODES = [VIEW_LIST, VIEW_THUMBNAILS]
+
+
+@login_required
+def autocomplete(request):
+    """Return the completions of the beginning of a search query"""
+    prefix = request.GET.get("q", "").strip()
+    return JsonResponse({
+        "suggestions": complete(prefix, request.user,
+                                settings.COMPLETION_LIMIT),
+    })
+
+
+@login_required
+def bulk_metadata(request, path):
+    """Display the form to edit the metadata of several objects of a
+    collection, the edit runs in a background job"""
+    coll = Collection.find(path)
+    if not coll:
+        raise Http404
+
+    if not user_can(coll, request.user, "edit"):
+        raise PermissionDenied
+
+    if request.method == "POST":
+        form = BulkMetadataForm(request.POST)
+        if form.is_valid():
+            data = form.cleaned_data
+            changes = parse_metadata(data["metadata"] or "[]")
+            changes.pop("", None)
+            if changes:
+                # Selected names are relative to the collection
+                paths = []
+                for line in data["paths"].splitlines():
+                    line = line.strip()
+                    if line:
+                        paths.append(line if line.startswith("/")
+                                     else merge(coll.path, line))
+                job = submit(
+                    request.user.login, "metadata",
+                    "Metadata edit in '{}'".format(coll.path),
+                    update_metadata, paths or [coll.path], data["recursive"],
+                    data["operation"], changes, request.user, data["targets"],
+                    data["pattern"], data["conditions"],
+                    link=reverse(ARCHIVE_VIEW, kwargs={"path": coll.path}),
+                )
+                return redirect("job", job_id=job.job_id)
+            form.add_error("metadata", "At least one field is needed")
+    else:
+        form = BulkMetadataForm()
+
+    return render(request, URL_BULK_METADATA, {"form": form, "collection": coll})
+
 
 @login_required
 def delete_collection(request, path):
@@ -85,7 +229,7 @@ def delete_collection(request, path):
     if not coll:
         raise Http404
  
-    if not coll.user_can(request.user, "delete"):
+    if not user_can(coll, request.user, "delete"):
         raise PermissionDenied
  
     if request.method == "POST":
@@ -107,7 +251,7 @@ def delete_collection(request, path):
             msg = "Deletion of collection '{}' is still pending".format(path)
         
         messages.add_message(request, messages.INFO, msg)
-        
+        invalidate_child_index(coll.container)
             
         return redirect(ARCHIVE_VIEW, path=parent_path)
  
@@ -121,7 +265,7 @@ def delete_resource(request, path):
     if not resc:
         raise Http404
  
-    if not resc.user_can(request.user, "delete"):
+    if not user_can(resc, request.user, "delete"):
         raise PermissionDenied
  
     container = Collection.find(resc.container)
@@ -138,6 +282,7 @@ def delete_resource(request, path):
             msg = "Deletion of resource '{}' is still pending".format(path)
         
         messages.add_message(request, messages.INFO, msg)
+        invalidate_child_index(container.path)
         
         return redirect(ARCHIVE_VIEW, path=container.path)
  
@@ -151,29 +296,144 @@ def delete_resource(request, path):
 
 
 def download(request, path):
-    """ Download the content of a resource"""
+    """ Download the content of a resource. Single and multiple byte ranges and
+    conditional requests are supported"""
     resource = Resource.find(path)
     if not resource:
         raise Http404
  
-    if not resource.user_can(request.user, "read"):
+    if not user_can(resource, request.user, "read"):
         raise PermissionDenied
 
     if resource.is_reference():
-        r = requests.get(resource.url, stream=True)
+        return download_reference(request, resource)
+
+    mimetype = resource.get_mimetype() or "application/octet-stream"
+    size = resource.get_size() or 0
+    etag = get_etag(resource)
+    last_modified = get_last_modified(resource)
+
+    # 304 Not Modified or 412 Precondition Failed
+    resp = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if resp is not None:
+        return resp
+
+    ranges = get_download_ranges(request, size, etag, last_modified)
+    if ranges is None:
+        resp = HttpResponse(status=416)
+        resp["Content-Range"] = "bytes */{}".format(size)
+        return resp
+    if not ranges:
+        resp = StreamingHttpResponse(
+            streaming_content=resource.chunk_content(),
+            content_type=mimetype,
+        )
+        resp["Content-Length"] = size
+    elif len(ranges) == 1:
+        start, stop = ranges[0]
         resp = StreamingHttpResponse(
-            streaming_content=r, content_type=resource.get_mimetype()
+            streaming_content=iter_range(resource.chunk_content(), start, stop),
+            content_type=mimetype,
+            status=206,
         )
+        resp["Content-Range"] = "bytes {}-{}/{}".format(start, stop - 1, size)
+        resp["Content-Length"] = stop - start
     else:
+        boundary, length, body = multipart_byteranges(
+            resource.chunk_content, ranges, size, mimetype)
         resp = StreamingHttpResponse(
-            streaming_content=resource.chunk_content(),
-            content_type=resource.get_mimetype(),
+            streaming_content=body,
+            content_type="multipart/byteranges; boundary={}".format(boundary),
+            status=206,
         )
+        resp["Content-Length"] = length
+    resp["Accept-Ranges"] = "bytes"
+    resp["ETag"] = etag
+    if last_modified is not None:
+        resp["Last-Modified"] = http_date(last_modified)
     resp["Content-Disposition"] = u'attachment; filename="{}"'.format(resource.name)
  
     return resp
 
 
+def download_reference(request, resource):
+    """Download the content of a reference, range requests are forwarded to
+    the server which stores the content"""
+    headers = {}
+    for meta, header in [("HTTP_RANGE", "Range"), ("HTTP_IF_RANGE", "If-Range")]:
+        if meta in request.META:
+            headers[header] = request.META[meta]
+    r = requests.get(resource.url, stream=True, headers=headers)
+    resp = StreamingHttpResponse(
+        streaming_content=r.iter_content(DOWNLOAD_CHUNK_SIZE),
+        content_type=resource.get_mimetype(),
+        status=r.status_code if r.status_code in [206, 416] else 200,
+    )
+    for header in ["Accept-Ranges", "Content-Length", "Content-Range", "ETag",
+                   "Last-Modified"]:
+        if header in r.headers:
+            resp[header] = r.headers[header]
+    resp["Content-Disposition"] = u'attachment; filename="{}"'.format(resource.name)
+    return resp
+
+
+@login_required
+@require_POST
+def expand(request, parent):
+    """Expand an uploaded ZIP or TAR archive in a collection, in a background
+    job whose progress is displayed"""
+    parent_collection = Collection.find(parent)
+    if not parent_collection:
+        raise Http404()
+
+    if not user_can(parent_collection, request.user, "write"):
+        raise PermissionDenied
+
+    uploaded = request.FILES.get("archive")
+    if not uploaded:
+        messages.add_message(request, messages.ERROR, "No archive has been sent")
+        return redirect("archive:upload", parent=parent_collection.path)
+    try:
+        archive_path = stage_archive(uploaded)
+    except UploadError as exc:
+        messages.add_message(request, messages.ERROR, str(exc))
+        return redirect("archive:upload", parent=parent_collection.path)
+
+    # The new objects inherit the ACL of the collection
+    read_access, write_access = parent_collection.get_acl_list()
+    job = submit(
+        request.user.login, "expand",
+        "Expansion of '{}' in '{}'".format(uploaded.name, parent_collection.path),
+        expand_archive, archive_path, parent_collection.path, read_access,
+        write_access, request.user.login,
+        link=reverse("archive:view", kwargs={"path": parent_collection.path}),
+    )
+    return redirect("job", job_id=job.job_id)
+
+
+@login_required
+def export_collection(request, path):
+    """Download a collection subtree as a ZIP or a TAR archive, generated while
+    it's sent"""
+    collection = Collection.find(path)
+    if not collection:
+        raise Http404
+    if not user_can(collection, request.user, "read"):
+        raise PermissionDenied
+
+    fmt = request.GET.get("format", FORMAT_ZIP)
+    if fmt not in FORMATS:
+        return HttpResponse(status=400, content="Unknown format '{}'".format(fmt))
+
+    resp = StreamingHttpResponse(
+        streaming_content=stream_archive(collection, request.user, fmt),
+        content_type=FORMATS[fmt],
+    )
+    filename = "{}.{}".format(collection.name.rstrip("/") or "radon", fmt)
+    resp["Content-Disposition"] = u'attachment; filename="{}"'.format(filename)
+    return resp
+
+
 @login_required
 def edit_collection(request, path):
     """Display the form to edit an existing collection"""
@@ -181,7 +441,7 @@ def edit_collection(request, path):
     if not coll:
         raise Http404
  
-    if not coll.user_can(request.user, "edit"):
+    if not user_can(coll, request.user, "edit"):
         raise PermissionDenied
  
     if request.method == "POST":
@@ -213,6 +473,17 @@ def edit_collection(request, path):
                 msg = "Modification of collection '{}' is still pending".format(path)
             
             messages.add_message(request, messages.INFO, msg)
+
+            if resp == 0 and data["recursive"]:
+                # The content of the collection is updated in the background
+                job = submit(
+                    request.user.login, "acl",
+                    "Permissions of the content of '{}'".format(coll.path),
+                    propagate_acl, coll.path, data["read_access"],
+                    data["write_access"], request.user,
+                    link=reverse(ARCHIVE_VIEW, kwargs={"path": coll.path}),
+                )
+                return redirect("job", job_id=job.job_id)
             
             return redirect(ARCHIVE_VIEW, path=coll.path)
     else:
@@ -229,7 +500,7 @@ def edit_collection(request, path):
         }
         form = CollectionForm(initial=initial_data)
  
-    groups = Group.objects.all()
+    groups = get_group_names()
     return render(
         request,
         URL_EDIT_COLLECTION,
@@ -249,7 +520,7 @@ def edit_resource(request, path):
     if not container:
         raise Http404()
  
-    if not resc.user_can(request.user, "edit"):
+    if not user_can(resc, request.user, "edit"):
         raise PermissionDenied
  
     if request.method == "POST":
@@ -300,7 +571,7 @@ def edit_resource(request, path):
         "form": form,
         "resource": resc,
         "container": container,
-        "groups": Group.objects.all(),
+        "groups": get_group_names(),
     }
  
     return render(request, URL_EDIT_RESOURCE, ctx)
@@ -317,7 +588,7 @@ def new_collection(request, parent):
     """Display the form to create a new collection"""
     parent_collection = Collection.find(parent)
  
-    if not parent_collection.user_can(request.user, "write"):
+    if not user_can(parent_collection, request.user, "write"):
         raise PermissionDenied
  
     read_access, write_access = parent_collection.get_acl_list()
@@ -342,7 +613,7 @@ def new_collection(request, parent):
                         MSG_NAME_CONFLICT,
                     )
                     return render(request, URL_NEW_COLLECTION,
-                                  {"form": form, "parent": parent_collection, "groups": Group.objects.all()})
+                                  {"form": form, "parent": parent_collection, "groups": get_group_names()})
                 if Resource.find(path):
                     messages.add_message(
                         request,
@@ -350,7 +621,7 @@ def new_collection(request, parent):
                         MSG_NAME_CONFLICT,
                     )
                     return render(request, URL_NEW_COLLECTION, 
-                                  {"form": form, "parent": parent_collection, "groups": Group.objects.all()})
+                                  {"form": form, "parent": parent_collection, "groups": get_group_names()})
 
                 payload_json = {
                     "obj": {
@@ -375,6 +646,7 @@ def new_collection(request, parent):
                     msg = "Creation of collection '{}' is still pending".format(path)
                 
                 messages.add_message(request, messages.INFO, msg)
+                invalidate_child_index(parent)
                 return redirect(ARCHIVE_VIEW, path=parent)
                 
             
@@ -388,11 +660,11 @@ def new_collection(request, parent):
             return render(request, URL_NEW_COLLECTION,
                           {"form": form, 
                            "parent": parent_collection, 
-                           "groups": Group.objects.all()})
+                           "groups": get_group_names()})
     return render(
         request,
         URL_NEW_COLLECTION,
-        {"form": form, "parent": parent_collection, "groups": Group.objects.all()},
+        {"form": form, "parent": parent_collection, "groups": get_group_names()},
     )
 
 
@@ -405,7 +677,7 @@ def new_reference(request, parent):
         raise Http404()
 
     # User must be able to write to this collection
-    if not parent_collection.user_can(request.user, "write"):
+    if not user_can(parent_collection, request.user, "write"):
         raise PermissionDenied
 
     read_access, write_access = parent_collection.get_acl_list()
@@ -444,14 +716,16 @@ def new_reference(request, parent):
                     "That name is in use within the current collection",
                 )
 
+            invalidate_child_index(parent_collection.path)
             return redirect(ARCHIVE_VIEW, path=parent_collection.path)
     else:
         form = ReferenceNewForm(initial=initial)
 
-    ctx = {"form": form, "container": parent_collection, "groups": Group.objects.all()}
+    ctx = {"form": form, "container": parent_collection, "groups": get_group_names()}
     return render(request, URL_NEW_REFERENCE, ctx)
 
 
+@csrf_exempt
 @login_required
 def new_resource(request, parent):
     """Manage the forms to create a new resource"""
@@ -461,10 +735,29 @@ def new_resource(request, parent):
         raise Http404()
  
     # User must be able to write to this collection
-    if not parent_collection.user_can(request.user, "write"):
+    if not user_can(parent_collection, request.user, "write"):
         raise PermissionDenied
  
     read_access, write_access = parent_collection.get_acl_list()
+    if request.method == "POST" and has_csrf_token(request):
+        # The file is streamed to the store while the request is parsed, the
+        # CSRF token sent with the URL is checked before the body is read and
+        # the handler installed before the form view reads it. Without this
+        # token the file is buffered by Django and the form is checked as
+        # usual.
+        rejected = check_csrf_token(request)
+        if rejected is not None:
+            return rejected
+        request.upload_handlers.insert(0, ResourceUploadHandler(
+            request, parent_collection.path, read_access, write_access))
+    return new_resource_form(request, parent_collection, read_access,
+                             write_access)
+
+
+@csrf_protect
+def new_resource_form(request, parent_collection, read_access, write_access):
+    """Manage the forms to create a new resource, once the upload handlers
+    are installed"""
     initial = {
         "metadata": {},
         "read_access": read_access,
@@ -473,48 +766,50 @@ def new_resource(request, parent):
  
     if request.method == "POST":
         form = ResourceNewForm(request.POST, files=request.FILES, initial=initial)
+        stored = request.FILES.get("file")
+        if not isinstance(stored, StoredFile):
+            stored = None
         if form.is_valid():
             data = form.cleaned_data
-            name = data["name"]
+            name = stored.name if stored else data["name"]
             parent = parent_collection.path
             metadata = parse_metadata(form.cleaned_data["metadata"])
             path = merge(parent, name)
             
-            if Collection.find(path + '/'):
+            if not stored and Collection.find(path + '/'):
                 messages.add_message(
                     request,
                     messages.ERROR,
                     MSG_NAME_CONFLICT,
                 )
                 return render(request, URL_NEW_RESOURCE,
-                              {"form": form, "parent": parent_collection, "groups": Group.objects.all()})
-            if Resource.find(path):
+                              {"form": form, "parent": parent_collection, "groups": get_group_names()})
+            if not stored and Resource.find(path):
                 messages.add_message(
                     request,
                     messages.ERROR,
                     MSG_NAME_CONFLICT,
                 )
                 return render(request, URL_NEW_RESOURCE, 
-                              {"form": form, "parent": parent_collection, "groups": Group.objects.all()})
-
-            payload_json = {
-                "obj": {
-                    "name" : name,
-                    "container": parent_collection.path,
-                    "path": path, 
-                    "metadata": metadata,
-                    "mimetype": data["file"].content_type,
-                    "size": data["file"].size,
-                    "read_access": data["read_access"],
-                    "write_access": data["write_access"],
-                },
-                "meta": {
-                    "sender": request.user.login,
-                }
-            }
-            
-            notif = create_resource_request(PayloadCreateResourceRequest(payload_json))
-            resp = wait_response(notif.req_id)
+                              {"form": form, "parent": parent_collection, "groups": get_group_names()})
+
+            if stored:
+                # The resource has been created with the ACL of the parent
+                # and its content is already stored
+                resp = stored.status
+                if resp == 0 and (
+                        metadata or
+                        set(data["read_access"]) != set(read_access) or
+                        set(data["write_access"]) != set(write_access)):
+                    update_resource(path, metadata, data["read_access"],
+                                    data["write_access"], request.user.login)
+            else:
+                resp = create_resource(
+                    parent_collection.path, name, data["file"],
+                    data["file"].content_type, data["file"].size,
+                    data["read_access"], data["write_access"], request.user.login,
+                    metadata,
+                )
 
             if resp == 0:
                 msg = "Resource '{}' has been created".format(path)
@@ -524,21 +819,75 @@ def new_resource(request, parent):
                 msg = "Creation of resource '{}' is still pending".format(path)
                 
             messages.add_message(request, messages.INFO, msg)
-
-            if resp == 0:
-                resource = Resource.find(path)
-                resource.put(data["file"]) 
+            invalidate_child_index(parent_collection.path)
             return redirect(ARCHIVE_VIEW, path=parent_collection.path)
         else:
-            ctx = {"form": form, "container": parent_collection, "groups": Group.objects.all()}
+            if stored:
+                stored.discard(request.user.login)
+            ctx = {"form": form, "container": parent_collection, "groups": get_group_names()}
             return render(request, URL_NEW_RESOURCE, ctx)
     else:
         form = ResourceNewForm(initial=initial)
  
-    ctx = {"form": form, "container": parent_collection, "groups": Group.objects.all()}
+    ctx = {"form": form, "container": parent_collection, "groups": get_group_names()}
     return render(request, URL_NEW_RESOURCE, ctx)
 
 
+def get_upload(request, upload_id):
+    """Get an upload started by the user of the request"""
+    try:
+        upload = StagedUpload(upload_id)
+    except UploadError:
+        raise Http404()
+    if upload.meta.get("sender") != request.user.login:
+        raise Http404()
+    return upload
+
+
+def get_download_ranges(request, size, etag, last_modified):
+    """
+    Get the byte ranges requested in the Range header of a download.
+
+    :return: A list of (start, stop) pairs (stop is exclusive), an empty list
+      if the whole content has to be sent or None if the ranges can't be
+      satisfied
+    :rtype: list
+    """
+    specifier = request.META.get("HTTP_RANGE")
+    if not specifier or not size:
+        return []
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range:
+        # The ranges are only valid for the same version of the content
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            if if_range != etag:
+                return []
+        elif (last_modified is None or
+              parse_http_date_safe(if_range) != last_modified):
+            return []
+    # Invalid Range headers are ignored
+    try:
+        ranges = parse_range_header(specifier, size)
+    except RangeNotSatisfiable:
+        return None
+    except ValueError:
+        return []
+    if not ranges or len(ranges) > settings.DOWNLOAD_MAX_RANGES:
+        return []
+    return [(start, min(stop, size)) for (start, stop) in ranges]
+
+
+def get_page_size(request):
+    """Get the number of children displayed in a page of a collection"""
+    try:
+        page_size = int(request.GET.get("size", settings.ARCHIVE_PAGE_SIZE))
+    except ValueError:
+        page_size = settings.ARCHIVE_PAGE_SIZE
+    if page_size not in settings.ARCHIVE_PAGE_SIZES:
+        page_size = settings.ARCHIVE_PAGE_SIZE
+    return page_size
+
+
 def parse_metadata(form_metadata):
     metadata = {}
     for k, v in json.loads(form_metadata):
@@ -563,6 +912,9 @@ def preview(request, path):
     if not resource:
         raise Http404
 
+    if not user_can(resource, request.user, "read"):
+        raise PermissionDenied
+
     container = Collection.find(resource.container)
     if not container:
         # The container has to be there. If not it may be a network
@@ -587,7 +939,12 @@ def preview(request, path):
 
     data = ""
     if resource.get_mimetype() in PREVIEW_MIMETYPE:
-        data = PREVIEW_MIMETYPE.get(resource.get_mimetype())(resource)
+        # Previews only depend on the version of the content
+        key = "preview_{}_{}".format(get_version(resource), settings.PREVIEW_MAX_BYTES)
+        data = cache.get(key)
+        if data is None:
+            data = PREVIEW_MIMETYPE.get(resource.get_mimetype())(resource)
+            cache.set(key, data, settings.PREVIEW_CACHE_TIMEOUT)
 
     ctx = {
         "resource": resource.full_dict(request.user),
@@ -600,37 +957,141 @@ def preview(request, path):
     return render(request, URL_PREVIEW_RESOURCE, ctx)
 
 
+def preview_arrow(resource):
+    """Preview of the schema of an Arrow IPC file, read from its footer"""
+    try:
+        info = parse_arrow_footer(read_tail(resource, settings.PREVIEW_FOOTER_MAX_BYTES))
+    except ValueError as exc:
+        return render_to_string(URL_PREVIEW_SCHEMA, {"error": exc})
+    ctx = {
+        "title": "Arrow file",
+        "summary": [("Record batches", info["record_batches"])],
+        "columns": info["columns"],
+    }
+    return render_to_string(URL_PREVIEW_SCHEMA, ctx)
+
+
+def preview_delimited(resource, delimiter):
+    """Preview of the first rows of a delimited text, as a table"""
+    data, truncated = read_head(resource, settings.PREVIEW_MAX_BYTES)
+    header, rows, truncated = parse_delimited(
+        data, truncated, delimiter, settings.PREVIEW_MAX_ROWS)
+    ctx = {
+        "header": header,
+        "rows": rows,
+        "truncated": truncated,
+        "page_size": settings.PREVIEW_TABLE_PAGE_SIZE,
+    }
+    return render_to_string(URL_PREVIEW_TABLE, ctx)
+
+
+def preview_parquet(resource):
+    """Preview of the schema and the row count of a Parquet file, read from
+    its footer"""
+    try:
+        info = parse_parquet_footer(read_tail(resource, settings.PREVIEW_FOOTER_MAX_BYTES))
+    except ValueError as exc:
+        return render_to_string(URL_PREVIEW_SCHEMA, {"error": exc})
+    ctx = {
+        "title": "Parquet file",
+        "summary": [
+            ("Rows", info["num_rows"]),
+            ("Row groups", info["row_groups"]),
+            ("Created by", info["created_by"]),
+        ],
+        "columns": info["columns"],
+    }
+    return render_to_string(URL_PREVIEW_SCHEMA, ctx)
+
+
 def preview_test(resource):
     return "test"
 
 
 def preview_text_json(resource):
-    res = ""
-    if resource.is_reference():
-        res = requests.get(resource.url, stream=True)
-    else:
-        data = []
-        for chk in resource.chunk_content():
-            data.append(chk)
-        res = b"".join([s for s in data])
-        json_obj = json.loads(res)
-        res = "<pre>{}</pre>".format(json.dumps(json_obj, indent=2))
-
-    return res
+    """Preview of the beginning of a JSON document, pretty-printed even if it
+    has been truncated"""
+    data, truncated = read_head(resource, settings.PREVIEW_MAX_BYTES)
+    text = data.decode("utf-8", errors="replace")
+    res = None
+    if not truncated:
+        try:
+            res = json.dumps(json.loads(text), indent=2)
+        except ValueError:
+            pass
+    if res is None:
+        res = pretty_print_json(text)
+    return "<pre>{}</pre>{}".format(escape(res), preview_truncated_msg(truncated))
 
 
 def preview_text_plain(resource):
-    res = ""
-    if resource.is_reference():
-        res = requests.get(resource.url, stream=True)
-    else:
-        data = []
-        for chk in resource.chunk_content():
-            data.append(chk)
-        res = b"".join([s for s in data])
-        res = "<pre>{}</pre>".format(res)
+    """Preview of the beginning of a text document"""
+    data, truncated = read_head(resource, settings.PREVIEW_MAX_BYTES)
+    text = data.decode("utf-8", errors="replace")
+    return "<pre>{}</pre>{}".format(escape(text), preview_truncated_msg(truncated))
+
+
+def preview_text_csv(resource):
+    """Preview of the first rows of a CSV document"""
+    return preview_delimited(resource, ",")
+
+
+def preview_text_tsv(resource):
+    """Preview of the first rows of a TSV document"""
+    return preview_delimited(resource, "\t")
+
+
+def preview_truncated_msg(truncated):
+    """Message displayed under a preview which doesn't show the whole
+    content"""
+    if not truncated:
+        return ""
+    return '<p class="text-muted">Preview limited to the first {} KB</p>'.format(
+        settings.PREVIEW_MAX_BYTES // 1024)
+
+
+def pretty_print_json(text, indent=2):
+    """
+    Indent a JSON text without parsing it, so a document which has been
+    truncated can still be displayed.
+
+    :param text: The JSON text, possibly incomplete
+    :type text: str
+    :param indent: The number of spaces of an indentation level
+    :type indent: int
 
-    return res
+    :return: The indented text
+    :rtype: str
+    """
+    res = []
+    level = 0
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            res.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+            res.append(char)
+        elif char in "{[":
+            level += 1
+            res.append(char + "\n" + " " * indent * level)
+        elif char in "}]":
+            level = max(level - 1, 0)
+            res.append("\n" + " " * indent * level + char)
+        elif char == ",":
+            res.append(",\n" + " " * indent * level)
+        elif char == ":":
+            res.append(": ")
+        elif not char.isspace():
+            res.append(char)
+    return "".join(res)
 
 
 def search(request):
@@ -638,24 +1099,278 @@ def search(request):
     query = request.GET.get("q")
     collection = request.GET.get("collection")
     
-    ctx = {"q": query}
-    
-    if ":" not in query:
-        solr_query = """solr_query='path:"{}"'""".format(query)
-    else:
-        solr_query = """solr_query='{}'""".format(query)
-    
-    results = Search.search(solr_query, request.user)
-    
-    if collection:
-        results = [el for el in results if el["path"].startswith(collection)]
-    
-    ctx["results"] = results
-    ctx["total"] = len(ctx["results"])
+    ctx = {"q": query, "collection": collection or ""}
+    if not query:
+        ctx["results"] = []
+        ctx["total"] = 0
+        return render(request, "archive/search.html", ctx)
+
+    # Filters selected in the facets, as field:value
+    labels = dict(get_facet_fields())
+    filters = []
+    for param in request.GET.getlist("f"):
+        field, _, value = param.partition(":")
+        if field in labels and value and (field, value) not in filters:
+            filters.append((field, value))
+
+    # The collection filter and the pagination are done by the search
+    # backend, only the hits of the displayed page are fetched
+    paginator = Paginator(SearchResults(query, collection, request.user, filters),
+                          settings.SEARCH_PAGE_SIZE)
+    page_num = request.GET.get("page")
+    try:
+        page = paginator.page(page_num)
+    except PageNotAnInteger:
+        # If page is not an integer, deliver first page.
+        page = paginator.page(1)
+    except EmptyPage:
+        # If page is out of range (e.g. 9999), deliver last page of results.
+        page = paginator.page(paginator.num_pages)
+
+    ctx["results"] = page.object_list
+    ctx["page"] = page
+    ctx["total"] = paginator.count
+    ctx["params"] = search_params(query, collection, filters)
+    ctx["filters"] = [
+        {
+            "label": labels[field],
+            "value": value,
+            "params": search_params(query, collection,
+                                    [f for f in filters if f != (field, value)]),
+        }
+        for field, value in filters
+    ]
+    ctx["facets"] = get_search_facets(request, query, collection, filters, labels)
  
     return render(request, "archive/search.html", ctx)
 
 
+def get_facet_fields():
+    """Get the fields the search results can be filtered on, as a list of
+    (field name, label). The custom index fields follow the fixed ones."""
+    fields = list(settings.SEARCH_FACET_FIELDS)
+    names = [name for name, _ in fields]
+    fields.extend((name, name) for name in get_field_names() if name not in names)
+    return fields
+
+
+def get_search_facets(request, query, collection, filters, labels):
+    """Build the facets displayed with the search results, with the
+    parameters of the search filtered on each value"""
+    top_level = get_child_index(Collection.get_root())["collections"]
+    top_level = ["/{}/".format(name.rstrip("/"))
+                 for name in top_level[:settings.SEARCH_FACET_COLLECTIONS]]
+    counts = get_facets(query, collection, filters, list(labels), top_level)
+    facets = []
+    if not collection or collection == "/":
+        values = []
+        for path, count in counts["collections"]:
+            coll = Collection.find(path)
+            if coll and user_can(coll, request.user, "read"):
+                values.append({
+                    "value": path,
+                    "count": count,
+                    "params": search_params(query, path, filters),
+                })
+        if values:
+            facets.append({"label": "Collection", "values": values})
+    for field, label in labels.items():
+        values = [
+            {
+                "value": value,
+                "count": count,
+                "params": search_params(query, collection,
+                                        filters + [(field, value)]),
+            }
+            for value, count in counts["fields"].get(field, [])
+            if (field, value) not in filters
+        ]
+        if values:
+            facets.append({"label": label, "values": values})
+    return facets
+
+
+def search_params(query, collection, filters):
+    """Build the query string of a search"""
+    return urlencode({
+        "q": query,
+        "collection": collection or "",
+        "f": ["{}:{}".format(field, value) for field, value in filters],
+    }, doseq=True)
+
+
+@login_required()
+def thumbnail(request, path):
+    """Return the thumbnail of an image resource. The URL contains the version
+    of the resource so the thumbnail can be cached for a long time."""
+    resource = Resource.find(path)
+    if not resource:
+        raise Http404()
+
+    if not user_can(resource, request.user, "read"):
+        raise PermissionDenied
+
+    if not has_thumbnail(resource.get_mimetype()):
+        raise Http404()
+
+    etag = '"{}"'.format(thumbnail_key(resource))
+    resp = get_conditional_response(request, etag=etag)
+    if resp is not None:
+        return resp
+
+    try:
+        data = request_thumbnail(resource).result(
+            timeout=settings.THUMBNAIL_WAIT)
+    except TimeoutError:
+        # The generation goes on in the background
+        resp = HttpResponse(status=503)
+        resp["Retry-After"] = 1
+        return resp
+    if not data:
+        raise Http404()
+
+    resp = HttpResponse(data, content_type=THUMBNAIL_MIMETYPE)
+    resp["ETag"] = etag
+    resp["Cache-Control"] = "private, max-age={}, immutable".format(
+        settings.DERIVATIVE_TIMEOUT)
+    return resp
+
+
+@login_required()
+def tree(request, path="/"):
+    """Return the subcollections of a collection in JSON, by pages. The 'after'
+    parameter is the cursor returned by the previous page"""
+    if not path:
+        path = "/"
+    collection = Collection.find(path)
+    if not collection:
+        raise Http404()
+    if not user_can(collection, request.user, "read") and not collection.is_root:
+        raise Http404()
+
+    try:
+        limit = max(1, min(int(request.GET.get("limit", settings.ARCHIVE_TREE_PAGE_SIZE)),
+                           settings.ARCHIVE_TREE_PAGE_SIZE))
+    except ValueError:
+        limit = settings.ARCHIVE_TREE_PAGE_SIZE
+    names = get_child_index(collection)["collections"]
+    after = request.GET.get("after")
+    start = 0
+    if after:
+        # Names are sorted case-insensitively in the index
+        keys = [(name.lower(), name) for name in names]
+        start = bisect_right(keys, (after.lower(), after))
+    page = names[start:start + limit]
+
+    data = {
+        "path": collection.path,
+        "children": [
+            {"name": name.rstrip("/"), "path": merge(collection.path, name)}
+            for name in page
+        ],
+        "next": page[-1] if start + limit < len(names) else None,
+    }
+    resp = JsonResponse(data)
+    resp["Cache-Control"] = "private, max-age={}".format(settings.ARCHIVE_INDEX_TIMEOUT)
+    return resp
+
+
+@login_required
+def upload(request, parent):
+    """Display the page to upload several files in a collection"""
+    parent_collection = Collection.find(parent)
+    if not parent_collection:
+        raise Http404()
+
+    if not user_can(parent_collection, request.user, "write"):
+        raise PermissionDenied
+
+    ctx = {
+        "container": parent_collection,
+        "concurrency": settings.UPLOAD_CONCURRENCY,
+        "retries": settings.UPLOAD_RETRIES,
+    }
+    return render(request, URL_UPLOAD_RESOURCES, ctx)
+
+
+@login_required
+@require_POST
+def upload_chunk(request, upload_id):
+    """Receive a chunk of an upload, the index of the chunk is a parameter
+    and its content is the body of the request"""
+    upload = get_upload(request, upload_id)
+    try:
+        index = int(request.GET.get("index", ""))
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+        upload.write_chunk(index, request, length)
+    except (UploadError, ValueError) as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return JsonResponse({"index": index})
+
+
+@login_required
+@require_POST
+def upload_commit(request, upload_id):
+    """Create the resource of an upload once all its chunks are received"""
+    upload = get_upload(request, upload_id)
+    container = Collection.find(upload.meta["container"])
+    if not container or not user_can(container, request.user, "write"):
+        upload.abort()
+        raise PermissionDenied
+    missing = upload.missing_chunks()
+    if missing:
+        return JsonResponse({"error": "Some chunks are missing",
+                             "missing": missing}, status=400)
+    resp = upload.commit()
+    invalidate_child_index(container.path)
+    return JsonResponse({
+        "status": resp,
+        "path": merge(container.path, upload.meta["name"]),
+    })
+
+
+@login_required
+@require_POST
+def upload_start(request, parent):
+    """Start the chunked upload of a file in a collection"""
+    parent_collection = Collection.find(parent)
+    if not parent_collection:
+        raise Http404()
+
+    if not user_can(parent_collection, request.user, "write"):
+        raise PermissionDenied
+
+    try:
+        data = json.loads(request.body)
+        name = data["name"].strip()
+        size = int(data["size"])
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return JsonResponse({"error": "Invalid upload"}, status=400)
+    if not name or "/" in name or size < 0:
+        return JsonResponse({"error": "Invalid upload"}, status=400)
+
+    path = merge(parent_collection.path, name)
+    if Collection.find(path + "/") or Resource.find(path):
+        return JsonResponse({"error": MSG_NAME_CONFLICT}, status=409)
+
+    read_access, write_access = parent_collection.get_acl_list()
+    upload = StagedUpload.create({
+        "name": name,
+        "container": parent_collection.path,
+        "size": size,
+        "mimetype": (data.get("mimetype") or mimetypes.guess_type(name)[0] or
+                     "application/octet-stream"),
+        "read_access": read_access,
+        "write_access": write_access,
+        "sender": request.user.login,
+    })
+    return JsonResponse({
+        "upload_id": upload.upload_id,
+        "chunk_size": upload.meta["chunk_size"],
+        "num_chunks": upload.num_chunks,
+    })
+
+
 @login_required()
 def view_collection(request, path='/'):
     """Display the page which shows the subcollections/resources of a collection"""
@@ -666,7 +1381,7 @@ def view_collection(request, path='/'):
     if not collection:
         raise Http404()
  
-    if not collection.user_can(request.user, "read") and not collection.is_root:
+    if not user_can(collection, request.user, "read") and not collection.is_root:
         # If the user can't read, then return 404 rather than 403 so that
         # we don't leak information.
         raise Http404()
@@ -679,27 +1394,59 @@ def view_collection(request, path='/'):
         full = u"{}{}/".format(full, p)
         paths.append((p, full))
  
-    children_c, children_r = collection.get_child(False)
-    children_c.sort(key=lambda x: x.lower())
-    children_r.sort(key=lambda x: x.lower())
-    
-    # With pending requests it may be possible that some objects are currently being deleted
-    ls_coll = []
-    for c in children_c:
-        child_c = Collection.find(merge(path, c))
-        if child_c:
-            ls_coll.append(child_c.to_dict(request.user))
-    ls_resc = []
-    for c in children_r:
-        child_r = Resource.find(merge(path, c))
-        if child_r:
-            ls_resc.append(child_r.simple_dict(request.user))
+    sort = request.GET.get("sort", SORT_NAME)
+    if sort not in SORT_KEYS:
+        sort = SORT_NAME
+    order = "desc" if request.GET.get("order") == "desc" else "asc"
+    page_size = get_page_size(request)
+
+    # Only the names are listed, the objects of the visible page are then
+    # fetched in parallel batches
+    entries = sort_child_index(collection.path, get_child_index(collection),
+                               sort, order == "desc")
+    paginator = Paginator(entries, page_size)
+    page_num = request.GET.get("page")
+    jump = request.GET.get("jump")
+    if jump:
+        pos = find_name(entries, jump,
+                        by_name=(sort == SORT_NAME and order == "asc"))
+        if pos is not None:
+            page_num = pos // page_size + 1
+    try:
+        page = paginator.page(page_num)
+    except PageNotAnInteger:
+        # If page is not an integer, deliver first page.
+        page = paginator.page(1)
+    except EmptyPage:
+        # If page is out of range (e.g. 9999), deliver last page of results.
+        page = paginator.page(paginator.num_pages)
+
+    ls_coll = get_child_collections(
+        path, [name for name, is_coll in page if is_coll], request.user)
+    ls_resc = get_child_resources(
+        path, [name for name, is_coll in page if not is_coll], request.user)
+    view_mode = request.GET.get("view")
+    if view_mode not in VIEW_MODES:
+        view_mode = VIEW_LIST
+    if view_mode == VIEW_THUMBNAILS:
+        for resc in ls_resc:
+            mimetype = resc.get("type") or mimetypes.guess_type(resc["name"])[0]
+            resc["thumbnail"] = has_thumbnail(mimetype)
     ctx = {
-        "collection": collection.to_dict(request.user),
+        "collection": dict(collection.to_dict(),
+                           **permissions(collection, request.user)),
         "children_c": ls_coll,
         "children_r": ls_resc,
         "collection_paths": paths,
-        "empty": len(ls_coll) + len(ls_resc) == 0,
+        "empty": paginator.count == 0,
+        "page": page,
+        "page_size": page_size,
+        "page_sizes": settings.ARCHIVE_PAGE_SIZES,
+        "sort": sort,
+        "order": order,
+        "jump": jump or "",
+        "row_timeout": settings.ARCHIVE_ROW_CACHE_TIMEOUT,
+        "view_mode": view_mode,
     }
     return render(request, "archive/index.html", ctx)
 
@@ -711,7 +1458,7 @@ def view_resource(request, path):
     if not resource:
         raise Http404()
  
-    if not resource.user_can(request.user, "read"):
+    if not user_can(resource, request.user, "read"):
         raise PermissionDenied
  
     container = Collection.find(resource.container)
@@ -741,7 +1488,9 @@ def view_resource(request, path):
         "container": container,
         "container_path": container.path,
         "collection_paths": paths,
-        "preview": resource.get_mimetype() in PREVIEW_MIMETYPE.keys()
+        "preview": resource.get_mimetype() in PREVIEW_MIMETYPE.keys(),
+        "thumbnail": has_thumbnail(resource.get_mimetype()),
+        "version": get_version(resource),
     }
     return render(request, URL_VIEW_RESOURCE, ctx)
 
@@ -749,7 +1498,12 @@ def view_resource(request, path):
 
 
 PREVIEW_MIMETYPE = {
+    "application/vnd.apache.arrow.file" : preview_arrow,
+    "application/vnd.apache.parquet" : preview_parquet,
+    "application/x-parquet" : preview_parquet,
+    "text/csv" : preview_text_csv,
     "text/json" : preview_text_json,
     "text/plain" : preview_text_plain,
+    "text/tab-separated-values" : preview_text_tsv,
     "test" : preview_test
 }
@@ -23,6 +23,7 @@ from groups.forms import (
     GroupForm,
     GroupAddForm
 )
+from project.acl import invalidate_group_names
 from radon.model.group import Group
 from radon.model.notification import (
     create_group_request,
@@ -102,6 +103,8 @@ def delete_group(request, name):
         notif = delete_group_request(PayloadDeleteGroupRequest(payload_json))
 
         resp = wait_response(notif.req_id)
+        # The list of the groups is also refreshed by the notification
+        invalidate_group_names()
 
         if resp == 0:
             msg = "Group '{}' has been deleted".format(group.name)
@@ -221,6 +224,8 @@ def new_group(request):
             notif = create_group_request(PayloadCreateGroupRequest(payload_json))
 
             resp = wait_response(notif.req_id)
+            # The list of the groups is also refreshed by the notification
+            invalidate_group_names()
 
             if resp == 0:
                 msg = "Group '{}' has been created".format(groupname)
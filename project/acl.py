@@ -0,0 +1,320 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Memoised evaluation of the permissions of a user on a collection or a resource.
+
+The result of ``user_can`` only depends on the ACL of the object, or the
+inherited one when the object doesn't have an ACL, and on the groups of the
+user, so it's cached with a key built from a digest of the ACL and a
+signature of the user's group set. Listings check the same ACLs against
+the same user for every child. The ACL a collection passes to its children
+is kept in memory too, until a collection is updated or deleted, so the
+digest of an object which inherits its ACL doesn't read its parents.
+
+The names of all the groups, used by the ACL forms, are also kept in memory
+until a group changes.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+
+from radon.model.collection import Collection
+from radon.model.group import Group
+from radon.model.notification import (
+    OBJ_COLLECTION,
+    OBJ_GROUP,
+    OBJ_USER,
+    OP_DELETE,
+    OP_UPDATE,
+)
+
+from project import listener
+
+
+ACTIONS = ["read", "write", "edit", "delete"]
+
+# Maximum number of evaluations, and of ACLs of collections, kept in memory
+ACL_CACHE_SIZE = getattr(settings, "ACL_CACHE_SIZE", 10000)
+
+# Signature used for users who aren't logged in
+ANONYMOUS_SIGNATURE = "ANONYMOUS@"
+
+_lock = threading.Lock()
+# (acl digest, user signature, action) -> bool
+_evaluations = OrderedDict()
+# path of a collection -> (path of the collection the ACL comes from,
+# sorted read access, sorted write access)
+_inherited = OrderedDict()
+# Incremented when a collection changes, an ACL read meanwhile isn't kept
+_inherited_gen = 0
+# login -> (group set, signature)
+_group_sets = {}
+# Sorted names of all the groups, None until they are read
+_group_names = None
+# Incremented when the groups change, a list read meanwhile isn't kept
+_group_names_gen = 0
+
+
+def _evaluation_get(key):
+    """Get an evaluation from the cache, marking it as recently used"""
+    with _lock:
+        value = _evaluations.get(key)
+        if value is not None:
+            _evaluations.move_to_end(key)
+        return value
+
+
+def _evaluation_set(key, value):
+    """Store an evaluation in the cache, dropping the least recently used one
+    if it's full"""
+    with _lock:
+        _evaluations[key] = value
+        _evaluations.move_to_end(key)
+        if len(_evaluations) > ACL_CACHE_SIZE:
+            _evaluations.popitem(last=False)
+
+
+def _collection_acl(path):
+    """ACL a collection passes to its children, its own or the one it
+    inherits. None if the collection doesn't exist"""
+    with _lock:
+        res = _inherited.get(path)
+        if res is not None:
+            _inherited.move_to_end(path)
+            return res
+        gen = _inherited_gen
+    coll = Collection.find(path)
+    if coll is None:
+        return None
+    read_access, write_access = coll.get_acl_list()
+    res = None
+    if not read_access and not write_access and not _is_top(coll):
+        res = _collection_acl(coll.container)
+    if res is None:
+        res = (coll.path, sorted(read_access), sorted(write_access))
+    with _lock:
+        if gen == _inherited_gen:
+            _inherited[path] = res
+            if len(_inherited) > ACL_CACHE_SIZE:
+                _inherited.popitem(last=False)
+    return res
+
+
+def _is_top(obj):
+    """Check if an object has no parent to inherit an ACL from"""
+    container = getattr(obj, "container", None)
+    return (getattr(obj, "is_root", False) or
+            container in [None, "", "null", obj.path])
+
+
+def _on_notification(notif):
+    """Group memberships are stored in the users and the groups so any change
+    on these objects invalidates the precomputed sets. The ACL of a
+    collection applies to everything below it"""
+    if notif["object_type"] in [OBJ_GROUP, OBJ_USER]:
+        invalidate()
+    if notif["object_type"] == OBJ_GROUP:
+        invalidate_group_names()
+    if (notif["object_type"] == OBJ_COLLECTION and
+            notif["operation_name"] in [OP_UPDATE, OP_DELETE]):
+        invalidate_inherited()
+
+
+def acl_digest(obj):
+    """
+    Compute a digest of the ACL of a collection or a resource. The ACL of an
+    object which doesn't have one is inherited from its parent collections.
+
+    :param obj: A collection or a resource
+    :type obj: :class:`radon.model.collection.Collection` or
+      :class:`radon.model.resource.Resource`
+
+    :return: The digest of the ACL
+    :rtype: str
+    """
+    obj_type = type(obj).__name__
+    read_access, write_access = obj.get_acl_list()
+    inherited = None
+    # An object without ACL is evaluated with the ACL of the closest
+    # collection above it which has one
+    if not read_access and not write_access and not _is_top(obj):
+        parent_acl = _collection_acl(obj.container)
+        if parent_acl is not None:
+            inherited, read_access, write_access = parent_acl
+    acl = [obj_type, inherited, sorted(read_access), sorted(write_access)]
+    return hashlib.md5(json.dumps(acl).encode("utf-8")).hexdigest()
+
+
+def cached_user_can(digest, user, action):
+    """
+    Get the memoised permission of a user on the objects with an ACL, without
+    reading any object.
+
+    :param digest: The digest of the ACL, see :func:`acl_digest`
+    :type digest: str
+    :param user: The user
+    :type user: :class:`radon.model.user.User`
+    :param action: The action (read, write, edit, delete)
+    :type action: str
+
+    :return: True if the user can perform the action, None if it hasn't been
+      evaluated yet
+    :rtype: bool
+    """
+    _, signature = get_group_set(user)
+    return _evaluation_get((digest, signature, action))
+
+
+def get_group_set(user):
+    """
+    Get the set of groups of a user and the signature of the set. Sets are
+    precomputed per user and invalidated on group or user notifications.
+
+    :param user: The user
+    :type user: :class:`radon.model.user.User`
+
+    :return: A tuple (frozenset of group names, signature)
+    :rtype: tuple
+    """
+    login = getattr(user, "login", None)
+    if not login:
+        return (frozenset(), ANONYMOUS_SIGNATURE)
+    with _lock:
+        res = _group_sets.get(login)
+    if res is None:
+        groups = frozenset(user.groups or [])
+        if user.administrator:
+            # Administrators can do everything, whatever their groups
+            signature = "ADMINISTRATOR@"
+        else:
+            signature = hashlib.md5(
+                json.dumps(sorted(groups)).encode("utf-8")).hexdigest()
+        res = (groups, signature)
+        with _lock:
+            _group_sets[login] = res
+    return res
+
+
+def get_group_names():
+    """
+    Get the names of all the groups, read once until a group is created,
+    modified or deleted.
+
+    :return: The sorted list of the names of the groups
+    :rtype: list
+    """
+    global _group_names
+    with _lock:
+        names = _group_names
+        gen = _group_names_gen
+    if names is None:
+        names = sorted(group.name for group in Group.objects.all())
+        with _lock:
+            if gen == _group_names_gen:
+                _group_names = names
+    return names
+
+
+def invalidate():
+    """Clear the precomputed group sets and the cached evaluations"""
+    with _lock:
+        _group_sets.clear()
+        _evaluations.clear()
+
+
+def invalidate_inherited():
+    """Drop the ACLs of the collections, when one of them changes"""
+    global _inherited_gen
+    with _lock:
+        _inherited.clear()
+        _inherited_gen += 1
+
+
+def invalidate_group_names():
+    """Drop the list of the names of the groups"""
+    global _group_names, _group_names_gen
+    with _lock:
+        _group_names = None
+        _group_names_gen += 1
+
+
+def permissions(obj, user):
+    """
+    Get the permissions of a user on a collection or a resource, with the
+    keys used in the dictionaries of radon objects.
+
+    :param obj: A collection or a resource
+    :type obj: :class:`radon.model.collection.Collection` or
+      :class:`radon.model.resource.Resource`
+    :param user: The user
+    :type user: :class:`radon.model.user.User`
+
+    :return: A dictionary with the can_read, can_write, can_edit and
+      can_delete fields
+    :rtype: dict
+    """
+    digest = acl_digest(obj)
+    return {
+        "can_{}".format(action): user_can(obj, user, action, digest)
+        for action in ACTIONS
+    }
+
+
+def user_can(obj, user, action, digest=None):
+    """
+    Check if a user can perform an action on a collection or a resource.
+
+    :param obj: A collection or a resource
+    :type obj: :class:`radon.model.collection.Collection` or
+      :class:`radon.model.resource.Resource`
+    :param user: The user
+    :type user: :class:`radon.model.user.User`
+    :param action: The action (read, write, edit, delete)
+    :type action: str
+    :param digest: The digest of the ACL of the object if it's already known
+    :type digest: str
+
+    :return: True if the user can perform the action
+    :rtype: bool
+    """
+    if digest is None:
+        digest = acl_digest(obj)
+    _, signature = get_group_set(user)
+    key = (digest, signature, action)
+    res = _evaluation_get(key)
+    if res is None:
+        res = bool(obj.user_can(user, action))
+        _evaluation_set(key, res)
+    return res
+
+
+def user_signature(user):
+    """
+    Get the signature of the permissions of a user, two users with the same
+    signature have the same rights on every object.
+
+    :param user: The user
+    :type user: :class:`radon.model.user.User`
+
+    :return: The signature
+    :rtype: str
+    """
+    return get_group_set(user)[1]
+
+
+listener.register(_on_notification)
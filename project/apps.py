@@ -16,6 +16,8 @@ from django.apps import AppConfig
 from radon.model.collection import Collection
 from radon.database import initialise
 
+from project import listener
+
 
 class RadonAppConfig(AppConfig):
     """The Radon application. We need to initialise Cassandra connection when
@@ -29,3 +31,6 @@ class RadonAppConfig(AppConfig):
 
         # Try to get the root. It will be created if it doesn't exist
         _ = Collection.get_root()
+
+        # Notifications are used to invalidate what the worker keeps in memory
+        listener.start()
@@ -18,6 +18,7 @@
 
 ARCHIVE_VIEW = "archive:view"
 
+URL_BULK_METADATA = "archive/bulk_metadata.html"
 URL_DELETE_COLLECTION = "archive/delete.html"
 URL_DELETE_RESOURCE = "archive/resource/delete.html"
 URL_EDIT_COLLECTION = "archive/edit.html"
@@ -26,4 +27,7 @@ URL_NEW_COLLECTION = "archive/new.html"
 URL_NEW_RESOURCE = "archive/resource/new.html"
 URL_NEW_REFERENCE = "archive/resource/new_reference.html"
 URL_PREVIEW_RESOURCE = "archive/resource/preview.html"
+URL_PREVIEW_SCHEMA = "archive/resource/preview_schema.html"
+URL_PREVIEW_TABLE = "archive/resource/preview_table.html"
+URL_UPLOAD_RESOURCES = "archive/resource/upload.html"
 URL_VIEW_RESOURCE = "archive/resource/view.html"
\ No newline at end of file
@@ -0,0 +1,212 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Background jobs with progress reports.
+
+Long operations started from a page (e.g. the expansion of an archive) run in
+a pool of threads of the worker, the request returns straight away. The state
+of a job is saved in the "jobs" cache, at most once per
+JOB_PROGRESS_INTERVAL seconds while it runs, so its progress can be polled by
+the browser. The cache is shared by the workers (a file based cache by
+default), any worker can report it.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+# Number of jobs which run at the same time in a worker
+JOB_WORKERS = getattr(settings, "JOB_WORKERS", 2)
+# Number of seconds the state of a job is kept after it's finished
+JOB_RETENTION = getattr(settings, "JOB_RETENTION", 86400)
+# Minimum number of seconds between two saves of the progress of a job
+JOB_PROGRESS_INTERVAL = getattr(settings, "JOB_PROGRESS_INTERVAL", 1)
+# Maximum number of errors kept in the report of a job
+JOB_MAX_ERRORS = 100
+# Name of the cache which holds the state of the jobs
+JOB_CACHE = "jobs"
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+logger = logging.getLogger("radon")
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS,
+                               thread_name_prefix="radon-jobs")
+
+
+def _job_key(job_id):
+    """Cache key of the state of a job"""
+    return "job_{}".format(job_id)
+
+
+class Job():
+    """A background operation and its progress. The methods which update the
+    progress can be called from several threads."""
+
+    def __init__(self, owner, kind, title, link=None):
+        self.job_id = uuid.uuid4().hex
+        self.owner = owner
+        self.kind = kind
+        self.title = title
+        # Page the user can go back to
+        self.link = link
+        self.status = STATUS_PENDING
+        self.total = 0
+        self.done = 0
+        self.skipped = 0
+        self.errors = []
+        self.num_errors = 0
+        self.message = ""
+        self.started = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+        self._saved = 0
+
+    def add_total(self, count):
+        """
+        Increase the number of steps of the job.
+
+        :param count: The number of steps to add
+        :type count: int
+        """
+        with self._lock:
+            self.total += count
+        self.save()
+
+    def advance(self, count=1, skipped=0):
+        """
+        Record some steps which are done.
+
+        :param count: The number of steps done
+        :type count: int
+        :param skipped: The number of steps among them which didn't have
+          anything to do
+        :type skipped: int
+        """
+        with self._lock:
+            self.done += count
+            self.skipped += skipped
+        self.save()
+
+    def error(self, path, msg):
+        """
+        Record a step which has failed, it counts as done.
+
+        :param path: The path of the object the step is about
+        :type path: str
+        :param msg: The description of the error
+        :type msg: str
+        """
+        with self._lock:
+            self.done += 1
+            self.num_errors += 1
+            if len(self.errors) < JOB_MAX_ERRORS:
+                self.errors.append({"path": path, "error": msg})
+        self.save()
+
+    def save(self, force=False):
+        """
+        Save the state of the job in the cache.
+
+        :param force: Save it even if it has been saved recently
+        :type force: bool
+        """
+        now = time.time()
+        with self._lock:
+            if not force and now - self._saved < JOB_PROGRESS_INTERVAL:
+                return
+            self._saved = now
+            state = self.to_dict()
+        caches[JOB_CACHE].set(_job_key(self.job_id), state, JOB_RETENTION)
+
+    def to_dict(self):
+        """Return a dictionary which describes the job"""
+        return {
+            "id": self.job_id,
+            "owner": self.owner,
+            "kind": self.kind,
+            "title": self.title,
+            "link": self.link,
+            "status": self.status,
+            "total": self.total,
+            "done": self.done,
+            "skipped": self.skipped,
+            "errors": list(self.errors),
+            "num_errors": self.num_errors,
+            "message": self.message,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+def _run(job, func, args):
+    """Run the function of a job and record how it ended"""
+    job.status = STATUS_RUNNING
+    job.save(True)
+    try:
+        func(job, *args)
+        job.status = STATUS_DONE
+    except Exception as exc:
+        logger.exception("Job {} ({}) has failed".format(job.job_id, job.kind))
+        job.status = STATUS_FAILED
+        job.message = str(exc)
+    job.finished = time.time()
+    job.save(True)
+
+
+def get_job(job_id):
+    """
+    Get the state of a job.
+
+    :param job_id: The id of the job
+    :type job_id: str
+
+    :return: The dictionary which describes the job, None if it's unknown
+    :rtype: dict
+    """
+    return caches[JOB_CACHE].get(_job_key(job_id))
+
+
+def submit(owner, kind, title, func, *args, link=None):
+    """
+    Start a background job. The function is called with the job as first
+    argument, followed by the arguments given here.
+
+    :param owner: The login of the user who starts the job
+    :type owner: str
+    :param kind: The type of job
+    :type kind: str
+    :param title: A description of the job for the user
+    :type title: str
+    :param func: The function which does the work
+    :type func: function
+    :param link: The URL of the page the job is about
+    :type link: str
+
+    :return: The job
+    :rtype: :class:`Job`
+    """
+    job = Job(owner, kind, title, link)
+    job.save(True)
+    _executor.submit(_run, job, func, args)
+    return job
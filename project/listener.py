@@ -0,0 +1,149 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Subscription to the notifications published on MQTT by Radon.
+
+Each worker of the web server opens a single connection to the broker. The
+modules which keep data in memory (caches, indexes, streams) register a
+callback which is called for every notification received.
+"""
+
+import json
+import logging
+import threading
+
+import paho.mqtt.client as mqtt
+from django.conf import settings
+
+from radon.model.config import cfg
+from radon.model.notification import (
+    OBJ_COLLECTION,
+    OBJ_RESOURCE,
+)
+
+
+# Topics are built as "op_type/op_name/obj_type/obj_key"
+TOPIC_ALL = "#"
+
+logger = logging.getLogger("radon")
+
+_callbacks = []
+_lock = threading.Lock()
+_client = None
+
+
+def _on_connect(client, userdata, flags, rc):
+    """Subscribe again each time the connection is (re)established"""
+    if rc == 0:
+        client.subscribe(TOPIC_ALL)
+    else:
+        logger.warning("Connection to the MQTT broker refused ({})".format(rc))
+
+
+def _on_message(client, userdata, msg):
+    """Decode a notification and dispatch it to the registered callbacks"""
+    notif = parse_message(msg.topic, msg.payload)
+    if not notif:
+        return
+    with _lock:
+        callbacks = list(_callbacks)
+    for callback in callbacks:
+        try:
+            callback(notif)
+        except Exception:
+            # A faulty consumer mustn't stop the others
+            logger.exception("Notification callback {} failed".format(callback))
+
+
+def parse_message(topic, payload):
+    """
+    Build a dictionary from a MQTT message, with the same fields as a stored
+    notification.
+
+    :param topic: The topic of the message (op_type/op_name/obj_type/obj_key)
+    :type topic: str
+    :param payload: The JSON payload of the message
+    :type payload: bytes
+
+    :return: A dictionary which describes the notification, None if the topic
+      isn't a Radon topic
+    :rtype: dict
+    """
+    parts = topic.split("/", 3)
+    if len(parts) < 3:
+        return None
+    op_type, op_name, obj_type = parts[:3]
+    obj_key = parts[3] if len(parts) == 4 else ""
+    # Superfluous slashes are removed from the topic when it's published
+    if obj_type in [OBJ_COLLECTION, OBJ_RESOURCE]:
+        obj_key = "/" + obj_key
+        if obj_type == OBJ_COLLECTION and obj_key != "/":
+            obj_key += "/"
+    try:
+        payload = json.loads(payload or "{}")
+    except (TypeError, ValueError):
+        payload = {}
+    if not isinstance(payload, dict):
+        payload = {}
+    return {
+        "operation_type": op_type,
+        "operation_name": op_name,
+        "object_type": obj_type,
+        "object_key": obj_key,
+        "sender": payload.get("meta", {}).get("sender", ""),
+        "payload": payload,
+    }
+
+
+def register(callback):
+    """
+    Register a function called with each notification received. The function
+    is called from the thread of the MQTT client so it has to be quick.
+
+    :param callback: A function which takes a notification dictionary
+    :type callback: function
+    """
+    with _lock:
+        if callback not in _callbacks:
+            _callbacks.append(callback)
+
+
+def start():
+    """Open the connection to the broker for the current process. It doesn't
+    do anything if it's already started or if the listener is disabled in the
+    settings."""
+    global _client
+    if not getattr(settings, "NOTIFICATION_LISTENER", True):
+        return
+    with _lock:
+        if _client is not None:
+            return
+        _client = mqtt.Client()
+        _client.on_connect = _on_connect
+        _client.on_message = _on_message
+        # The client thread reconnects on its own if the broker isn't there
+        _client.connect_async(cfg.mqtt_host)
+        _client.loop_start()
+
+
+def unregister(callback):
+    """
+    Remove a function registered with :meth:`register`.
+
+    :param callback: The function to remove
+    :type callback: function
+    """
+    with _lock:
+        if callback in _callbacks:
+            _callbacks.remove(callback)
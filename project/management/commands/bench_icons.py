@@ -0,0 +1,71 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template import engines
+
+
+ROW_TEMPLATES = [
+    "archive/collection/collection_entry.html",
+    "archive/resource/resource_entry.html",
+]
+
+
+class Command(BaseCommand):
+    """Measure the cost of a row of a collection listing, with the icons
+    rendered by bs_icon and by the cached icon tag"""
+
+    help = "Benchmark the rendering of the icons in the listing templates"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000,
+                            help="Number of rows rendered for each template")
+
+    def handle(self, *args, **options):
+        engine = engines["django"]
+        rows = options["rows"]
+        entry = {
+            "name": "entry",
+            "path": "/bench/entry",
+            "type": "text/plain",
+            "can_read": True,
+            "can_delete": True,
+        }
+        ctx = {"collection": entry, "resource": entry}
+        # Without a cache directory, bs_icon downloads the icon from the CDN
+        # on every rendering
+        icons_cache = getattr(settings, "BS_ICONS_CACHE", None)
+        self.stdout.write("bs_icon source: {}".format(
+            icons_cache or "CDN (BS_ICONS_CACHE isn't set)"))
+
+        for name in ROW_TEMPLATES:
+            source = engine.get_template(name).template.source
+            # The same row, with the icons of django_bootstrap_icons
+            before_source = (source
+                             .replace("{% load radon_icons %}", "{% load bootstrap_icons %}")
+                             .replace("{% icon ", "{% bs_icon "))
+            self.stdout.write(name)
+            for label, tmpl in [("bs_icon", engine.from_string(before_source)),
+                                ("icon", engine.from_string(source))]:
+                # First rendering is excluded (icon files loaded from disk)
+                tmpl.render(ctx)
+                start = time.perf_counter()
+                for _ in range(rows):
+                    tmpl.render(ctx)
+                elapsed = time.perf_counter() - start
+                self.stdout.write("  {:<8} {:>10.1f} us/row".format(
+                    label, elapsed * 1000000 / rows))
@@ -0,0 +1,152 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import uuid
+
+
+class RangeNotSatisfiable(Exception):
+    """A Range header whose ranges are all beyond the end of the content"""
+
+
+def iter_range(chunks, start, stop):
+    """
+    Get the bytes between two offsets from an iterator of chunks. Chunks are
+    consumed one by one and the iteration stops as soon as the range is
+    complete so the end of the content isn't read.
+
+    :param chunks: An iterator of bytes
+    :type chunks: iterator
+    :param start: The offset of the first byte
+    :type start: int
+    :param stop: The offset of the byte after the last one (exclusive)
+    :type stop: int
+
+    :return: An iterator of bytes
+    :rtype: iterator
+    """
+    offset = 0
+    try:
+        for chk in chunks:
+            end = offset + len(chk)
+            if end > start:
+                yield chk[max(start - offset, 0):stop - offset]
+            offset = end
+            if offset >= stop:
+                break
+    finally:
+        # Release the underlying connection/cursor if it's a generator
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+
+
+def multipart_byteranges(get_chunks, ranges, len_content, content_type):
+    """
+    Build the body of a multipart/byteranges response.
+
+    :param get_chunks: A function which returns a new iterator on the content
+    :type get_chunks: function
+    :param ranges: A list of (start, stop) pairs, stop is exclusive
+    :type ranges: list
+    :param len_content: The total size of the content
+    :type len_content: int
+    :param content_type: The mimetype of the content
+    :type content_type: str
+
+    :return: A tuple (boundary, length of the body, iterator on the body)
+    :rtype: tuple
+    """
+    boundary = uuid.uuid4().hex
+    headers = [
+        ("--{}\r\nContent-Type: {}\r\nContent-Range: bytes {}-{}/{}\r\n\r\n".format(
+            boundary, content_type, start, stop - 1, len_content)).encode()
+        for start, stop in ranges
+    ]
+    end = "--{}--\r\n".format(boundary).encode()
+    length = (sum(len(h) for h in headers) +
+              sum(stop - start + 2 for start, stop in ranges) +
+              len(end))
+
+    def body():
+        for header, (start, stop) in zip(headers, ranges):
+            yield header
+            for chk in iter_range(get_chunks(), start, stop):
+                yield chk
+            yield b"\r\n"
+        yield end
+
+    return boundary, length, body()
+
+
+def parse_range_header(specifier, len_content):
+    """
+    Parses a range header into a list of pairs (start, stop), stop is
+    exclusive. An invalid header gives an empty list, it has to be ignored.
+
+    :param specifier: The value of the Range header
+    :type specifier: str
+    :param len_content: The total size of the content
+    :type len_content: int
+
+    :return: A list of (start, stop) pairs
+    :rtype: list
+
+    :raises RangeNotSatisfiable: If none of the ranges overlaps the content
+    """
+    if not specifier or "=" not in specifier:
+        return []
+
+    ranges = []
+    unit, byte_set = specifier.split("=", 1)
+    unit = unit.strip().lower()
+
+    if unit != "bytes":
+        return []
+
+    unsatisfiable = False
+    for val in byte_set.split(","):
+        val = val.strip()
+        if "-" not in val:
+            return []
+
+        if val.startswith("-"):
+            # suffix-byte-range-spec: this form specifies the last N
+            # bytes of an entity-body
+            if int(val) == 0:
+                unsatisfiable = True
+                continue
+            start = len_content + int(val)
+            if start < 0:
+                start = 0
+            stop = len_content
+        else:
+            # byte-range-spec: first-byte-pos "-" [last-byte-pos]
+            start, last = val.split("-", 1)
+            start = int(start)
+            # Add 1 to make stop exclusive (HTTP spec is inclusive)
+            stop = int(last) + 1 if last else len_content
+            if last and stop <= start:
+                # The last byte is before the first one
+                return []
+            if start >= len_content:
+                # Starts after the end of the content, e.g. the download of a
+                # complete file is resumed
+                unsatisfiable = True
+                continue
+
+        ranges.append((start, stop))
+
+    if not ranges and unsatisfiable:
+        raise RangeNotSatisfiable(specifier)
+    return ranges
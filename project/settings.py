@@ -23,7 +23,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import multiprocessing
 import os
+import tempfile
 from pathlib import Path
 from django.core.management.utils import get_random_secret_key
 from dotenv import load_dotenv
@@ -97,7 +99,6 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -105,6 +106,13 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Templates are compiled once per worker, even in DEBUG mode
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -125,6 +133,43 @@ AUTH_LDAP_SERVER_URI = None
 AUTH_LDAP_USER_DN_TEMPLATE = None
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'radon-default',
+    },
+    # Rendered fragments of templates (rows of the collection listings)
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'radon-fragments',
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+        },
+    },
+    # Derivatives of the resources (thumbnails), keyed by content version
+    'derivatives': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'radon-derivatives',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # State of the background jobs, shared by the workers of the server so
+    # the progress of a job can be polled from any of them. Use memcached or
+    # Redis when the workers run on several hosts
+    'jobs': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), "radon-jobs"),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -189,3 +234,137 @@ REST_FRAMEWORK = {
 AUTH_LDAP_SERVER_URI = None
 AUTH_LDAP_USER_DN_TEMPLATE = None
 
+
+# Children of a collection are materialised in batches by a bounded pool of
+# workers when a collection is displayed
+ARCHIVE_LISTING_BATCH_SIZE = 50
+ARCHIVE_LISTING_WORKERS = 8
+# Sorted names of the children of a collection are cached (in seconds)
+ARCHIVE_INDEX_TIMEOUT = 60
+# Number of children displayed in a page of a collection
+ARCHIVE_PAGE_SIZE = 100
+ARCHIVE_PAGE_SIZES = [25, 50, 100, 250, 500]
+
+# Each worker subscribes to the notifications published on MQTT to keep its
+# caches up to date
+NOTIFICATION_LISTENER = True
+# Maximum number of permission evaluations, and of ACLs inherited from the
+# collections, kept in memory by a worker
+ACL_CACHE_SIZE = 10000
+
+# Rendered rows of the collection listings are cached (in seconds)
+ARCHIVE_ROW_CACHE_TIMEOUT = 3600
+# Maximum number of subcollections returned by a call to the tree endpoint
+ARCHIVE_TREE_PAGE_SIZE = 200
+# Maximum number of byte ranges accepted in a download request, the whole
+# content is sent if there are more
+DOWNLOAD_MAX_RANGES = 16
+# Collection exports: number of resources read in advance and number of
+# chunks buffered for each of them
+EXPORT_READ_AHEAD = 4
+EXPORT_MEMBER_BUFFER = 4
+# Previews only show the beginning of the content (in bytes), rendered
+# previews are cached (in seconds)
+PREVIEW_MAX_BYTES = 65536
+PREVIEW_CACHE_TIMEOUT = 3600
+# Tabular previews: maximum number of rows parsed, rows displayed per page and
+# maximum size of the footer read for Parquet and Arrow files (in bytes)
+PREVIEW_MAX_ROWS = 1000
+PREVIEW_TABLE_PAGE_SIZE = 50
+PREVIEW_FOOTER_MAX_BYTES = 1048576
+# Stored contents are read from the start to find their footer, the schema
+# isn't previewed above this size (in bytes)
+PREVIEW_FOOTER_MAX_SIZE = 67108864
+# Number of seconds waited for the server of a reference when its content is
+# read for a preview
+REFERENCE_TIMEOUT = 10
+# Thumbnails of images (needs Pillow) are generated by a pool of processes,
+# for images smaller than DERIVATIVE_MAX_BYTES, and kept DERIVATIVE_TIMEOUT
+# seconds. A generation which failed for a transient reason is tried again
+# after DERIVATIVE_RETRY_TIMEOUT seconds. A request waits at most
+# THUMBNAIL_WAIT seconds for a thumbnail
+DERIVATIVE_WORKERS = 2
+DERIVATIVE_MAX_BYTES = 20971520
+DERIVATIVE_TIMEOUT = 30 * 24 * 3600
+DERIVATIVE_RETRY_TIMEOUT = 300
+THUMBNAIL_SIZE = 256
+THUMBNAIL_WAIT = 5
+# Number of search results displayed per page
+SEARCH_PAGE_SIZE = 25
+# Number of seconds a page of search results is cached, cached searches are
+# also dropped when an object of their scope changes
+SEARCH_CACHE_TIMEOUT = 300
+# Search completion: maximum number of collection paths kept in memory,
+# number of seconds the indexed field names are kept and number of
+# completions returned
+COMPLETION_MAX_PATHS = 100000
+COMPLETION_FIELDS_TIMEOUT = 60
+COMPLETION_LIMIT = 10
+# Facets of the search results: fixed index fields (name, label), maximum
+# number of values of a facet and maximum number of top-level collections
+# counted. The custom index fields are added to the fixed ones.
+SEARCH_FACET_FIELDS = [
+    ("mimetype", "Type"),
+    ("owner", "Owner"),
+]
+SEARCH_FACET_LIMIT = 10
+SEARCH_FACET_COLLECTIONS = 20
+# Uploads: staging directory of the chunked uploads, size of the chunks (in
+# bytes), number of seconds an upload which isn't committed is kept, number
+# of chunks sent in parallel by a browser and number of times a failed chunk
+# is sent again. Form uploads aren't staged, they're streamed to the store
+# with at most UPLOAD_PIPE_BUFFER blocks in memory
+UPLOAD_STAGING_DIR = os.path.join(tempfile.gettempdir(), "radon-uploads")
+UPLOAD_CHUNK_SIZE = 8388608
+UPLOAD_STAGING_TIMEOUT = 86400
+UPLOAD_CONCURRENCY = 4
+UPLOAD_RETRIES = 3
+UPLOAD_PIPE_BUFFER = 16
+# Background jobs: number of jobs run at the same time by a worker and number
+# of seconds the progress of a finished job is kept. The progress is saved in
+# the "jobs" cache
+JOB_WORKERS = 2
+JOB_RETENTION = 86400
+# Expansion of uploaded archives: number of threads which write the contents,
+# number of creation requests sent before their responses are awaited,
+# maximum number of members of an archive and maximum size of its expanded
+# content (in bytes, for the decompression and the members together)
+EXPAND_WORKERS = 8
+EXPAND_BATCH_SIZE = 100
+EXPAND_MAX_ENTRIES = 100000
+EXPAND_MAX_BYTES = 10737418240
+# Bulk updates (metadata, ACL): number of threads which read the objects,
+# number of update requests sent before their responses are awaited and
+# number of seconds waited between two batches
+BULK_WORKERS = 8
+BULK_BATCH_SIZE = 100
+BULK_BATCH_DELAY = 0
+# Activity feed: number of characters of a payload displayed before it's
+# expanded and number of threads which look up the objects of a page
+ACTIVITY_PAYLOAD_CHARS = 500
+ACTIVITY_WORKERS = 8
+# Activity history: number of notifications of a page, number of days
+# searched when the range has no start, maximum number of day partitions
+# read for a page and number of rows read by a query. The days which are
+# over are read from an index once "manage.py index_notifications" has been
+# run (every night), the other days are scanned
+ACTIVITY_PAGE_SIZE = 20
+ACTIVITY_HISTORY_DAYS = 365
+ACTIVITY_SCAN_DAYS = 31
+ACTIVITY_FETCH_SIZE = 200
+# Number of threads of a worker of the server, keep it in line with
+# gunicorn.conf
+SERVER_THREADS = multiprocessing.cpu_count() * 2 + 1
+# Live activity stream: number of rows kept for a slow client, number of
+# seconds between two keepalive comments, maximum number of clients per
+# worker and number of seconds a connection is kept open. Each client holds
+# a thread of the server, the stream leaves some threads to the other
+# requests. Use an asynchronous worker class to serve many more clients
+ACTIVITY_STREAM_QUEUE = 100
+ACTIVITY_STREAM_KEEPALIVE = 15
+ACTIVITY_STREAM_RESERVED_THREADS = 4
+ACTIVITY_STREAM_MAX_CLIENTS = max(
+    SERVER_THREADS - ACTIVITY_STREAM_RESERVED_THREADS, 1)
+ACTIVITY_STREAM_MAX_AGE = 300
+# Export of the notifications: number of records written in a chunk
+EXPORT_CHUNK_SIZE = 100
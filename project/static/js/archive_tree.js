@@ -0,0 +1,102 @@
+
+// Collection tree of the archive sidebar. Subcollections are loaded from the
+// tree endpoint when a node is expanded and kept in the session storage so a
+// node is only fetched once per browser session.
+
+var ARCHIVE_TREE_PREFIX = "radon-tree:";
+
+function archive_tree_fetch(base_url, path, after) {
+    var key = ARCHIVE_TREE_PREFIX + path + "|" + (after || "");
+    var cached = sessionStorage.getItem(key);
+    if (cached) {
+        return Promise.resolve(JSON.parse(cached));
+    }
+    var url = base_url + encodeURI(path);
+    if (after) {
+        url += "?after=" + encodeURIComponent(after);
+    }
+    return fetch(url, {credentials: "same-origin"})
+        .then(function (resp) {
+            if (!resp.ok) {
+                throw new Error(resp.status);
+            }
+            return resp.json();
+        })
+        .then(function (data) {
+            try {
+                sessionStorage.setItem(key, JSON.stringify(data));
+            } catch (e) {
+                // Storage full, the tree still works without the cache
+            }
+            return data;
+        });
+}
+
+function archive_tree_node(tree, child) {
+    var li = document.createElement("li");
+    var toggle = document.createElement("a");
+    toggle.href = "#";
+    toggle.className = "archive-tree-toggle";
+    toggle.textContent = "+";
+    var link = document.createElement("a");
+    link.href = tree.dataset.viewUrl + child.path;
+    link.textContent = child.name;
+    var ul = document.createElement("ul");
+    ul.className = "archive-tree-children d-none";
+    toggle.addEventListener("click", function (ev) {
+        ev.preventDefault();
+        if (!ul.classList.contains("d-none")) {
+            ul.classList.add("d-none");
+            toggle.textContent = "+";
+            return;
+        }
+        ul.classList.remove("d-none");
+        toggle.textContent = "-";
+        if (!li.dataset.loaded) {
+            li.dataset.loaded = "1";
+            archive_tree_load(tree, ul, child.path, null);
+        }
+    });
+    li.appendChild(toggle);
+    li.appendChild(link);
+    li.appendChild(ul);
+    return li;
+}
+
+function archive_tree_load(tree, ul, path, after) {
+    archive_tree_fetch(tree.dataset.treeUrl, path, after).then(function (data) {
+        data.children.forEach(function (child) {
+            ul.appendChild(archive_tree_node(tree, child));
+        });
+        if (data.next) {
+            // Next page of a large collection, loaded on demand
+            var li = document.createElement("li");
+            var more = document.createElement("a");
+            more.href = "#";
+            more.textContent = "more ...";
+            more.addEventListener("click", function (ev) {
+                ev.preventDefault();
+                ul.removeChild(li);
+                archive_tree_load(tree, ul, path, data.next);
+            });
+            li.appendChild(more);
+            ul.appendChild(li);
+        }
+    }).catch(function () {
+        var li = document.createElement("li");
+        li.className = "text-muted";
+        li.textContent = "unavailable";
+        ul.appendChild(li);
+    });
+}
+
+function archive_tree_init(tree_id) {
+    var tree = document.getElementById(tree_id);
+    if (!tree) {
+        return;
+    }
+    var ul = document.createElement("ul");
+    ul.className = "archive-tree-children";
+    tree.appendChild(ul);
+    archive_tree_load(tree, ul, "/", null);
+}
@@ -0,0 +1,61 @@
+
+
+// Progress of a background job. The state of the job is polled until it's
+// finished.
+
+var JOB_POLL_INTERVAL = 1000;
+
+function job_render(root, job) {
+    var bar = root.querySelector(".job-bar");
+    var summary = root.querySelector(".job-summary");
+    var errors = root.querySelector(".job-errors");
+    var percent = job.total ? Math.floor(100 * job.done / job.total) : 0;
+    if (job.status === "done") {
+        percent = 100;
+        bar.classList.add(job.num_errors ? "bg-warning" : "bg-success");
+    } else if (job.status === "failed") {
+        bar.classList.add("bg-danger");
+    }
+    bar.style.width = percent + "%";
+    bar.textContent = percent + "%";
+    var text = job.done + " / " + job.total + " done";
+    if (job.skipped) {
+        text += ", " + job.skipped + " unchanged";
+    }
+    if (job.num_errors) {
+        text += ", " + job.num_errors + " errors";
+    }
+    text += " (" + job.status + ")";
+    if (job.message) {
+        text += ": " + job.message;
+    }
+    summary.textContent = text;
+    errors.innerHTML = "";
+    job.errors.forEach(function (err) {
+        var item = document.createElement("li");
+        item.textContent = err.path + ": " + err.error;
+        errors.appendChild(item);
+    });
+}
+
+function job_init(id) {
+    var root = document.getElementById(id);
+    var url = root.dataset.statusUrl;
+
+    function poll() {
+        fetch(url, {credentials: "same-origin"}).then(function (resp) {
+            if (!resp.ok) {
+                throw new Error(resp.statusText);
+            }
+            return resp.json();
+        }).then(function (job) {
+            job_render(root, job);
+            if (job.status === "pending" || job.status === "running") {
+                setTimeout(poll, JOB_POLL_INTERVAL);
+            }
+        }).catch(function () {
+            setTimeout(poll, 5 * JOB_POLL_INTERVAL);
+        });
+    }
+    poll();
+}
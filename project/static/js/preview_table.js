@@ -0,0 +1,42 @@
+
+
+// Pagination of the tables of the previews. The rows read are all in the
+// page, only one page of them is displayed at a time.
+
+function preview_table_show(table, page, page_size, nav) {
+    var rows = table.tBodies[0].rows;
+    var num_pages = Math.max(Math.ceil(rows.length / page_size), 1);
+    for (var i = 0; i < rows.length; i++) {
+        var visible = i >= page * page_size && i < (page + 1) * page_size;
+        rows[i].style.display = visible ? "" : "none";
+    }
+    nav.textContent = "";
+    if (num_pages < 2) {
+        return;
+    }
+    var link = function (label, target, enabled) {
+        var btn = document.createElement("button");
+        btn.type = "button";
+        btn.className = "btn btn-sm btn-outline-secondary mx-1";
+        btn.textContent = label;
+        btn.disabled = !enabled;
+        btn.addEventListener("click", function () {
+            preview_table_show(table, target, page_size, nav);
+        });
+        nav.appendChild(btn);
+    };
+    link("previous", page - 1, page > 0);
+    var label = document.createElement("span");
+    label.textContent = "Page " + (page + 1) + " of " + num_pages;
+    nav.appendChild(label);
+    link("next", page + 1, page < num_pages - 1);
+}
+
+function preview_table_init() {
+    var divs = document.querySelectorAll(".preview-table");
+    for (var i = 0; i < divs.length; i++) {
+        var page_size = parseInt(divs[i].dataset.pageSize, 10) || 50;
+        preview_table_show(divs[i].querySelector("table"), 0, page_size,
+                           divs[i].querySelector(".preview-table-pages"));
+    }
+}
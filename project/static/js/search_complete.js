@@ -0,0 +1,54 @@
+
+
+// Completion of the search box. Requests are sent once the user stops typing
+// and the answers are kept for the page so a prefix is only asked once.
+
+var SEARCH_COMPLETE_DELAY = 200;
+
+function search_complete_init(input) {
+    var list = document.getElementById(input.getAttribute("list"));
+    var cache = {};
+    var timer = null;
+    var show = function (suggestions) {
+        list.textContent = "";
+        suggestions.forEach(function (value) {
+            var option = document.createElement("option");
+            option.value = value;
+            list.appendChild(option);
+        });
+    };
+    input.addEventListener("input", function () {
+        var prefix = input.value.trim();
+        clearTimeout(timer);
+        if (!prefix) {
+            show([]);
+            return;
+        }
+        if (cache[prefix]) {
+            show(cache[prefix]);
+            return;
+        }
+        timer = setTimeout(function () {
+            var url = input.dataset.completeUrl + "?q=" + encodeURIComponent(prefix);
+            fetch(url, {credentials: "same-origin"})
+                .then(function (resp) {
+                    return resp.ok ? resp.json() : {suggestions: []};
+                })
+                .then(function (data) {
+                    cache[prefix] = data.suggestions;
+                    // The user may have typed something else in the meantime
+                    if (input.value.trim() === prefix) {
+                        show(data.suggestions);
+                    }
+                })
+                .catch(function () {});
+        }, SEARCH_COMPLETE_DELAY);
+    });
+}
+
+document.addEventListener("DOMContentLoaded", function () {
+    var inputs = document.querySelectorAll("input[data-complete-url]");
+    for (var i = 0; i < inputs.length; i++) {
+        search_complete_init(inputs[i]);
+    }
+});
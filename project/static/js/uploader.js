@@ -0,0 +1,163 @@
+
+
+// Multi-file uploader. Files are sent in chunks, at most "concurrency" chunks
+// are in flight at the same time whatever the number of files, and a chunk
+// which fails is sent again up to "retries" times.
+
+function uploader_request(url, body, csrf, content_type) {
+    var headers = {"X-CSRFToken": csrf};
+    if (content_type) {
+        headers["Content-Type"] = content_type;
+    }
+    return fetch(url, {
+        method: "POST",
+        credentials: "same-origin",
+        headers: headers,
+        body: body
+    }).then(function (resp) {
+        return resp.json().catch(function () {
+            return {};
+        }).then(function (data) {
+            if (!resp.ok) {
+                throw new Error(data.error || resp.statusText);
+            }
+            return data;
+        });
+    });
+}
+
+function uploader_init(id) {
+    var root = document.getElementById(id);
+    var drop = root.querySelector(".uploader-drop");
+    var input = root.querySelector("input[type=file]");
+    var list = root.querySelector(".uploader-files");
+    var csrf = root.querySelector("input[name=csrfmiddlewaretoken]").value;
+    var concurrency = parseInt(root.dataset.concurrency, 10) || 4;
+    var retries = parseInt(root.dataset.retries, 10) || 3;
+    // Chunks waiting for a free slot
+    var queue = [];
+    var running = 0;
+
+    var url = function (template, upload_id) {
+        return template.replace("UPLOAD_ID", upload_id);
+    };
+
+    var pump = function () {
+        while (running < concurrency && queue.length) {
+            var task = queue.shift();
+            running++;
+            task().then(function () {
+                running--;
+                pump();
+            });
+        }
+    };
+
+    var send_chunk = function (upload, index, attempt) {
+        var start = index * upload.chunk_size;
+        var blob = upload.file.slice(start, start + upload.chunk_size);
+        return uploader_request(
+            url(root.dataset.chunkUrl, upload.upload_id) + "?index=" + index,
+            blob, csrf, "application/octet-stream"
+        ).then(function () {
+            upload.done++;
+            upload.show();
+            if (upload.done === upload.num_chunks) {
+                return commit(upload);
+            }
+        }).catch(function (err) {
+            if (attempt < retries) {
+                queue.push(function () {
+                    return send_chunk(upload, index, attempt + 1);
+                });
+            } else {
+                upload.fail(err);
+            }
+        });
+    };
+
+    var commit = function (upload) {
+        upload.status.textContent = "saving ...";
+        return uploader_request(url(root.dataset.commitUrl, upload.upload_id),
+                                null, csrf)
+            .then(function (data) {
+                upload.bar.style.width = "100%";
+                upload.status.textContent =
+                    data.status === 0 ? "done" :
+                    data.status === 1 ? "failed" : "pending";
+            })
+            .catch(function (err) {
+                upload.fail(err);
+            });
+    };
+
+    var add_file = function (file) {
+        var li = document.createElement("li");
+        li.className = "mb-2";
+        li.innerHTML = '<div class="d-flex"><span class="name"></span>' +
+            '<span class="status ms-auto text-muted"></span></div>' +
+            '<div class="progress"><div class="progress-bar"></div></div>';
+        li.querySelector(".name").textContent = file.name;
+        list.appendChild(li);
+        var upload = {
+            file: file,
+            done: 0,
+            bar: li.querySelector(".progress-bar"),
+            status: li.querySelector(".status")
+        };
+        upload.show = function () {
+            var pct = Math.floor(100 * upload.done / upload.num_chunks);
+            upload.bar.style.width = pct + "%";
+            upload.status.textContent = pct + "%";
+        };
+        upload.fail = function (err) {
+            upload.bar.classList.add("bg-danger");
+            upload.status.textContent = "error: " + err.message;
+        };
+        upload.status.textContent = "waiting ...";
+        queue.push(function () {
+            return uploader_request(root.dataset.startUrl, JSON.stringify({
+                name: file.name,
+                size: file.size,
+                mimetype: file.type
+            }), csrf, "application/json").then(function (data) {
+                upload.upload_id = data.upload_id;
+                upload.chunk_size = data.chunk_size;
+                upload.num_chunks = data.num_chunks;
+                for (var i = 0; i < data.num_chunks; i++) {
+                    (function (index) {
+                        queue.push(function () {
+                            return send_chunk(upload, index, 0);
+                        });
+                    })(i);
+                }
+            }).catch(function (err) {
+                upload.fail(err);
+            });
+        });
+        pump();
+    };
+
+    var add_files = function (files) {
+        for (var i = 0; i < files.length; i++) {
+            add_file(files[i]);
+        }
+    };
+
+    drop.addEventListener("dragover", function (evt) {
+        evt.preventDefault();
+        drop.classList.add("uploader-over");
+    });
+    drop.addEventListener("dragleave", function () {
+        drop.classList.remove("uploader-over");
+    });
+    drop.addEventListener("drop", function (evt) {
+        evt.preventDefault();
+        drop.classList.remove("uploader-over");
+        add_files(evt.dataTransfer.files);
+    });
+    input.addEventListener("change", function () {
+        add_files(input.files);
+        input.value = "";
+    });
+}
@@ -0,0 +1,79 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bootstrap icons rendered from the SVG files bundled in project/static/icons,
+without any network access. The markup of an icon only depends on its
+parameters so it's computed once per process, icons which can't be found
+aren't kept.
+"""
+
+import os
+import threading
+import xml.dom.minidom
+from xml.parsers.expat import ExpatError
+
+from django import template
+from django.utils.safestring import mark_safe
+from django_bootstrap_icons.templatetags.bootstrap_icons import render_svg
+
+register = template.Library()
+
+# Directory of the SVG files of the icons
+ICONS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                         "static", "icons")
+
+MSG_NOT_FOUND = "Icon <{}> does not exist"
+
+_lock = threading.Lock()
+_rendered = {}
+
+
+def render_icon(name, size=None, color=None, extra_classes=None):
+    """
+    Render the SVG markup of a bootstrap icon. The markup only depends on the
+    parameters so it's computed once per process.
+
+    :param name: The name of the icon
+    :type name: str
+    :param size: The size of the icon
+    :type size: str
+    :param color: The color of the icon
+    :type color: str
+    :param extra_classes: Classes added to the svg element
+    :type extra_classes: str
+
+    :return: The SVG markup
+    :rtype: str
+    """
+    key = (name, size, color, extra_classes)
+    svg = _rendered.get(key)
+    if svg is not None:
+        return svg
+    path = os.path.join(ICONS_DIR, "{}.svg".format(os.path.basename(name)))
+    try:
+        content = xml.dom.minidom.parse(path)
+    except (OSError, ExpatError):
+        # Not kept, the file may be added later
+        return MSG_NOT_FOUND.format(name)
+    svg = render_svg(content, size, color, extra_classes)
+    with _lock:
+        _rendered[key] = svg
+    return svg
+
+
+@register.simple_tag
+def icon(name, size=None, color=None, extra_classes=None):
+    """Same as bs_icon, with the bundled icons and a cached rendering"""
+    return mark_safe(render_icon(name, size, color, extra_classes))
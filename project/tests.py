@@ -0,0 +1,157 @@
+# Radon Copyright 2021, University of Oxford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from project import acl
+from project.templatetags import radon_icons
+from project.ranges import (
+    RangeNotSatisfiable,
+    parse_range_header,
+)
+
+
+class FakeObject():
+    """A collection or a resource with an ACL"""
+
+    def __init__(self, path, container, read_access=(), write_access=(),
+                 readers=()):
+        self.path = path
+        self.container = container
+        self.is_root = path == "/"
+        self.read_access = list(read_access)
+        self.write_access = list(write_access)
+        # Logins of the users who can read the object, as radon-lib would
+        # evaluate it
+        self.readers = readers
+
+    def get_acl_list(self):
+        return (self.read_access, self.write_access)
+
+    def user_can(self, user, action):
+        return user.login in self.readers
+
+
+class FakeUser():
+
+    def __init__(self, login, groups):
+        self.login = login
+        self.groups = groups
+        self.administrator = False
+
+
+class AclCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        acl.invalidate()
+        acl.invalidate_inherited()
+        self.collections = {
+            "/": FakeObject("/", "null"),
+            "/open/": FakeObject("/open/", "/", read_access=["public"]),
+            "/closed/": FakeObject("/closed/", "/", read_access=["staff"]),
+        }
+        patcher = mock.patch.object(acl.Collection, "find",
+                                    side_effect=self.collections.get)
+        self.find = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(acl.invalidate)
+        self.addCleanup(acl.invalidate_inherited)
+
+    def test_empty_acl_inherits_parent(self):
+        user = FakeUser("alice", ["public"])
+        child_open = FakeObject("/open/a", "/open/", readers=["alice"])
+        child_closed = FakeObject("/closed/a", "/closed/")
+        self.assertNotEqual(acl.acl_digest(child_open),
+                            acl.acl_digest(child_closed))
+        self.assertTrue(acl.user_can(child_open, user, "read"))
+        self.assertFalse(acl.user_can(child_closed, user, "read"))
+
+    def test_same_acl_shares_evaluation(self):
+        first = FakeObject("/open/a", "/open/", read_access=["public"])
+        second = FakeObject("/closed/b", "/closed/", read_access=["public"])
+        self.assertEqual(acl.acl_digest(first), acl.acl_digest(second))
+
+    def test_root_without_acl(self):
+        # The search of an inherited ACL stops at the root
+        child = FakeObject("/a", "/")
+        sibling = FakeObject("/b", "/")
+        explicit = FakeObject("/c", "/", read_access=["public"])
+        self.assertEqual(acl.acl_digest(child), acl.acl_digest(sibling))
+        self.assertNotEqual(acl.acl_digest(child), acl.acl_digest(explicit))
+
+    def test_inherited_acl_cached(self):
+        children = [FakeObject("/open/{}".format(idx), "/open/")
+                    for idx in range(10)]
+        digests = set(acl.acl_digest(child) for child in children)
+        self.assertEqual(len(digests), 1)
+        self.assertEqual(self.find.call_count, 1)
+
+    def test_collection_update_invalidates(self):
+        child = FakeObject("/open/a", "/open/")
+        before = acl.acl_digest(child)
+        self.collections["/open/"].read_access = ["staff"]
+        self.assertEqual(acl.acl_digest(child), before)
+        acl._on_notification({"object_type": acl.OBJ_COLLECTION,
+                              "operation_name": acl.OP_UPDATE})
+        self.assertNotEqual(acl.acl_digest(child), before)
+
+
+class RangeHeaderTest(SimpleTestCase):
+
+    def test_single_range(self):
+        self.assertEqual(parse_range_header("bytes=0-99", 10240), [(0, 100)])
+
+    def test_open_ended_range(self):
+        self.assertEqual(parse_range_header("bytes=100-", 10240),
+                         [(100, 10240)])
+
+    def test_suffix_range(self):
+        self.assertEqual(parse_range_header("bytes=-100", 10240),
+                         [(10140, 10240)])
+
+    def test_open_ended_past_end(self):
+        # A client resumes the download of a file it already has
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header("bytes=20000-", 10240)
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header("bytes=10240-", 10240)
+
+    def test_closed_range_past_end(self):
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header("bytes=20000-30000", 10240)
+
+    def test_some_ranges_past_end(self):
+        self.assertEqual(parse_range_header("bytes=0-9,20000-", 10240),
+                         [(0, 10)])
+
+    def test_invalid_header_ignored(self):
+        self.assertEqual(parse_range_header("bytes=100-50", 10240), [])
+        self.assertEqual(parse_range_header("items=0-10", 10240), [])
+        self.assertEqual(parse_range_header("bytes=10", 10240), [])
+
+
+class IconTest(SimpleTestCase):
+
+    def test_bundled_icon(self):
+        svg = radon_icons.render_icon("folder-fill", color="#428bca")
+        self.assertIn('fill="#428bca"', svg)
+        self.assertIn("bi-folder-fill", svg)
+
+    def test_missing_icon_not_kept(self):
+        self.assertEqual(radon_icons.render_icon("no-such-icon"),
+                         "Icon <no-such-icon> does not exist")
+        self.assertNotIn(("no-such-icon", None, None, None),
+                         radon_icons._rendered)
@@ -21,13 +21,19 @@ from django.conf.urls.static import static
 from django.views.generic import TemplateView
 from django.views.generic.base import RedirectView
 # 
-from project.views import home
+from project.views import (
+    home,
+    job,
+    job_status,
+)
 
 urlpatterns = [
     path("favicon.ico", RedirectView.as_view(url="/static/img/favicon.ico")),
     path("", home, name="home"),
     path("activity/", include("activity.urls", namespace="activity")),
     path("archive/", include("archive.urls", namespace="archive")),
+    path("jobs/<str:job_id>", job, name="job"),
+    path("jobs/<str:job_id>/status", job_status, name="job_status"),
     path("groups/", include("groups.urls", namespace="groups")),
     path("users/", include("users.urls", namespace="users")),
     path("about/", TemplateView.as_view(template_name="about.html"), name="about"),
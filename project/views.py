@@ -13,7 +13,23 @@
 # limitations under the License.
 
 from django.shortcuts import render, redirect
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, JsonResponse
+
+from project.jobs import get_job
+
+
+def get_user_job(request, job_id):
+    """Get the state of a job, only its owner and the administrators can
+    follow it"""
+    job = get_job(job_id)
+    if not job:
+        raise Http404()
+    if job["owner"] != request.user.login and not request.user.administrator:
+        raise Http404()
+    return job
+
 
 def home(request):
     """Main view for the radon web interface"""
@@ -24,3 +40,16 @@ def home(request):
     ):
         return redirect("archive:home")
     return render(request, "index.html", {})
+
+
+@login_required
+def job(request, job_id):
+    """Display the progress of a background job"""
+    return render(request, "job.html", {"job": get_user_job(request, job_id)})
+
+
+@login_required
+def job_status(request, job_id):
+    """Return the state of a background job as JSON, polled by the progress
+    page"""
+    return JsonResponse(get_user_job(request, job_id))
@@ -16,7 +16,15 @@ from django.urls import path
 from rest_framework.urlpatterns import format_suffix_patterns
 
 
-from rest_admin.views import authenticate, group, groups, user, users
+from rest_admin.views import (
+    authenticate,
+    bulk_metadata,
+    group,
+    groups,
+    job,
+    user,
+    users,
+)
 
 app_name = "rest_admin"
 
@@ -26,6 +34,8 @@ urlpatterns = [
     path("users", users),
     path("groups/<str:groupname>", group),
     path("groups", groups),
+    path("jobs/metadata", bulk_metadata),
+    path("jobs/<str:job_id>", job),
 #    path("", home),
 ]
 
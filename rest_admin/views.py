@@ -35,7 +35,15 @@ from rest_framework.status import (
     HTTP_409_CONFLICT,
 )
 
+from archive.bulk import (
+    METADATA_OPERATIONS,
+    TARGET_ALL,
+    TARGETS,
+    update_metadata,
+)
 from project.custom import CassandraAuthentication
+from project.acl import get_group_names, invalidate_group_names
+from project.jobs import get_job, submit
 
 from radon.model.group import Group
 from radon.model.user import User
@@ -97,6 +105,49 @@ def authenticate(request):
     return Response({"message": msg})
 
 
+@api_view(["POST"])
+@authentication_classes((CassandraAuthentication,))
+@permission_classes((IsAuthenticated,))
+def bulk_metadata(request):
+    """Start a background job which edits the metadata of several objects.
+    The body gives the paths of the objects, the operation (set, add,
+    remove) and the metadata, and optionally if the content of the
+    collections is included (recursive), the types of the objects
+    (targets), a pattern on the paths and a metadata filter (conditions)."""
+    try:
+        body = json.loads(request.body)
+        paths = body["paths"]
+        operation = body["operation"]
+        changes = body["metadata"]
+        recursive = body.get("recursive", True)
+        targets = body.get("targets", TARGET_ALL)
+        pattern = body.get("pattern") or None
+        conditions = body.get("conditions") or {}
+    except (TypeError, json.JSONDecodeError):
+        return Response(MSG_INVALID_JSON, status=HTTP_400_BAD_REQUEST)
+    except KeyError as exc:
+        return Response("Missing {}".format(exc), status=HTTP_400_BAD_REQUEST)
+    if (not isinstance(paths, list) or not paths or
+            not all(isinstance(path, str) and path.startswith("/") for path in paths)):
+        return Response("paths must be a list of absolute paths",
+                        status=HTTP_400_BAD_REQUEST)
+    if operation not in METADATA_OPERATIONS:
+        return Response("Unknown operation {}".format(operation),
+                        status=HTTP_400_BAD_REQUEST)
+    if not isinstance(changes, dict) or not changes:
+        return Response("metadata must be a non empty object",
+                        status=HTTP_400_BAD_REQUEST)
+    if targets not in TARGETS or not isinstance(conditions, dict):
+        return Response(MSG_INVALID_JSON, status=HTTP_400_BAD_REQUEST)
+
+    job = submit(
+        request.user.login, "metadata", "Metadata edit of {}".format(", ".join(paths)),
+        update_metadata, paths, bool(recursive), operation, changes,
+        request.user, targets, pattern, conditions,
+    )
+    return Response(job.to_dict(), status=HTTP_202_ACCEPTED)
+
+
 def create_group(request):
     """Expecting json in the body:
     { "groupname": groupname }
@@ -121,6 +172,8 @@ def create_group(request):
     notif = create_group_request(PayloadCreateGroupRequest(payload_json))
 
     resp = wait_response(notif.req_id)
+    # The list of the groups is also refreshed by the notification
+    invalidate_group_names()
 
     if resp == 0:
         new_group_db = Group.find(groupname)
@@ -205,6 +258,8 @@ def delete_group(request, groupname):
 
     notif = delete_group_request(PayloadDeleteGroupRequest(payload_json))
     resp = wait_response(notif.req_id)
+    # The list of the groups is also refreshed by the notification
+    invalidate_group_names()
 
     if resp == 0:
         return Response("Group {} has been deleted".format(groupname), status=HTTP_200_OK)
@@ -269,7 +324,7 @@ def group(request, groupname):
 def groups(request):
     """REST calls to manage groups"""
     if request.method == "GET":
-        return Response([u.name for u in Group.objects.all()])
+        return Response(get_group_names())
     elif request.method == "POST":
         if request.user and request.user.administrator:
             return create_group(request)
@@ -279,6 +334,18 @@ def groups(request):
         return Response(MSG_METH_NOT_ALLOWED, status=HTTP_405_METHOD_NOT_ALLOWED)
 
 
+@api_view(["GET"])
+@authentication_classes((CassandraAuthentication,))
+@permission_classes((IsAuthenticated,))
+def job(request, job_id):
+    """Get the progress of a background job"""
+    state = get_job(job_id)
+    if (not state or
+            (state["owner"] != request.user.login and not request.user.administrator)):
+        return Response(u"Job {} not found".format(job_id), status=HTTP_404_NOT_FOUND)
+    return Response(state)
+
+
 def ls_group(groupname):
     """Get a list of groups"""
     group_db = Group.find(groupname)
@@ -62,6 +62,11 @@ from radon.util import (
 ) 
 from radon.model.errors import ResourceConflictError
 from project.custom import CassandraAuthentication
+from project.acl import user_can
+from project.ranges import (
+    RangeNotSatisfiable,
+    parse_range_header,
+)
 from radon.model.notification import (
     create_collection_request,
     create_resource_request,
@@ -291,7 +296,7 @@ class CDMIView(APIView):
         if not collection:
             self.logger.info(u"Fail to delete collection at '{}'".format(path))
             return Response(status=HTTP_404_NOT_FOUND)
-        if not collection.user_can(self.user, "delete"):
+        if not user_can(collection, self.user, "delete"):
             self.logger.warning(
                 u"User {} tried to delete container '{}'".format(self.user, path)
             )
@@ -330,7 +335,7 @@ class CDMIView(APIView):
             else:
                 self.logger.info(u"Fail to delete resource at '{}'".format(path))
                 return Response(status=HTTP_404_NOT_FOUND)
-        if not resource.user_can(self.user, "delete"):
+        if not user_can(resource, self.user, "delete"):
             self.logger.warning(
                 u"User {} tried to delete resource '{}'".format(self.user, path)
             )
@@ -398,7 +403,7 @@ class CDMIView(APIView):
         
         # Update Collection
         if collection:
-            if not collection.user_can(self.user, "edit"):
+            if not user_can(collection, self.user, "edit"):
                 self.logger.warning(
                     "User {} tried to modify collection at '{}'".format(
                         self.user, path
@@ -430,7 +435,7 @@ class CDMIView(APIView):
             )
             return Response(status=HTTP_404_NOT_FOUND)
         # Check if user can create a new collection in the collection
-        if not parent_collection.user_can(self.user, "write"):
+        if not user_can(parent_collection, self.user, "write"):
             self.logger.warning(
                 "User {} tried to create new collection at '{}'".format(
                     self.user, path
@@ -584,7 +589,7 @@ class CDMIView(APIView):
         # Check permissions
         if resource:
             # Update Resource, check we can edit it
-            if not resource.user_can(self.user, "edit"):
+            if not user_can(resource, self.user, "edit"):
                 self.logger.warning(
                     "User {} tried to modify resource at '{}'".format(self.user, path)
                 )
@@ -603,7 +608,7 @@ class CDMIView(APIView):
                 )
                 return Response(status=HTTP_404_NOT_FOUND)
             # Check if user can create a new resource in the collection
-            if not parent_collection.user_can(self.user, "write"):
+            if not user_can(parent_collection, self.user, "write"):
                 self.logger.warning(
                     "User {} tried to create new resource at '{}'".format(
                         self.user, path
@@ -671,7 +676,7 @@ class CDMIView(APIView):
         if resource:
             # Update Resource
             # Check permissions
-            if not resource.user_can(self.user, "edit"):
+            if not user_can(resource, self.user, "edit"):
                 self.logger.warning(
                     "User {} tried to modify resource at '{}'".format(self.user, path)
                 )
@@ -691,7 +696,7 @@ class CDMIView(APIView):
                 )
                 return Response(status=HTTP_404_NOT_FOUND)
             # Check if user can create a new resource in the collection
-            if not parent_collection.user_can(self.user, "write"):
+            if not user_can(parent_collection, self.user, "write"):
                 self.logger.warning(
                     "User {} tried to create new resource at '{}'".format(
                         self.user, path
@@ -709,7 +714,7 @@ class CDMIView(APIView):
         if not collection:
             self.logger.info(u"Fail to read a collection at '{}'".format(path))
             return Response(status=HTTP_404_NOT_FOUND)
-        if not collection.user_can(self.user, "read"):
+        if not user_can(collection, self.user, "read"):
             self.logger.warning(
                 u"User {} tried to read container at '{}'".format(self.user, path)
             )
@@ -800,7 +805,7 @@ class CDMIView(APIView):
             else:
                 self.logger.info(u"Fail to read a resource at '{}'".format(path))
                 return Response(status=HTTP_404_NOT_FOUND)
-        if not resource.user_can(self.user, "read"):
+        if not user_can(resource, self.user, "read"):
             self.logger.warning(
                 u"User {} tried to read resource at '{}'".format(self.user, path)
             )
@@ -893,7 +898,10 @@ class CDMIView(APIView):
         if "HTTP_RANGE" in self.request.META:
             # Use range header
             specifier = self.request.META.get("HTTP_RANGE", "")
-            http_range = parse_range_header(specifier, cdmi_resource.get_length())
+            try:
+                http_range = parse_range_header(specifier, cdmi_resource.get_length())
+            except RangeNotSatisfiable:
+                http_range = []
             if not http_range:
                 self.logger.error(
                     u"Range header parsing failed '{}' for resource '{}'".format(
@@ -1087,44 +1095,3 @@ def crud_id(request, obj_id):
             return redirect("rest_cdmi:api_cdmi", path=resource.path())
         else:
             return Response(status=HTTP_404_NOT_FOUND)
-
-
-def parse_range_header(specifier, len_content):
-    """Parses a range header into a list of pairs (start, stop)"""
-    if not specifier or "=" not in specifier:
-        return []
-
-    ranges = []
-    unit, byte_set = specifier.split("=", 1)
-    unit = unit.strip().lower()
-
-    if unit != "bytes":
-        return []
-
-    for val in byte_set.split(","):
-        val = val.strip()
-        if "-" not in val:
-            return []
-
-        if val.startswith("-"):
-            # suffix-byte-range-spec: this form specifies the last N
-            # bytes of an entity-body
-            start = len_content + int(val)
-            if start < 0:
-                start = 0
-            stop = len_content
-        else:
-            # byte-range-spec: first-byte-pos "-" [last-byte-pos]
-            start, stop = val.split("-", 1)
-            start = int(start)
-            # Add 1 to make stop exclusive (HTTP spec is inclusive)
-            stop = int(stop) + 1 if stop else len_content
-            if start >= stop:
-                return []
-
-        ranges.append((start, stop))
-
-    return ranges
-
-
-